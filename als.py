@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Runs in the suggestion worker process (see suggest.py), so it only depends on NumPy.
+
+
+def _groups(index: np.ndarray, count: int) -> List[np.ndarray]:
+    order = np.argsort(index, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(index, minlength=count))[:-1])
+
+
+# One half-step of alternating least squares: with `fixed` held still, solves each row of
+# `solving` for the ratings (offsets from the mean) it takes part in
+def _solve(solving: np.ndarray, fixed: np.ndarray, groups: List[np.ndarray], other: np.ndarray, ratings: np.ndarray, reg: float):
+    identity = np.eye(solving.shape[1])
+    for i, rows in enumerate(groups):
+        if not len(rows):
+            continue
+        factors = fixed[other[rows]]
+        solving[i] = np.linalg.solve(
+            factors.T @ factors + reg * len(rows) * identity,
+            factors.T @ ratings[rows],
+        )
+
+
+# A trained rater x song model, kept as its two factor matrices rather than the dense matrix
+# of predictions they multiply out to: a rater's predictions are computed when asked for.
+@dataclass
+class Model:
+    rater_ids: np.ndarray
+    song_ids: np.ndarray
+    rater_factors: np.ndarray
+    song_factors: np.ndarray
+    mean: float
+    # The song indexes rater i has rated are rated_songs[rated_offsets[i]:rated_offsets[i + 1]]
+    rated_offsets: np.ndarray
+    rated_songs: np.ndarray
+
+    # The `n` songs the rater has not rated with the highest predicted rating, best first, as
+    # song ids and predictions; None if the rater has no ratings in the model
+    def top(self, rater_id: int, n: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        i = np.searchsorted(self.rater_ids, rater_id)
+        if i == len(self.rater_ids) or self.rater_ids[i] != rater_id:
+            return None
+        predictions = self.song_factors @ self.rater_factors[i] + self.mean
+        predictions[self.rated_songs[self.rated_offsets[i]:self.rated_offsets[i + 1]]] = -np.inf
+        n = min(n, len(predictions))
+        top = np.argpartition(-predictions, n - 1)[:n]
+        top = top[np.argsort(-predictions[top])]
+        return self.song_ids[top], predictions[top]
+
+
+# Explicit-feedback matrix factorization of one rater x song matrix
+def factorize(
+    raters: np.ndarray,
+    songs: np.ndarray,
+    ratings: np.ndarray,
+    factors: int = 16,
+    reg: float = 0.1,
+    iterations: int = 10,
+    seed: int = 0,
+) -> Model:
+    rater_ids, rater_index = np.unique(raters, return_inverse=True)
+    song_ids, song_index = np.unique(songs, return_inverse=True)
+    mean = ratings.mean()
+    offsets = ratings - mean
+    rng = np.random.default_rng(seed)
+    rater_factors = rng.normal(scale=0.1, size=(len(rater_ids), factors))
+    song_factors = rng.normal(scale=0.1, size=(len(song_ids), factors))
+    by_rater = _groups(rater_index, len(rater_ids))
+    by_song = _groups(song_index, len(song_ids))
+    for _ in range(iterations):
+        _solve(rater_factors, song_factors, by_rater, song_index, offsets, reg)
+        _solve(song_factors, rater_factors, by_song, rater_index, offsets, reg)
+    return Model(
+        rater_ids=rater_ids,
+        song_ids=song_ids,
+        rater_factors=rater_factors,
+        song_factors=song_factors,
+        mean=float(mean),
+        rated_offsets=np.concatenate(([0], np.cumsum([len(rows) for rows in by_rater]))),
+        rated_songs=song_index[np.concatenate(by_rater)],
+    )
+
+
+# Factorizes each guild's ratings separately, so suggestions only ever come from songs shared
+# in the same guild. `columns` are Analytics columns.
+def train(columns: Dict[str, np.ndarray], **options) -> Dict[int, Model]:
+    models = {}
+    for guild_id in np.unique(columns["guild"]):
+        mask = columns["guild"] == guild_id
+        models[int(guild_id)] = factorize(
+            columns["rater"][mask], columns["song"][mask], columns["rating"][mask], **options
+        )
+    return models
@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.recommendation import Recommendation
+from models.song import Song
+
+COLUMNS = ("rater", "suggester", "guild", "song", "rating", "epoch")
+_DTYPES = {
+    "rater": np.int64,
+    "suggester": np.int64,
+    "guild": np.int64,
+    "song": np.int64,
+    "rating": np.float64,
+    "epoch": np.float64,
+}
+
+
+def _epoch(timestamp) -> float:
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        return np.nan
+
+
+# Every closed recommendation as NumPy columns (see COLUMNS), so stats over any slice of the
+# ratings are a few vectorized operations instead of a query each. Built from SQL by DB.setup
+# and updated by DB alongside the Leaderboard on every rating event. Rows are appended into
+# spare capacity, and removed rows are masked out of `live` until the next compaction.
+@dataclass
+class Analytics:
+    columns: Dict[str, np.ndarray] = None
+    live: np.ndarray = None
+    size: int = 0
+    # Masked rows below `size`, compacted away once they outnumber the live ones
+    dead: int = 0
+    # The live rows of each rec, keyed as DB identifies a rec: (guild, rater, suggester, song)
+    rows: Dict[Tuple[int, int, int, int], List[int]] = None
+    # Songs are numbered in the order they are first seen. Keys are casefolded, as the song
+    # columns are COLLATE NOCASE.
+    song_ids: Dict[Tuple[str, str], int] = None
+    songs: List[Song] = None
+
+    @classmethod
+    def _song_id(cls, name: str, artist: str) -> int:
+        key = (name.casefold(), artist.casefold())
+        song_id = cls.song_ids.get(key)
+        if song_id is None:
+            song_id = cls.song_ids[key] = len(cls.songs)
+            cls.songs.append(Song.of(name, artist))
+        return song_id
+
+    @staticmethod
+    def _key(rec: Recommendation, song_id: int) -> Tuple[int, int, int, int]:
+        return (rec.guild.discord_id, rec.rater.discord_id, rec.suggester.discord_id, song_id)
+
+    # Moves the live rows to the front, in order, and renumbers them in `rows`
+    @classmethod
+    def _compact(cls):
+        live = cls.live[:cls.size]
+        positions = np.cumsum(live) - 1
+        for name, column in cls.columns.items():
+            kept = column[:cls.size][live]
+            column[:len(kept)] = kept
+        cls.size -= cls.dead
+        cls.dead = 0
+        cls.live[:cls.size] = True
+        cls.live[cls.size:] = False
+        for key, rows in cls.rows.items():
+            cls.rows[key] = [int(positions[row]) for row in rows]
+
+    @classmethod
+    def _reserve(cls, capacity: int):
+        if cls.dead > cls.size - cls.dead:
+            capacity -= cls.dead
+            cls._compact()
+        if capacity <= len(cls.live):
+            return
+        capacity = max(capacity, 2 * len(cls.live), 1024)
+        for name, column in cls.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:cls.size] = column[:cls.size]
+            cls.columns[name] = grown
+        live = np.zeros(capacity, dtype=bool)
+        live[:cls.size] = cls.live[:cls.size]
+        cls.live = live
+
+    # rows are closed recommendation rows, in schema order (see Recommendation.parse_tuple)
+    @classmethod
+    def load(cls, rows: Sequence[Tuple]):
+        cls.song_ids = {}
+        cls.songs = []
+        cls.size = 0
+        cls.dead = 0
+        cls.rows = {}
+        cls.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in _DTYPES.items()}
+        cls.live = np.zeros(0, dtype=bool)
+        cls._reserve(len(rows))
+        count = len(rows)
+        song_ids = np.fromiter((cls._song_id(row[0], row[1]) for row in rows), np.int64, count)
+        for i, (row, song_id) in enumerate(zip(rows, song_ids.tolist())):
+            cls.rows.setdefault((row[4], row[2], row[3], song_id), []).append(i)
+        cls.columns["rater"][:count] = np.fromiter((row[2] for row in rows), np.int64, count)
+        cls.columns["suggester"][:count] = np.fromiter((row[3] for row in rows), np.int64, count)
+        cls.columns["guild"][:count] = np.fromiter((row[4] for row in rows), np.int64, count)
+        cls.columns["song"][:count] = song_ids
+        cls.columns["rating"][:count] = np.fromiter((row[6] for row in rows), np.float64, count)
+        cls.columns["epoch"][:count] = np.fromiter((_epoch(row[5]) for row in rows), np.float64, count)
+        cls.size = count
+        cls.live[:cls.size] = True
+
+    @classmethod
+    def add(cls, rec: Recommendation, rating: float):
+        cls._reserve(cls.size + 1)
+        i = cls.size
+        song_id = cls._song_id(rec.song.name, rec.song.artist)
+        cls.rows.setdefault(cls._key(rec, song_id), []).append(i)
+        cls.columns["rater"][i] = rec.rater.discord_id
+        cls.columns["suggester"][i] = rec.suggester.discord_id
+        cls.columns["guild"][i] = rec.guild.discord_id
+        cls.columns["song"][i] = song_id
+        cls.columns["rating"][i] = rating
+        cls.columns["epoch"][i] = _epoch(rec.timestamp)
+        cls.live[i] = True
+        cls.size += 1
+
+    # Drops one live row for this rec with the given rating
+    @classmethod
+    def remove(cls, rec: Recommendation, rating: float):
+        song_id = cls.song_ids.get((rec.song.name.casefold(), rec.song.artist.casefold()))
+        if song_id is None:
+            return
+        key = cls._key(rec, song_id)
+        rows = cls.rows.get(key, [])
+        for i in range(len(rows) - 1, -1, -1):
+            if cls.columns["rating"][rows[i]] == rating:
+                cls.live[rows.pop(i)] = False
+                cls.dead += 1
+                break
+        if not rows:
+            cls.rows.pop(key, None)
+
+    # The live rows, optionally narrowed to a guild, rater and/or suggester id
+    @classmethod
+    def select(
+        cls,
+        guild: Optional[int] = None,
+        rater: Optional[int] = None,
+        suggester: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        mask = cls.live[:cls.size].copy()
+        for name, value in (("guild", guild), ("rater", rater), ("suggester", suggester)):
+            if value is not None:
+                mask &= cls.columns[name][:cls.size] == value
+        return {name: column[:cls.size][mask] for name, column in cls.columns.items()}
+
+    # One value of `metric` per distinct value of column `by`, as (keys, values) arrays
+    @classmethod
+    def group_by(cls, by: str, metric: str, **filters) -> Tuple[np.ndarray, np.ndarray]:
+        rows = cls.select(**filters)
+        keys, groups = np.unique(rows[by], return_inverse=True)
+        ratings = rows["rating"]
+        match metric:
+            case "count":
+                values = np.bincount(groups, minlength=len(keys)).astype(np.float64)
+            case "total":
+                values = np.bincount(groups, weights=ratings, minlength=len(keys))
+            case "average":
+                values = np.bincount(groups, weights=ratings, minlength=len(keys)) / np.bincount(groups, minlength=len(keys))
+            case "max":
+                values = np.full(len(keys), -np.inf)
+                np.maximum.at(values, groups, ratings)
+            case _:
+                raise ValueError(f"Unknown metric {metric}")
+        return keys, values
+
+    # How many ratings fell in each whole point from 1 to 10
+    @classmethod
+    def distribution(cls, **filters) -> np.ndarray:
+        ratings = cls.select(**filters)["rating"]
+        buckets = np.clip(np.floor(ratings), 1, 10).astype(np.int64)
+        return np.bincount(buckets, minlength=11)[1:]
+
+    @classmethod
+    def percentiles(cls, q: Sequence[float] = (25, 50, 75, 90), **filters) -> np.ndarray:
+        ratings = cls.select(**filters)["rating"]
+        if not len(ratings):
+            return np.full(len(q), np.nan)
+        return np.percentile(ratings, q)
+
+    # `metric` of the ratings each rater (rows) gave each suggester (columns), NaN where a pair
+    # has none. Returns the user ids both axes are indexed by, and the matrix.
+    @classmethod
+    def pair_matrix(cls, metric: str = "average", guild: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        rows = cls.select(guild=guild)
+        users, index = np.unique(np.concatenate((rows["rater"], rows["suggester"])), return_inverse=True)
+        raters, suggesters = index[:len(rows["rater"])], index[len(rows["rater"]):]
+        cells = raters * len(users) + suggesters
+        counts = np.bincount(cells, minlength=len(users) ** 2).astype(np.float64)
+        match metric:
+            case "count":
+                matrix = counts
+            case "total":
+                matrix = np.bincount(cells, weights=rows["rating"], minlength=len(users) ** 2)
+            case "average":
+                with np.errstate(invalid="ignore"):
+                    matrix = np.bincount(cells, weights=rows["rating"], minlength=len(users) ** 2) / counts
+            case "max":
+                matrix = np.full(len(users) ** 2, -np.inf)
+                np.maximum.at(matrix, cells, rows["rating"])
+            case _:
+                raise ValueError(f"Unknown metric {metric}")
+        matrix = np.where(counts > 0, matrix, np.nan)
+        return users, matrix.reshape(len(users), len(users))
@@ -0,0 +1,381 @@
+"""Benchmarks every public DB method against generated data of several sizes.
+
+    python bench.py --sizes 1000 10000 100000 --output bench.json
+    python bench.py --sizes 1000 10000 100000 --baseline bench.json
+
+Data is generated deterministically from --seed, so runs on the same machine are comparable.
+Results (timings plus the query plan of every statement each method ran) are written as JSON.
+With --baseline, methods that got slower than --threshold times their baseline median, or whose
+query plans changed, are reported and the exit code is 1.
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from db import DB
+from leaderboard import Leaderboard
+from migrations import migrate
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, Role, Thread, User
+from models.song import Song
+
+
+@dataclass
+class Dataset:
+    guilds: List[int]
+    users: List[int]
+    threads: List[Thread]
+    songs: List[Song]
+    # Busiest raters, suggesters and pairs first, so lookups are benchmarked at their worst
+    raters: List[int]
+    suggesters: List[int]
+    pairs: List[tuple]
+    rated_songs: Dict[tuple, List[Song]]
+
+
+# Fills a fresh database at `path` with `recs` recommendations between `users` users, in
+# threads spread across `guilds` guilds. About one in fifty recs is left open.
+def generate(path: str, recs: int, guilds: int, users: int, seed: int) -> Dataset:
+    rng = random.Random(seed)
+    guild_ids = [1000 + i for i in range(guilds)]
+    user_ids = [10_000 + i for i in range(users)]
+    song_count = max(50, recs // 8)
+    songs = [Song(f"song {i}", f"artist {i % max(10, song_count // 20)}") for i in range(song_count)]
+    threads = []
+    seen = set()
+    thread_count = max(1, min(users * 2, users * (users - 1) // 2))
+    while len(threads) < thread_count:
+        a, b = rng.sample(user_ids, 2)
+        if (a, b) in seen or (b, a) in seen:
+            continue
+        seen.add((a, b))
+        threads.append(Thread(
+            thread_id=100_000 + len(threads),
+            guild=Guild(rng.choice(guild_ids)),
+            user1=User(a),
+            user2=User(b),
+            next_user=User(rng.choice((a, b))),
+        ))
+
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode = WAL')
+    migrate(con)
+    con.execute('BEGIN')
+    con.executemany('''INSERT INTO user VALUES(?)''', ((user_id,) for user_id in user_ids))
+    con.executemany('''INSERT INTO guild VALUES(?)''', ((guild_id,) for guild_id in guild_ids))
+    con.executemany('''INSERT INTO song VALUES(?, ?)''', ((song.name, song.artist) for song in songs))
+    con.executemany('''INSERT INTO thread VALUES(?, ?, ?, ?, ?)''', (
+        (t.thread_id, t.guild.discord_id, t.user1.discord_id, t.user2.discord_id, t.next_user.discord_id)
+        for t in threads
+    ))
+    raters: Dict[int, int] = {}
+    suggesters: Dict[int, int] = {}
+    pairs: Dict[tuple, int] = {}
+    rated_songs: Dict[tuple, List[Song]] = {}
+    start = datetime(2022, 1, 1)
+
+    def rows():
+        for i in range(recs):
+            thread = rng.choice(threads)
+            rater, suggester = (thread.user1, thread.user2) if rng.random() < 0.5 else (thread.user2, thread.user1)
+            song = rng.choice(songs)
+            is_closed = rng.random() >= 0.02
+            rating = rng.randint(2, 20) / 2 if is_closed else -1
+            if is_closed:
+                raters[rater.discord_id] = raters.get(rater.discord_id, 0) + 1
+                suggesters[suggester.discord_id] = suggesters.get(suggester.discord_id, 0) + 1
+                pair = (rater.discord_id, suggester.discord_id)
+                pairs[pair] = pairs.get(pair, 0) + 1
+                rated_songs.setdefault(pair, []).append(song)
+            yield (
+                song.name, song.artist, rater.discord_id, suggester.discord_id, thread.guild.discord_id,
+                (start + timedelta(minutes=i)).isoformat(" "), rating, int(is_closed),
+            )
+
+    con.executemany('''INSERT INTO recommendation VALUES(?, ?, ?, ?, ?, ?, ?, ?)''', rows())
+    con.commit()
+    con.execute('ANALYZE')
+    con.close()
+
+    def busiest(counts: Dict) -> List:
+        return sorted(counts, key=lambda key: -counts[key])
+
+    return Dataset(
+        guilds=guild_ids,
+        users=user_ids,
+        threads=threads,
+        songs=songs,
+        raters=busiest(raters),
+        suggesters=busiest(suggesters),
+        pairs=busiest(pairs),
+        rated_songs=rated_songs,
+    )
+
+
+@dataclass
+class Case:
+    name: str
+    # Called with the iteration number; only this is timed
+    run: Callable[[int], Awaitable[Any]]
+    # Untimed setup for an iteration, e.g. opening the rec that `run` closes
+    prepare: Optional[Callable[[int], Awaitable[Any]]] = None
+
+
+async def drain(iterator) -> int:
+    count = 0
+    async for _ in iterator:
+        count += 1
+    return count
+
+
+def build_cases(data: Dataset) -> List[Case]:
+    guild = Guild(data.guilds[0])
+    rater, suggester = User(data.pairs[0][0]), User(data.pairs[0][1])
+    busiest_rater, busiest_suggester = User(data.raters[0]), User(data.suggesters[0])
+    thread = data.threads[0]
+    song = data.rated_songs[data.pairs[0]][0]
+    typo = Song(song.name.replace("song", "sogn"), song.artist)
+    new_user = User(1)
+    # Writes use users and songs of their own, so repeated iterations never collide
+    def bench_rec(i: int, **kwargs) -> Recommendation:
+        return Recommendation(
+            song=Song(f"bench song {i}", "bench artist"),
+            rater=new_user,
+            suggester=busiest_suggester,
+            guild=guild,
+            timestamp=datetime.now(),
+            **kwargs
+        )
+    def bench_thread(i: int) -> Thread:
+        return Thread(
+            thread_id=10 ** 9 + i, guild=guild, user1=new_user, user2=busiest_suggester, next_user=new_user
+        )
+    page_cursor = {}
+
+    async def next_page(i: int):
+        page = await DB.get_ratings_page_by_pair(rater, suggester, cursor=page_cursor.get("last"))
+        page_cursor["last"] = page.last if page.has_older else None
+
+    async def rerate(i: int):
+        rec = (await DB.get_ratings_by_song_and_pair(song, rater, suggester))[0]
+        rec.rating = 1 + i % 10
+        await DB._close_rec(rec)
+
+    async def transaction(i: int):
+        async with DB.transaction():
+            await DB.flip_thread(thread)
+            await DB.create_open_rec(bench_rec(i + 2_000_000))
+
+    return [
+        Case("get_mod_roles", lambda i: asyncio.to_thread(DB.get_mod_roles)),
+        Case("create_mod_role", lambda i: DB.create_mod_role(Role(10 ** 9 + i), guild)),
+        Case("remove_mod_role", lambda i: DB.remove_mod_role(Role(2 * 10 ** 9 + i)),
+             prepare=lambda i: DB.create_mod_role(Role(2 * 10 ** 9 + i), guild)),
+        Case("get_threads_by_guild", lambda i: DB.get_threads_by_guild(guild)),
+        Case("iter_threads_by_guild", lambda i: drain(DB.iter_threads_by_guild(guild))),
+        Case("does_thread_have_open_rec", lambda i: DB.does_thread_have_open_rec(thread)),
+        Case("get_open_rating_by_thread", lambda i: DB.get_open_rating_by_thread(thread)),
+        Case("create_open_rec", lambda i: DB.create_open_rec(bench_rec(i))),
+        Case("close_rec", lambda i: DB.close_rec(bench_rec(i + 1_000_000, rating=7)),
+             prepare=lambda i: DB.create_open_rec(bench_rec(i + 1_000_000))),
+        Case("add_rating_manual", lambda i: DB.add_rating_manual(bench_rec(i + 3_000_000, rating=5, is_closed=True))),
+        Case("_close_rec", rerate),
+        Case("_delete_rec", lambda i: DB._delete_rec(bench_rec(i + 4_000_000)),
+             prepare=lambda i: DB.add_rating_manual(bench_rec(i + 4_000_000, rating=5, is_closed=True))),
+        Case("transaction", transaction),
+        Case("create_thread", lambda i: DB.create_thread(bench_thread(i))),
+        Case("delink_thread", lambda i: DB.delink_thread(bench_thread(i + 1_000_000)),
+             prepare=lambda i: DB.create_thread(bench_thread(i + 1_000_000))),
+        Case("get_thread_by_id", lambda i: DB.get_thread_by_id(thread.thread_id)),
+        Case("flip_thread", lambda i: DB.flip_thread(thread)),
+        Case("get_waiting_threads_by_user", lambda i: DB.get_waiting_threads_by_user(busiest_rater, guild)),
+        Case("get_ratings_by_suggester", lambda i: DB.get_ratings_by_suggester(busiest_suggester)),
+        Case("iter_ratings_by_suggester", lambda i: drain(DB.iter_ratings_by_suggester(busiest_suggester))),
+        Case("get_ratings_by_rater", lambda i: DB.get_ratings_by_rater(busiest_rater)),
+        Case("iter_ratings_by_rater", lambda i: drain(DB.iter_ratings_by_rater(busiest_rater))),
+        Case("get_open_recs_by_rater", lambda i: DB.get_open_recs_by_rater(busiest_rater)),
+        Case("get_ratings_by_song", lambda i: DB.get_ratings_by_song(song)),
+        Case("get_ratings_by_song_and_pair", lambda i: DB.get_ratings_by_song_and_pair(song, rater, suggester)),
+        Case("search_ratings_by_song_and_pair", lambda i: DB.search_ratings_by_song_and_pair(typo, rater, suggester)),
+        Case("get_ratings_by_artist", lambda i: DB.get_ratings_by_artist(song.artist)),
+        Case("iter_ratings_by_artist", lambda i: drain(DB.iter_ratings_by_artist(song.artist))),
+        Case("get_ratings_by_pair", lambda i: DB.get_ratings_by_pair(rater, suggester)),
+        Case("iter_ratings_by_pair", lambda i: drain(DB.iter_ratings_by_pair(rater, suggester))),
+        Case("get_ratings_page_by_pair", next_page),
+        Case("get_overlap", lambda i: DB.get_overlap(rater, suggester)),
+        Case("get_max_rating", lambda i: DB.get_max_rating(busiest_suggester)),
+        Case("get_max_rating(pair)", lambda i: DB.get_max_rating(suggester, rater)),
+        Case("get_average_rating", lambda i: DB.get_average_rating(busiest_suggester)),
+        Case("get_average_rating(pair)", lambda i: DB.get_average_rating(suggester, rater)),
+        Case("get_total_rating", lambda i: DB.get_total_rating(busiest_suggester)),
+        Case("get_total_rating(pair)", lambda i: DB.get_total_rating(suggester, rater)),
+        Case("get_max_ratings", lambda i: DB.get_max_ratings()),
+        Case("get_max_ratings(rater)", lambda i: DB.get_max_ratings(busiest_rater)),
+        Case("get_ratings_by_suggester_and_rating",
+             lambda i: DB.get_ratings_by_suggester_and_rating(Leaderboard.top("max", k=None))),
+        Case("get_ratings_by_suggester_and_rating(rater)",
+             lambda i: DB.get_ratings_by_suggester_and_rating(
+                 Leaderboard.top("max", k=None, rater=busiest_rater), busiest_rater)),
+        Case("get_average_ratings", lambda i: DB.get_average_ratings()),
+        Case("get_average_ratings(rater)", lambda i: DB.get_average_ratings(busiest_rater)),
+        Case("get_total_ratings", lambda i: DB.get_total_ratings()),
+        Case("get_total_ratings(rater)", lambda i: DB.get_total_ratings(busiest_rater)),
+    ]
+
+
+# Records the SQL every DB connection runs, so each method's statements can be explained
+class StatementRecorder:
+    ignored = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements: List[str] = []
+        self.recording = False
+
+    def record(self, sql: str):
+        if self.recording and not sql.lstrip().upper().startswith(self.ignored):
+            with self.lock:
+                if sql not in self.statements:
+                    self.statements.append(sql)
+
+    def attach(self):
+        # Start every reader thread, so each has opened its connection
+        workers = DB.readers._max_workers
+        barrier = threading.Barrier(workers)
+        for future in [DB.readers.submit(barrier.wait) for _ in range(workers)]:
+            future.result()
+        for con in [DB.con, *DB._reader_cons]:
+            con.set_trace_callback(self.record)
+
+    def plans(self, path: str) -> List[Dict[str, Any]]:
+        con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            plans = []
+            for sql in self.statements:
+                try:
+                    details = [row[3] for row in con.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                except sqlite3.Error as e:
+                    details = [f"error: {e}"]
+                plans.append({"sql": " ".join(sql.split()), "plan": details})
+            return plans
+        finally:
+            con.close()
+
+
+async def bench_size(size: int, args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    path = os.path.join(directory, f"bench-{size}.db")
+    started = time.perf_counter()
+    data = generate(path, size, args.guilds, args.users, args.seed)
+    generated = time.perf_counter() - started
+    DB.path = path
+    started = time.perf_counter()
+    DB.setup()
+    loaded = time.perf_counter() - started
+    print(f"{size} recs: generated in {generated:.1f}s, DB.setup took {loaded * 1000:.1f}ms", file=sys.stderr)
+    results = [{"size": size, "method": "setup", "runs": 1, "median_ms": loaded * 1000, "plans": []}]
+    recorder = StatementRecorder()
+    recorder.attach()
+    try:
+        for case in build_cases(data):
+            timings = []
+            for i in range(args.warmup + args.runs):
+                if case.prepare is not None:
+                    await case.prepare(i)
+                recorder.recording = i == 0
+                started = time.perf_counter()
+                await case.run(i)
+                elapsed = time.perf_counter() - started
+                recorder.recording = False
+                if i >= args.warmup:
+                    timings.append(elapsed * 1000)
+            timings.sort()
+            results.append({
+                "size": size,
+                "method": case.name,
+                "runs": len(timings),
+                "min_ms": timings[0],
+                "median_ms": statistics.median(timings),
+                "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                "mean_ms": statistics.fmean(timings),
+                "plans": recorder.plans(path),
+            })
+            recorder.statements = []
+            print(f"  {case.name:<34} {results[-1]['median_ms']:9.3f}ms", file=sys.stderr)
+    finally:
+        DB.close()
+    return results
+
+
+# Regressions against a previous run, as human readable lines
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    before = {(result["size"], result["method"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = before.get((result["size"], result["method"]))
+        if old is None:
+            continue
+        if result["median_ms"] > old["median_ms"] * threshold:
+            regressions.append(
+                f"{result['method']} at {result['size']} recs: median {old['median_ms']:.3f}ms -> {result['median_ms']:.3f}ms"
+            )
+        old_plans = [plan["plan"] for plan in old["plans"]]
+        new_plans = [plan["plan"] for plan in result["plans"]]
+        if old_plans != new_plans:
+            regressions.append(f"{result['method']} at {result['size']} recs: query plan changed")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            results += await bench_size(size, args, directory)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DB methods against generated data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="recommendations per run")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=20, help="timed iterations per method")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed iterations per method")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="a previous JSON report to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.5, help="slowdown factor that counts as a regression")
+    sys.exit(asyncio.run(main(parser.parse_args())))
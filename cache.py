@@ -1,23 +1,312 @@
-from typing import Dict, List, Tuple
-from dataclasses import dataclass
+import asyncio
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dataclasses import dataclass, field, replace
 
-from db import DB
-from models.snowflakes import Role
+from disnake import User as disnakeUser
+from disnake.ext import commands
 
+from models.recommendation import Recommendation
+from models.song import Song
+from models.snowflakes import Guild, Role, Thread, User
+
+# Moderator role ids per guild. Loaded by DB.setup and updated in place by DB.create_mod_role
+# and DB.remove_mod_role, so permission checks are a set lookup.
 @dataclass
 class RoleCache:
-    roles: Dict[int, List[Role]] = None
+    roles: Dict[int, Set[int]] = None
+    # Which guild each cached role belongs to, so a role can be removed by id alone
+    guilds: Dict[int, int] = None
 
     @classmethod
-    def refresh(cls):
-        rows: List[Tuple] = DB.get_mod_roles()
+    def load(cls, rows: List[Tuple]):
         cls.roles = {}
-        for row in rows:
-            role = Role(discord_id=row[0])
-            if row[1] not in cls.roles.keys():
-                cls.roles[row[1]] = []
-            cls.roles[row[1]].append(role)
-    
+        cls.guilds = {}
+        for role_id, guild_id in rows:
+            cls.add(Role(discord_id=role_id), Guild(discord_id=guild_id))
+
+    @classmethod
+    def add(cls, role: Role, guild: Guild):
+        cls.roles.setdefault(guild.discord_id, set()).add(role.discord_id)
+        cls.guilds[role.discord_id] = guild.discord_id
+
+    @classmethod
+    def remove(cls, role: Role):
+        guild_id = cls.guilds.pop(role.discord_id, None)
+        if guild_id is not None:
+            cls.roles[guild_id].discard(role.discord_id)
+
     @classmethod
     def fetch(cls, guild_id: int) -> List[Role]:
-        return cls.roles.get(guild_id, [])
\ No newline at end of file
+        return [Role(discord_id=role_id) for role_id in cls.roles.get(guild_id, ())]
+
+    @classmethod
+    def contains(cls, guild_id: int, role: Role) -> bool:
+        return role.discord_id in cls.roles.get(guild_id, ())
+
+    # Whether any of the given role ids is a moderator role in the guild
+    @classmethod
+    def has_any(cls, guild_id: int, role_ids: Iterable[int]) -> bool:
+        return not cls.roles.get(guild_id, set()).isdisjoint(role_ids)
+
+# Every linked thread, keyed by thread_id. Loaded by DB.setup and written through by DB on
+# create/flip/delink, so the registry always matches the thread table.
+# Callers get copies, as DB.flip_thread (and the cogs) mutate the Thread they are handed.
+@dataclass
+class ThreadCache:
+    threads: Dict[int, Thread] = None
+
+    @classmethod
+    def load(cls, threads: List[Thread]):
+        cls.threads = {thread.thread_id: thread for thread in threads}
+
+    @classmethod
+    def fetch(cls, thread_id: int) -> Optional[Thread]:
+        thread = cls.threads.get(thread_id)
+        return replace(thread) if thread is not None else None
+
+    @classmethod
+    def put(cls, thread: Thread):
+        cls.threads[thread.thread_id] = replace(thread)
+
+    @classmethod
+    def flip(cls, thread: Thread):
+        # Only threads that are still linked are updated
+        if thread.thread_id in cls.threads:
+            cls.put(thread)
+
+    @classmethod
+    def remove(cls, thread_id: int):
+        cls.threads.pop(thread_id, None)
+
+# The open recommendation (if any) between each rater and suggester, keyed by their ids.
+# Loaded by DB.setup and written through by DB on create_open_rec, close_rec and _delete_rec.
+@dataclass
+class OpenRecCache:
+    recs: Dict[Tuple[int, int], Recommendation] = None
+
+    @staticmethod
+    def _key(rater: User, suggester: User) -> Tuple[int, int]:
+        return (rater.discord_id, suggester.discord_id)
+
+    @staticmethod
+    def _same_rec(a: Recommendation, b: Recommendation) -> bool:
+        # Song columns are COLLATE NOCASE, so match them the same way
+        return (
+            a.song.name.casefold() == b.song.name.casefold()
+            and a.song.artist.casefold() == b.song.artist.casefold()
+            and a.guild == b.guild
+        )
+
+    @classmethod
+    def load(cls, recs: List[Recommendation]):
+        cls.recs = {}
+        for rec in recs:
+            cls.recs.setdefault(cls._key(rec.rater, rec.suggester), rec)
+
+    @classmethod
+    def fetch(cls, rater: User, suggester: User) -> Optional[Recommendation]:
+        rec = cls.recs.get(cls._key(rater, suggester))
+        return replace(rec) if rec is not None else None
+
+    @classmethod
+    def put(cls, rec: Recommendation):
+        cls.recs[cls._key(rec.rater, rec.suggester)] = replace(rec)
+
+    # Drops the cached open rec if it is the one that was just closed or deleted
+    @classmethod
+    def discard(cls, rec: Recommendation):
+        key = cls._key(rec.rater, rec.suggester)
+        cached = cls.recs.get(key)
+        if cached is not None and cls._same_rec(cached, rec):
+            del cls.recs[key]
+
+# Stands in for a user Discord would not return (e.g. a deleted account), so one missing
+# user shows up as "Unknown user" instead of failing the whole command. Never cached, so
+# the next command tries again.
+@dataclass
+class MissingUser:
+    id: int
+    name: str = "Unknown user"
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+# Discord users by id, for turning stored ids into names when rendering stats. Entries expire
+# after `ttl` seconds so renames show up, and the least recently used are evicted past
+# `max_size`. Misses are fetched concurrently, at most `concurrency` at a time, and a user
+# already being fetched for another command is awaited rather than fetched twice.
+@dataclass
+class UserCache:
+    users: "OrderedDict[int, Tuple[disnakeUser, float]]" = None
+    max_size: int = 4096
+    ttl: float = 15 * 60
+    concurrency: int = 8
+    _semaphore: asyncio.Semaphore = None
+    _pending: Dict[int, asyncio.Future] = None
+
+    @classmethod
+    def _get(cls, user_id: int) -> Optional[disnakeUser]:
+        entry = cls.users.get(user_id)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            del cls.users[user_id]
+            return None
+        cls.users.move_to_end(user_id)
+        return user
+
+    @classmethod
+    def _put(cls, user: disnakeUser):
+        cls.users[user.id] = (user, time.monotonic() + cls.ttl)
+        cls.users.move_to_end(user.id)
+        while len(cls.users) > cls.max_size:
+            cls.users.popitem(last=False)
+
+    @classmethod
+    async def _fetch(cls, bot: commands.Bot, user_id: int) -> disnakeUser:
+        async with cls._semaphore:
+            user = await bot.getch_user(user_id)
+        cls._put(user)
+        return user
+
+    @classmethod
+    async def resolve(cls, bot: commands.Bot, user_ids: Iterable[int]) -> Dict[int, disnakeUser]:
+        if cls.users is None:
+            cls.users = OrderedDict()
+            cls._pending = {}
+            cls._semaphore = asyncio.Semaphore(cls.concurrency)
+        resolved: Dict[int, disnakeUser] = {}
+        waiting: Dict[int, asyncio.Future] = {}
+        for user_id in set(user_ids):
+            user = cls._get(user_id)
+            if user is not None:
+                resolved[user_id] = user
+            elif user_id in cls._pending:
+                waiting[user_id] = cls._pending[user_id]
+            else:
+                task = asyncio.ensure_future(cls._fetch(bot, user_id))
+                task.add_done_callback(lambda _, user_id=user_id: cls._pending.pop(user_id, None))
+                cls._pending[user_id] = waiting[user_id] = task
+        if waiting:
+            users = await asyncio.gather(
+                *(asyncio.shield(future) for future in waiting.values()), return_exceptions=True
+            )
+            for user_id, user in zip(waiting.keys(), users):
+                resolved[user_id] = MissingUser(user_id) if isinstance(user, BaseException) else user
+        return resolved
+
+    @classmethod
+    async def get(cls, bot: commands.Bot, user_id: int) -> disnakeUser:
+        return (await cls.resolve(bot, (user_id,)))[user_id]
+
+# Sorted, de-duplicated strings for prefix lookups. Matching is case-insensitive, and each
+# string is returned as it was first stored. Strings are counted so they can be removed again.
+@dataclass
+class _Prefixes:
+    keys: List[str] = field(default_factory=list)
+    counts: Counter = field(default_factory=Counter)
+    display: Dict[str, str] = field(default_factory=dict)
+
+    # Builds the index from many strings at once: counted first and sorted once, rather than
+    # inserted one by one, which is quadratic in the number of distinct strings
+    @classmethod
+    def build(cls, values: Iterable[str]) -> "_Prefixes":
+        prefixes = cls()
+        for value in values:
+            key = value.casefold()
+            if key not in prefixes.display:
+                prefixes.display[key] = value
+            prefixes.counts[key] += 1
+        prefixes.keys = sorted(prefixes.counts)
+        return prefixes
+
+    def add(self, value: str):
+        key = value.casefold()
+        if not self.counts[key]:
+            insort(self.keys, key)
+            self.display[key] = value
+        self.counts[key] += 1
+
+    def remove(self, value: str):
+        key = value.casefold()
+        if key not in self.counts:
+            return
+        self.counts[key] -= 1
+        if self.counts[key] <= 0:
+            del self.counts[key]
+            del self.display[key]
+            del self.keys[bisect_left(self.keys, key)]
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        prefix = prefix.casefold()
+        matches = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(matches) < limit and self.keys[i].startswith(prefix):
+            matches.append(self.display[self.keys[i]])
+            i += 1
+        return matches
+
+# Song names and artists for slash command autocomplete, per guild (every rec) and per
+# (rater, suggester) pair (closed recs, i.e. what can be rerated). Loaded by DB.setup and
+# updated by DB as recs are created, rated and deleted, so completing a keystroke is a bisect.
+@dataclass
+class SongIndex:
+    guilds: Dict[Tuple[int, str], _Prefixes] = None
+    pairs: Dict[Tuple[int, int, str], _Prefixes] = None
+    # Discord shows at most 25 choices
+    limit: int = 25
+
+    # rows are recommendation rows, in schema order (see Recommendation.parse_tuple)
+    @classmethod
+    def load(cls, rows: List[Tuple]):
+        guilds: Dict[Tuple[int, str], List[str]] = {}
+        pairs: Dict[Tuple[int, int, str], List[str]] = {}
+        for song_name, artist, rater_id, suggester_id, guild_id, _, _, is_closed in rows:
+            guilds.setdefault((guild_id, "song"), []).append(song_name)
+            guilds.setdefault((guild_id, "artist"), []).append(artist)
+            if is_closed:
+                pairs.setdefault((rater_id, suggester_id, "song"), []).append(song_name)
+                pairs.setdefault((rater_id, suggester_id, "artist"), []).append(artist)
+        cls.guilds = {key: _Prefixes.build(values) for key, values in guilds.items()}
+        cls.pairs = {key: _Prefixes.build(values) for key, values in pairs.items()}
+
+    @staticmethod
+    def _apply(index: Dict[Tuple, _Prefixes], scope: Tuple, song: Song, delta: int):
+        for column, value in (("song", song.name), ("artist", song.artist)):
+            prefixes = index.setdefault((*scope, column), _Prefixes())
+            if delta > 0:
+                prefixes.add(value)
+            else:
+                prefixes.remove(value)
+
+    @classmethod
+    def add_to_guild(cls, rec: Recommendation):
+        cls._apply(cls.guilds, (rec.guild.discord_id,), rec.song, 1)
+
+    @classmethod
+    def remove_from_guild(cls, rec: Recommendation):
+        cls._apply(cls.guilds, (rec.guild.discord_id,), rec.song, -1)
+
+    @classmethod
+    def add_to_pair(cls, rec: Recommendation):
+        cls._apply(cls.pairs, (rec.rater.discord_id, rec.suggester.discord_id), rec.song, 1)
+
+    @classmethod
+    def remove_from_pair(cls, rec: Recommendation):
+        cls._apply(cls.pairs, (rec.rater.discord_id, rec.suggester.discord_id), rec.song, -1)
+
+    # `column` is "song" or "artist"
+    @classmethod
+    def complete_in_guild(cls, guild: Guild, column: str, prefix: str) -> List[str]:
+        prefixes = cls.guilds.get((guild.discord_id, column))
+        return prefixes.complete(prefix, cls.limit) if prefixes else []
+
+    @classmethod
+    def complete_in_pair(cls, rater: User, suggester: User, column: str, prefix: str) -> List[str]:
+        prefixes = cls.pairs.get((rater.discord_id, suggester.discord_id, column))
+        return prefixes.complete(prefix, cls.limit) if prefixes else []
@@ -0,0 +1,119 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import hashlib
+from io import BytesIO
+import multiprocessing
+from typing import List, Optional
+
+
+# Runs in the chart worker processes. Matplotlib is imported there (never in the bot process)
+# and pinned to the non-interactive Agg backend.
+def _init_worker() -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Horizontal bar chart, highest value on top, rendered to PNG bytes. Uses the object-oriented
+# Figure API rather than pyplot, so no global figure state is kept between renders.
+def _render_barh(labels: List[str], values: List[float], title: str) -> bytes:
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize = (16,9))
+    try:
+        ax = fig.subplots()
+        ax.barh(labels, values)
+        # Remove axes splines
+        for s in ['top', 'bottom', 'left', 'right']:
+            ax.spines[s].set_visible(False)
+        # Pad axes
+        ax.xaxis.set_tick_params(pad = 5)
+        ax.yaxis.set_tick_params(pad = 10)
+        # Set gridlines
+        ax.grid(
+            color ='grey',
+            linestyle ='-', linewidth = 0.5,
+            alpha = 0.2
+        )
+        ax.invert_yaxis()
+        # Add annotation to bars
+        for i in ax.patches:
+            ax.text(
+                i.get_width()+0.2, i.get_y()+0.5,
+                str(round((i.get_width()), 2)),
+                fontsize = 10, fontweight ='bold',
+                color ='grey'
+            )
+        ax.set_title(title, loc="left")
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+# Rendered chart PNGs keyed by a hash of everything that went into them. The labels and
+# values are the chart's data, so a rating change that moves the numbers is a new key and
+# one that does not still hits. Least recently used charts are evicted once the total size
+# passes `max_bytes`.
+@dataclass
+class ChartCache:
+    charts: "OrderedDict[str, bytes]" = None
+    max_bytes: int = 32 * 1024 * 1024
+    size: int = 0
+
+    @staticmethod
+    def key(*inputs) -> str:
+        return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[bytes]:
+        if cls.charts is None or key not in cls.charts:
+            return None
+        cls.charts.move_to_end(key)
+        return cls.charts[key]
+
+    @classmethod
+    def put(cls, key: str, png: bytes):
+        if cls.charts is None:
+            cls.charts = OrderedDict()
+        if key in cls.charts:
+            cls.size -= len(cls.charts.pop(key))
+        cls.charts[key] = png
+        cls.size += len(png)
+        while cls.size > cls.max_bytes and cls.charts:
+            _, evicted = cls.charts.popitem(last=False)
+            cls.size -= len(evicted)
+
+
+# Renders charts in a small process pool so matplotlib never blocks the event loop.
+# Charts come back as in-memory PNGs, ready to hand to disnake.File.
+class Charts():
+    executor: ProcessPoolExecutor = None
+
+    @classmethod
+    def setup(cls, workers: int = 1) -> None:
+        cls.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            # The bot process runs threads (see DB), which do not mix well with fork()
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    @classmethod
+    def close(cls) -> None:
+        if cls.executor is not None:
+            cls.executor.shutdown()
+            cls.executor = None
+
+    @classmethod
+    async def barh(cls, labels: List[str], values: List[float], title: str) -> BytesIO:
+        key = ChartCache.key("barh", labels, values, title)
+        png = ChartCache.get(key)
+        if png is None:
+            png = await asyncio.get_running_loop().run_in_executor(
+                cls.executor, _render_barh, labels, values, title
+            )
+            ChartCache.put(key, png)
+        return BytesIO(png)
@@ -5,7 +5,7 @@ from disnake import Role as disnakeRole, User as disnakeUser
 
 from util import Interaction
 from db import DB
-from cache import RoleCache
+from cache import RoleCache, SongIndex
 from models.snowflakes import User, Role, Thread, Guild
 from models.song import Song
 from models.recommendation import Recommendation
@@ -43,6 +43,15 @@ class Admin(commands.Cog):
         except ValueError as e:
             await inter.response.send_message(f"Error: {e}", ephemeral=True)
 
+    # Songs and artists already recommended in the guild
+    @add_rating.autocomplete("song_name")
+    async def add_rating_song(self, inter: Interaction, string: str) -> List[str]:
+        return SongIndex.complete_in_guild(Guild(inter.guild_id), "song", string)
+
+    @add_rating.autocomplete("artist")
+    async def add_rating_artist(self, inter: Interaction, string: str) -> List[str]:
+        return SongIndex.complete_in_guild(Guild(inter.guild_id), "artist", string)
+
     @commands.slash_command(name="role", dm_permission=False)
     @commands.default_member_permissions(manage_guild=True)
     async def role(self, inter: Interaction):
@@ -51,24 +60,22 @@ class Admin(commands.Cog):
     @role.sub_command(name="register")
     async def role_register(self, inter: Interaction, role: disnakeRole):
         new_role = Role(discord_id=role.id)
-        if new_role in RoleCache.fetch(inter.guild.id):
+        if RoleCache.contains(inter.guild.id, new_role):
             await inter.response.send_message(f"{new_role.mention} is already in the list of moderator roles.", ephemeral=True)
             return
         
         await DB.create_mod_role(role=new_role, guild=Guild(inter.guild.id))
         await inter.response.send_message(f"{new_role.mention} has been added to the list of moderator roles.")
-        RoleCache.refresh()
 
     @role.sub_command(name="remove")
     async def role_remove(self, inter: Interaction, role: disnakeRole):
         role_to_delete = Role(discord_id=role.id)
-        if role_to_delete not in RoleCache.fetch(inter.guild.id):
+        if not RoleCache.contains(inter.guild.id, role_to_delete):
             await inter.response.send_message(f"{role_to_delete.mention} is not in the list of moderator roles.", ephemeral=True)
             return
         
         await DB.remove_mod_role(role=role_to_delete)
         await inter.response.send_message(f"{role_to_delete.mention} has been removed from the list of moderator roles.")
-        RoleCache.refresh()
 
 def setup(bot: commands.Bot):
     bot.add_cog(Admin(bot))
\ No newline at end of file
@@ -1,9 +1,15 @@
-from disnake.ext import commands
+from traceback import print_exception
+from typing import List
 
+from disnake.ext import commands, tasks
+from disnake import User as disnakeUser
+
+from cache import SongIndex, ThreadCache
 from db import DB
-from models.snowflakes import User
+from models.snowflakes import User, Guild
 from models.modal import RecommendModal
 from models.song import Song
+from suggest import Suggestions
 
 from util import Interaction, fetch_thread, validate_request, validate_request_recommender
 
@@ -37,10 +43,10 @@ async def rec_rate(
     except(ValueError) as e:
         await inter.response.send_message(f"Error: {e}", ephemeral=True)
         return
-    if not await DB.get_open_rating_by_thread(thread):
+    rec = await DB.get_open_rating_by_thread(thread)
+    if not rec:
         await inter.response.send_message("Error: There is no open recommendation to rate.", ephemeral=True)
         return
-    rec = await DB.get_open_rating_by_thread(thread)
     rec.rating = rating
     await DB.close_rec(rec)
     await inter.response.send_message(f"{rec.suggester.mention}, your recommendation has been rated **{rec.rating}/10**. Any additional comments may be given above or below.")
@@ -69,7 +75,15 @@ async def rec_rerate(
     try:
         recs = await DB.get_ratings_by_song_and_pair(Song(song, artist), caller, other)
         if not recs:
-            await inter.response.send_message(f"Error: cannot find {song} by {artist} in your ratings", ephemeral=True)
+            # Only ever suggest the closest matches: rerating one unasked could overwrite the
+            # rating of a different song the pair has rated (e.g. "Song A" for "Song B")
+            matches = await DB.search_ratings_by_song_and_pair(Song(song, artist), caller, other)
+            if matches:
+                candidates = list(dict.fromkeys(rec.song for _, rec in matches))[:3]
+                suggestions = ", ".join(f"{match.name} by {match.artist}" for match in candidates)
+                await inter.response.send_message(f"Error: cannot find {song} by {artist} in your ratings. Did you mean: {suggestions}?", ephemeral=True)
+            else:
+                await inter.response.send_message(f"Error: cannot find {song} by {artist} in your ratings", ephemeral=True)
             return
     except(Exception) as e:
         await inter.response.send_message(f"Error: {e}", ephemeral=True)
@@ -80,9 +94,20 @@ async def rec_rerate(
     rec = recs[0]
     rec.rating = rating
     await DB._close_rec(rec)
-    await inter.response.send_message(f"{rec.suggester.mention}, your recommendation **{song}** has been re-rated **{rec.rating}/10**. Any additional comments may be given above or below.", allowed_mentions= False)
+    await inter.response.send_message(f"{rec.suggester.mention}, your recommendation **{rec.song.name}** has been re-rated **{rec.rating}/10**. Any additional comments may be given above or below.", allowed_mentions= False)
     
 
+# Autocomplete for the rerate song/artist options: what the caller has rated from the other
+# user in this thread, or anything recommended in the guild outside a linked thread
+def rerate_choices(inter: Interaction, column: str, prefix: str) -> List[str]:
+    caller = User(inter.author.id)
+    thread = ThreadCache.fetch(inter.channel_id)
+    if thread is None or caller not in thread:
+        return SongIndex.complete_in_guild(Guild(inter.guild_id), column, prefix)
+    other = thread.user2 if caller == thread.user1 else thread.user1
+    return SongIndex.complete_in_pair(caller, other, column, prefix)
+
+
 async def rec_clear(inter: Interaction):
     try:
         thread = await fetch_thread(inter)
@@ -95,18 +120,50 @@ async def rec_clear(inter: Interaction):
         await inter.response.send_message("Error: There is no open recommendation to clear.", ephemeral=True)
         return
     try:
-        await DB._delete_rec(rec)
-        await DB.flip_thread(thread=thread, next_user=User(inter.author.id))
+        async with DB.transaction():
+            await DB._delete_rec(rec)
+            await DB.flip_thread(thread=thread, next_user=User(inter.author.id))
     except(Exception) as e:
         await inter.response.send_message(f"Could not delete recommendation: {e}", ephemeral=True)
         return
     await inter.response.send_message (f"Deleted recommendation: {rec.song.name} by {rec.song.artist}")
 
 
+async def rec_suggest(inter: Interaction, rater: disnakeUser = None):
+    target = rater or inter.author
+    suggestions = Suggestions.suggest(Guild(inter.guild_id), User(target.id))
+    if not suggestions:
+        await inter.response.send_message(
+            f"Error: no suggestions for {target.name} yet. Suggestions are based on past ratings, and are refreshed every so often.",
+            ephemeral=True
+        )
+        return
+    lines = [
+        f"{i}. **{song.name}** by {song.artist} (predicted **{score:.1f}**/10)"
+        for i, (score, song) in enumerate(suggestions, start=1)
+    ]
+    who = "you" if target == inter.author else target.name
+    await inter.response.send_message(f"Songs {who} would probably like:\n" + "\n".join(lines), ephemeral=True)
+
+
 class Recommend(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    async def cog_load(self):
+        self.retrain_suggestions.start()
+
+    def cog_unload(self):
+        self.retrain_suggestions.cancel()
+
+    # Suggestions.refresh only retrains once enough ratings have changed
+    @tasks.loop(minutes=1)
+    async def retrain_suggestions(self):
+        try:
+            await Suggestions.refresh()
+        except Exception as e:
+            print_exception(e)
+
     ##############################################
     #
     # /rec Group
@@ -147,6 +204,14 @@ class Recommend(commands.Cog):
     ):
         await rec_rerate(inter, song, artist, rating)
 
+    @rerate.autocomplete("song")
+    async def rerate_song(self, inter: Interaction, string: str) -> List[str]:
+        return rerate_choices(inter, "song", string)
+
+    @rerate.autocomplete("artist")
+    async def rerate_artist(self, inter: Interaction, string: str) -> List[str]:
+        return rerate_choices(inter, "artist", string)
+
     @rec.sub_command(
         name="clear",
         description="Clears your active recommendation"
@@ -154,6 +219,13 @@ class Recommend(commands.Cog):
     async def clear(self, inter: Interaction):
         await rec_clear(inter)
 
+    @rec.sub_command(
+        name="suggest",
+        description="Songs you (or another user) would probably rate highly, based on everyone's ratings"
+    )
+    async def suggest(self, inter: Interaction, rater: disnakeUser = None):
+        await rec_suggest(inter, rater)
+
 
     ##############################################
     #
@@ -201,6 +273,14 @@ class Recommend(commands.Cog):
     ):
         await rec_rerate(inter, song, artist, rating)
 
+    @rerate_legacy.autocomplete("song")
+    async def rerate_legacy_song(self, inter: Interaction, string: str) -> List[str]:
+        return rerate_choices(inter, "song", string)
+
+    @rerate_legacy.autocomplete("artist")
+    async def rerate_legacy_artist(self, inter: Interaction, string: str) -> List[str]:
+        return rerate_choices(inter, "artist", string)
+
     # DEPRECATED, USE OF /REC CLEAR IS PREFERRED
     @commands.slash_command(name="clear", dm_permission=False)
     async def clear_legacy(self, inter: Interaction):
@@ -1,21 +1,24 @@
 from datetime import datetime
 from io import BytesIO
-import os
-import time
 import traceback
 from disnake.ext import commands
 from disnake import File, User as disnakeUser, ui
 
-import matplotlib.pyplot as plt
 from PIL import Image
 
 from traceback import print_exception
-from util import build_table, outputs_dir
+from util import build_table, build_table_pages, send_pages
+from analytics import Analytics
+from compatibility import Compatibility
+from cache import UserCache
+from charts import Charts
 from db import DB
+from leaderboard import Leaderboard
 from models.snowflakes import User, Thread, Guild
 from models.song import Song
 from models.recommendation import Recommendation
 from models.embed import EmbedBuilder
+from models.view import HistoryView
 from util import Interaction, fetch_thread, validate_request
 
 
@@ -34,10 +37,14 @@ class Stats(commands.Cog):
         rater: disnakeUser = None
     ): 
         try:
-            if rater:
-                ratings = await DB.get_max_rating(User(inter.author.id), User(rater.id))
-            else:
-                ratings = await DB.get_max_rating(User(inter.author.id))
+            rows = Analytics.select(suggester=inter.author.id, rater=rater.id if rater else None)
+            if not len(rows["rating"]):
+                raise Exception("No data found for given query")
+            best = rows["rating"] == rows["rating"].max()
+            ratings = [
+                (Analytics.songs[song], rater_id, rating)
+                for song, rater_id, rating in zip(*(rows[name][best].tolist() for name in ("song", "rater", "rating")))
+            ]
             if len(ratings) > 1:
                 title = f"{inter.author.name}'s Highest Rated Recommendations"
             else:
@@ -45,12 +52,11 @@ class Stats(commands.Cog):
             if rater:
                 title += f" to {rater.name}"
             headers = "Song", "Artist", "Rater", "Rating"
+            users = await UserCache.resolve(self.bot, (rater_id for _, rater_id, _ in ratings))
             data = []
-            for rating in ratings:
-                discord_user = await self.bot.getch_user(rating.rater.discord_id)
-                data.append((rating.song.name, rating.song.artist, discord_user.name, rating.rating))
-            message = build_table(title, headers, data)
-            await inter.response.send_message(message)
+            for song, rater_id, rating in ratings:
+                data.append((song.name, song.artist, users[rater_id].name, f"{rating:g}"))
+            await send_pages(inter, build_table_pages(title, headers, data))
             return
             #await inter.response.send_message(f"Your max rating is {ratings}", ephemeral=True)
         except Exception as e:
@@ -66,12 +72,13 @@ class Stats(commands.Cog):
     ): 
 
         try:
+            ratings = Analytics.select(suggester=inter.author.id, rater=rater.id if rater else None)["rating"]
+            if not len(ratings):
+                raise Exception("No data found for given query")
             if rater:
-                avg = await DB.get_average_rating(User(inter.author.id), User(rater.id))
-                await inter.response.send_message(f"Your suggestions to {rater.name} are, on average, rated **{avg:.1f}**")
+                await inter.response.send_message(f"Your suggestions to {rater.name} are, on average, rated **{ratings.mean():.1f}**")
             else:
-                avg = await DB.get_average_rating(User(inter.author.id))
-                await inter.response.send_message(f"Your suggestions are, on average, rated **{avg:.1f}**")
+                await inter.response.send_message(f"Your suggestions are, on average, rated **{ratings.mean():.1f}**")
             
             
         except Exception as e:
@@ -87,12 +94,13 @@ class Stats(commands.Cog):
     ): 
 
         try:
+            ratings = Analytics.select(suggester=inter.author.id, rater=rater.id if rater else None)["rating"]
+            if not len(ratings):
+                raise Exception("No data found for given query")
             if rater:
-                total = await DB.get_total_rating(User(inter.author.id), User(rater.id))
-                await inter.response.send_message(f"You have recieved **{total:.1f}** points from {rater.name}")
+                await inter.response.send_message(f"You have recieved **{ratings.sum():.1f}** points from {rater.name}")
             else:
-                total = await DB.get_total_rating(User(inter.author.id))
-                await inter.response.send_message(f"You have recieved **{total:.1f}** points in total")
+                await inter.response.send_message(f"You have recieved **{ratings.sum():.1f}** points in total")
             
             
         except Exception as e:
@@ -100,6 +108,78 @@ class Stats(commands.Cog):
             #print_exception(e)
             return
     
+    @stats.sub_command(name="distribution")
+    async def stats_distribution(
+        self,
+        inter: Interaction,
+        rater: disnakeUser = None
+    ): 
+
+        try:
+            filters = {"suggester": inter.author.id, "rater": rater.id if rater else None}
+            counts = Analytics.distribution(**filters)
+            if not counts.sum():
+                raise Exception("No data found for given query")
+            title = f"{inter.author.name}'s Ratings"
+            if rater:
+                title += f" from {rater.name}"
+            headers = "Rating", "Count", "Share"
+            bar_unit = max(counts.max() / 20, 1)
+            data = [
+                (rating, int(count), "#" * int(round(count / bar_unit)))
+                for rating, count in enumerate(counts, start=1)
+            ]
+            p25, p50, p75, p90 = Analytics.percentiles((25, 50, 75, 90), **filters)
+            message = build_table(title, headers, data)
+            message += f"\nMedian **{p50:.1f}**, middle half **{p25:.1f}-{p75:.1f}**, top tenth **{p90:.1f}**+"
+            await inter.response.send_message(message)
+        except Exception as e:
+            await inter.response.send_message(f"Error: {e}", ephemeral=True)
+            #print_exception(e)
+            return
+
+    @stats.sub_command(name="compatibility")
+    async def stats_compatibility(
+        self,
+        inter: Interaction,
+        other: disnakeUser = None
+    ): 
+
+        try:
+            guild = Guild(inter.guild_id)
+            if other:
+                pearson, overlap = Compatibility.similarity(guild, User(inter.author.id), User(other.id))
+                cosine, _ = Compatibility.similarity(guild, User(inter.author.id), User(other.id), metric="cosine")
+                if not overlap:
+                    await inter.response.send_message(f"You and {other.name} have no songs in common yet.", ephemeral=True)
+                    return
+                # Either score is None when its norm is zero, e.g. every shared rating the same
+                cosine_text = f" (cosine **{cosine:.2f}**)" if cosine is not None else ""
+                if pearson is None:
+                    await inter.response.send_message(
+                        f"You and {other.name} have rated {overlap} of the same songs, which is not enough to compare tastes{cosine_text}"
+                    )
+                else:
+                    await inter.response.send_message(
+                        f"Over {overlap} songs you both rated, your taste matches {other.name}'s with a correlation of **{pearson:.2f}**{cosine_text}"
+                    )
+                return
+            matches = Compatibility.most_similar(guild, User(inter.author.id))
+            if not matches:
+                raise Exception("No one has rated enough of the same songs as you yet")
+            title = f"Most Similar Taste to {inter.author.name}"
+            headers = "User", "Correlation", "Songs in Common"
+            users = await UserCache.resolve(self.bot, (match[1].discord_id for match in matches))
+            data = [
+                (users[user.discord_id].name, round(score, 2), overlap)
+                for score, user, overlap in matches
+            ]
+            await inter.response.send_message(build_table(title, headers, data))
+        except Exception as e:
+            await inter.response.send_message(f"Error: {e}", ephemeral=True)
+            #print_exception(e)
+            return
+
     @stats.sub_command(name="history")
     async def stats_history(
         self,
@@ -108,19 +188,8 @@ class Stats(commands.Cog):
     ): 
 
         try:
-            ratings = await DB.get_ratings_by_pair(User(inter.author.id), User(other.id))
-            title = f"History Between {inter.author.name} and {other.name}"
-
-            headers = "Song", "Artist", "Suggester", "Rater", "Rating"
-            data = []
-            
-            #create a dictionary matching discord id to discord name
-            users = {inter.author.id : inter.author.name, other.id : other.name}
-            for rating in ratings:
-                data.append((rating.song.name, rating.song.artist, users[rating.suggester.discord_id], users[rating.rater.discord_id], rating.rating))
-
-            message = build_table(title, headers, data)
-            await inter.response.send_message(message)
+            view = await HistoryView.fetch_first(inter.author, other)
+            await inter.response.send_message(view.render(), view=view)
             return
         except Exception as e:
             await inter.response.send_message(f"Error: {e}", ephemeral=True)
@@ -142,20 +211,25 @@ class Stats(commands.Cog):
 
         try:
             if rater:
-                ratings = await DB.get_max_ratings(User(rater.id))
+                tups = Leaderboard.top("max", k=None, rater=User(rater.id))
+                ratings = await DB.get_ratings_by_suggester_and_rating(tups, User(rater.id))
                 title = f"{rater.name}'s Highest Ratings"
             else:
-                ratings = await DB.get_max_ratings()
+                tups = Leaderboard.top("max", k=None)
+                ratings = await DB.get_ratings_by_suggester_and_rating(tups)
                 title = f"Highest Rated Suggestion Leaderboard"
 
             headers = "Song", "Artist", "Suggester", "Rater", "Rating"
+            users = await UserCache.resolve(
+                self.bot,
+                [rating.suggester.discord_id for rating in ratings] + [rating.rater.discord_id for rating in ratings]
+            )
             data = []
             for rating in ratings:
-                s_user = await self.bot.getch_user(rating.suggester.discord_id)
-                r_user = await self.bot.getch_user(rating.rater.discord_id)
+                s_user = users[rating.suggester.discord_id]
+                r_user = users[rating.rater.discord_id]
                 data.append((rating.song.name, rating.song.artist, s_user.name, r_user.name, rating.rating))
-            message = build_table(title, headers, data)
-            await inter.response.send_message(message)
+            await send_pages(inter, build_table_pages(title, headers, data))
             return
         except Exception as e:
             await inter.response.send_message(f"Error: {e}", ephemeral=True)
@@ -172,21 +246,21 @@ class Stats(commands.Cog):
 
         try:
             if rater:
-                tups = await DB.get_average_ratings(User(rater.id))
+                tups = Leaderboard.top("average", k=None, rater=User(rater.id))
                 title = f"{rater.name}'s Ratings Average Leaderboard"
             else:
-                tups = await DB.get_average_ratings()
+                tups = Leaderboard.top("average", k=None)
                 title = f"Ratings Average Leaderboard"
 
             headers = "User", "Average Rating"
+            users = await UserCache.resolve(self.bot, (tup[1].discord_id for tup in tups))
             data = []
             for tup in tups:
-                s_user = await self.bot.getch_user(tup[1].discord_id)
+                s_user = users[tup[1].discord_id]
                 data.append((s_user.name, round(tup[0], 1)))
             if not data:
                 raise Exception("No data found for given query")
-            message = build_table(title, headers, data)
-            await inter.response.send_message(message)
+            await send_pages(inter, build_table_pages(title, headers, data))
             return
         except Exception as e:
             await inter.response.send_message(f"Error: {e}", ephemeral=True)
@@ -201,47 +275,23 @@ class Stats(commands.Cog):
     ): 
         # try:
         if rater:
-            tups = await DB.get_total_ratings(User(rater.id))
+            tups = Leaderboard.top("total", k=10, rater=User(rater.id))
             title = f"{rater.name}'s Total Points Leaderboard"
         else:
-            tups = await DB.get_total_ratings()
+            tups = Leaderboard.top("total", k=10)
             title = f"Total Points Leaderboard"
 
         # Gather data
         data = {}
-        for tup in tups[:10]:
-            user: disnakeUser = await self.bot.getch_user(tup[1].discord_id)
+        users = await UserCache.resolve(self.bot, (tup[1].discord_id for tup in tups))
+        for tup in tups:
+            user: disnakeUser = users[tup[1].discord_id]
             data[user.name] = tup[0]
-        # Generate matplotlib figure and horizontal bar graph
-        fig, ax = plt.subplots(figsize = (16,9))
-        ax.barh(list(data.keys()), list(data.values()))
-        # Remove axes splines
-        for s in ['top', 'bottom', 'left', 'right']:
-            ax.spines[s].set_visible(False)
-        # Pad axes
-        ax.xaxis.set_tick_params(pad = 5)
-        ax.yaxis.set_tick_params(pad = 10)
-        # Set gridlines
-        ax.grid(
-            color ='grey',
-            linestyle ='-', linewidth = 0.5,
-            alpha = 0.2
-        )
-        ax.invert_yaxis()
-        # Add annotation to bars
-        for i in ax.patches:
-            plt.text(
-                i.get_width()+0.2, i.get_y()+0.5,
-                str(round((i.get_width()), 2)),
-                fontsize = 10, fontweight ='bold',
-                color ='grey'
-            )
-        ax.set_title("Users with highest total ratings", loc="left")
-        filename=f"leaderboard_total{int(time.time())}.png"
-        plt.savefig(os.path.join(outputs_dir, filename), format='png')
+        # Render the horizontal bar graph off the event loop
+        image = await Charts.barh(list(data.keys()), list(data.values()), "Users with highest total ratings")
         builder=EmbedBuilder(
             title="Highest Total Ratings",
-            image=File(os.path.join(outputs_dir, filename))
+            image=File(image, filename="leaderboard_total.png")
         )
         await inter.response.send_message(embed=await builder.build())
         # except Exception as e:
@@ -5,7 +5,7 @@ from disnake.ext.commands import check, Context
 from disnake.utils import get as disnakeGet, get as disnakeGet
 
 from db import DB
-from cache import RoleCache
+from cache import RoleCache, UserCache
 from models.snowflakes import User, Role, Thread, Guild
 from models.embed import Field, EmbedBuilder
 from util import Interaction
@@ -18,10 +18,7 @@ class Threads(commands.Cog):
         def predicate(ctx: Context):
             if ctx.author.guild_permissions.administrator:
                 return True
-            for role in RoleCache.fetch(ctx.guild.id):
-                if disnakeGet(ctx.author.roles, id=role.discord_id):
-                    return True
-            return False
+            return RoleCache.has_any(ctx.guild.id, (role.id for role in ctx.author.roles))
         return check(predicate)
 
     @commands.Cog.listener(name=Event.slash_command_error)
@@ -114,8 +111,9 @@ class Threads(commands.Cog):
             await inter.response.send_message("You're all caught up (in this server)!", ephemeral=True)
             return
         fields = []
+        users = await UserCache.resolve(self.bot, (thread.other_user.discord_id for thread in threads[:5]))
         for thread in threads[:5]:
-            other_user: disnakeUser = await self.bot.getch_user(thread.other_user.discord_id)
+            other_user: disnakeUser = users[thread.other_user.discord_id]
             fields.append(
                 Field(
                     name=other_user.display_name,
@@ -154,11 +152,9 @@ class Threads(commands.Cog):
     @thread.sub_command(name="cleanup", description="Cleans up any threads that no longer exist.")
     async def thread_cleanup(self, inter: Interaction):
         guild: Guild = Guild(discord_id=inter.guild.id)
-        print("Help")
-        for thread in await DB.get_threads_by_guild(guild=guild):
-            print("Still going...")
+        # Streamed, so a guild with many threads is never loaded all at once
+        async for thread in DB.iter_threads_by_guild(guild=guild):
             if disnakeGet(inter.guild.threads, id=thread.thread_id) is None:
-                print("Bad Data Found!")
                 await DB.delink_thread(thread=thread)
         await inter.response.send_message("Threads are all clean!")
 
@@ -0,0 +1,153 @@
+from collections import Counter
+from dataclasses import dataclass
+from math import sqrt
+from typing import Dict, List, Optional, Tuple
+
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, User
+
+# Running sums over the songs two raters have both rated, enough to give their cosine and
+# Pearson similarity at any time. `a` is always the lower rater id of the pair.
+@dataclass
+class _PairSums:
+    n: int = 0
+    a: float = 0
+    b: float = 0
+    aa: float = 0
+    bb: float = 0
+    ab: float = 0
+
+    def apply(self, a: float, b: float, delta: int):
+        self.n += delta
+        self.a += a * delta
+        self.b += b * delta
+        self.aa += a * a * delta
+        self.bb += b * b * delta
+        self.ab += a * b * delta
+
+    def score(self, metric: str) -> Optional[float]:
+        match metric:
+            case "cosine":
+                norm = sqrt(self.aa * self.bb)
+                return self.ab / norm if norm > 0 else None
+            case "pearson":
+                norm = sqrt(max(self.n * self.aa - self.a ** 2, 0) * max(self.n * self.bb - self.b ** 2, 0))
+                return (self.n * self.ab - self.a * self.b) / norm if norm > 0 else None
+
+
+# Guild members' taste as a sparse rater x song matrix (as dicts both ways round), with the
+# similarity sums of every pair of raters kept up to date as ratings come and go, so "who has
+# the most similar taste to me" is a scan of one rater's neighbours rather than a self-join per
+# user. Like DB.get_overlap, a rater's score for a song is their best rating of it.
+# Built from SQL by DB.setup and updated by DB on every rating event.
+@dataclass
+class Compatibility:
+    # guild_id -> rater_id -> song key -> every rating the rater gave the song
+    ratings: Dict[int, Dict[int, Dict[Tuple[str, str], Counter]]] = None
+    # guild_id -> song key -> rater_id -> the rater's best rating of the song
+    songs: Dict[int, Dict[Tuple[str, str], Dict[int, float]]] = None
+    # guild_id -> rater_id -> other rater_id -> shared sums of the pair
+    pairs: Dict[int, Dict[int, Dict[int, _PairSums]]] = None
+
+    @staticmethod
+    def _song_key(rec: Recommendation) -> Tuple[str, str]:
+        return (rec.song.name.casefold(), rec.song.artist.casefold())
+
+    # rows are closed recommendation rows, in schema order (see Recommendation.parse_tuple)
+    @classmethod
+    def load(cls, rows: List[Tuple]):
+        cls.ratings = {}
+        cls.songs = {}
+        cls.pairs = {}
+        for song_name, artist, rater_id, _, guild_id, _, rating, _ in rows:
+            ratings = cls.ratings.setdefault(guild_id, {}).setdefault(rater_id, {})
+            ratings.setdefault((song_name.casefold(), artist.casefold()), Counter())[rating] += 1
+        for guild_id, raters in cls.ratings.items():
+            songs = cls.songs[guild_id] = {}
+            for rater_id, rated in raters.items():
+                for song, counts in rated.items():
+                    songs.setdefault(song, {})[rater_id] = max(counts)
+            pairs = cls.pairs[guild_id] = {}
+            for song_raters in songs.values():
+                raters = sorted(song_raters.items())
+                for i, (a, rating_a) in enumerate(raters):
+                    for b, rating_b in raters[i + 1:]:
+                        cls._pair(pairs, a, b).apply(rating_a, rating_b, 1)
+
+    @staticmethod
+    def _pair(pairs: Dict[int, Dict[int, _PairSums]], a: int, b: int) -> _PairSums:
+        sums = pairs.setdefault(a, {}).get(b)
+        if sums is None:
+            sums = pairs[a][b] = pairs.setdefault(b, {})[a] = _PairSums()
+        return sums
+
+    # Moves one rater's score for a song from `old` to `new` (None meaning unrated), updating
+    # their sums with everyone else who rated the song
+    @classmethod
+    def _rescore(cls, guild_id: int, rater_id: int, song: Tuple[str, str], old: Optional[float], new: Optional[float]):
+        if old == new:
+            return
+        song_raters = cls.songs.setdefault(guild_id, {}).setdefault(song, {})
+        pairs = cls.pairs.setdefault(guild_id, {})
+        for other_id, other in song_raters.items():
+            if other_id == rater_id:
+                continue
+            sums = cls._pair(pairs, rater_id, other_id)
+            for score, delta in ((old, -1), (new, 1)):
+                if score is not None:
+                    sums.apply(*((score, other) if rater_id < other_id else (other, score)), delta)
+        if new is None:
+            del song_raters[rater_id]
+        else:
+            song_raters[rater_id] = new
+
+    @classmethod
+    def _apply(cls, rec: Recommendation, rating: float, delta: int):
+        guild_id, rater_id, song = rec.guild.discord_id, rec.rater.discord_id, cls._song_key(rec)
+        counts = cls.ratings.setdefault(guild_id, {}).setdefault(rater_id, {}).setdefault(song, Counter())
+        old = max(counts) if counts else None
+        counts[rating] += delta
+        if counts[rating] <= 0:
+            del counts[rating]
+        new = max(counts) if counts else None
+        if not counts:
+            del cls.ratings[guild_id][rater_id][song]
+        cls._rescore(guild_id, rater_id, song, old, new)
+
+    @classmethod
+    def add(cls, rec: Recommendation, rating: float):
+        cls._apply(rec, rating, 1)
+
+    @classmethod
+    def remove(cls, rec: Recommendation, rating: float):
+        cls._apply(rec, rating, -1)
+
+    # Similarity of two raters in a guild and how many songs it is over, or (None, 0)
+    @classmethod
+    def similarity(cls, guild: Guild, a: User, b: User, metric: str = "pearson") -> Tuple[Optional[float], int]:
+        sums = cls.pairs.get(guild.discord_id, {}).get(a.discord_id, {}).get(b.discord_id)
+        if sums is None or sums.n <= 0:
+            return None, 0
+        return sums.score(metric), sums.n
+
+    # The raters in a guild whose taste is closest to `rater`'s, as (score, User, songs in
+    # common). Pairs with fewer than `min_overlap` songs in common are left out.
+    @classmethod
+    def most_similar(
+        cls,
+        guild: Guild,
+        rater: User,
+        metric: str = "pearson",
+        k: Optional[int] = 5,
+        min_overlap: int = 3,
+    ) -> List[Tuple[float, User, int]]:
+        neighbours = cls.pairs.get(guild.discord_id, {}).get(rater.discord_id, {})
+        scored = []
+        for other_id, sums in neighbours.items():
+            if sums.n < min_overlap:
+                continue
+            score = sums.score(metric)
+            if score is not None:
+                scored.append((score, User.of(other_id), sums.n))
+        scored.sort(key=lambda entry: (-entry[0], -entry[2]))
+        return scored[:k]
@@ -1,90 +1,110 @@
+import asyncio
+from difflib import SequenceMatcher
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import replace
 from datetime import datetime
+import json
+import os
 from pprint import pprint
 import sqlite3
-from typing import List, Optional, Tuple, overload
+import threading
+from typing import Any, AsyncIterator, Callable, List, Optional, Set, Tuple, TypeVar, overload
 
+from analytics import Analytics
+from compatibility import Compatibility
+from cache import OpenRecCache, RoleCache, SongIndex, ThreadCache
+from leaderboard import Leaderboard
+from migrations import migrate
 from models.snowflakes import User, Role, Guild, Thread
 from models.song import Song
 from models.recommendation import Recommendation
+from models.page import Cursor, Page
+
+T = TypeVar("T")
 
 class DB():
+    # sqlite3 is blocking, so statements are handed to worker threads and awaited instead of
+    # stalling the event loop. All writes go through a single writer thread, so each unit of
+    # work below runs start-to-finish without interleaving. Plain reads go to a pool of
+    # read-only connections which, thanks to WAL, never wait on the writer.
+    path: str = "pyrate.db"
+    writer: ThreadPoolExecutor = None
+    readers: ThreadPoolExecutor = None
+    con: sqlite3.Connection = None
+    # Bumped whenever a rating is added, changed or deleted, so derived data (e.g. the
+    # suggestion model) can tell whether it is stale
+    generation: int = 0
+    # Whether fuzzy song search can use the song_search index (see migrations.py), which needs
+    # FTS5; if not, it falls back to LIKE over the pair's ratings
+    trigram_search: bool = False
+    # Pairs with at most this many ratings are searched by scanning their ratings, which is
+    # cheaper than ranking every song in the library that shares a trigram with the search
+    fuzzy_scan_limit: int = 5000
+    _local = threading.local()
+    _reader_cons: List[sqlite3.Connection] = []
+    # Read-only connections for _iterate that are not streaming a query at the moment
+    _idle_streams: List[sqlite3.Connection] = []
+    # Held for the whole of a DB.transaction() block, so no other write lands inside it
+    _write_lock: asyncio.Lock = None
+    # Inside a DB.transaction() block, holds the callbacks to run once it commits
+    _transaction: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar("transaction", default=None)
+    # Group commit: when a window is set, writes from concurrent commands share one commit,
+    # issued once the window (in seconds) elapses or the batch reaches group_commit_size.
+    group_commit_window: Optional[float] = None
+    group_commit_size: int = 64
+    _batch: Optional[asyncio.Future] = None
+    _batch_size: int = 0
+    _batch_timer: Optional[asyncio.TimerHandle] = None
+    _flush_tasks: Set[asyncio.Task] = set()
 
     @classmethod
-    def setup(cls, truncate: bool = False) -> None:
-        cls.con = sqlite3.connect("pyrate.db")
-        cls.cur = cls.con.cursor()
+    def setup(
+        cls,
+        truncate: bool = False,
+        readers: int = None,
+        group_commit_ms: float = None,
+        group_commit_size: int = 64,
+    ) -> None:
+        cls.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyrate-db-writer")
+        cls._write_lock = asyncio.Lock()
+        cls.group_commit_window = group_commit_ms / 1000 if group_commit_ms is not None else None
+        cls.group_commit_size = group_commit_size
+        # The writer connection is only ever touched from the writer thread.
+        cls.con = sqlite3.connect(cls.path, check_same_thread=False)
+        cls.con.execute('PRAGMA journal_mode = WAL')
+        cls.readers = ThreadPoolExecutor(
+            max_workers=readers or min(4, os.cpu_count() or 1),
+            thread_name_prefix="pyrate-db-reader",
+            initializer=cls._open_reader,
+        )
         # cls.cur.execute('PRAGMA foreign_keys = ON')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS user(
-        #         discord_id NUMERIC PRIMARY KEY NOT NULL
-        #     );
-        # ''')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS guild(
-        #         discord_id NUMERIC PRIMARY KEY NOT NULL
-        #     );
-        # ''')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS role(
-        #         discord_id NUMERIC PRIMARY KEY NOT NULL,
-        #         guild_id NUMERIC NOT NULL,
-        #         FOREIGN KEY(guild_id) REFERENCES guild (guild_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE
-        #     );
-        # ''')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS thread(
-        #         thread_id NUMERIC PRIMARY KEY NOT NULL,
-        #         guild_id NUMERIC NOT NULL,
-        #         user1_id NUMERIC NOT NULL,
-        #         user2_id NUMERIC NOT NULL,
-        #         next_user NUMERIC NOT NULL,
-        #         FOREIGN KEY(guild_id) REFERENCES guild (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE,
-        #         FOREIGN KEY(user1_id) REFERENCES user (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE,
-        #         FOREIGN KEY(user2_id) REFERENCES user (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE
-        #         FOREIGN KEY (next_user) REFERENCES user (discord_id) 
-        #             ON DELETE CASCADE 
-        #             ON UPDATE CASCADE
-        #     );
-        # ''')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS song(
-        #         song_name varchar NOT NULL COLLATE NOCASE,
-        #         artist varchar NOT NULL COLLATE NOCASE,
-        #         PRIMARY KEY(song_name, artist)
-        #     );
-        # ''')
-        # cls.cur.execute('''
-        #     CREATE TABLE IF NOT EXISTS recommendation(
-        #         song_name varchar NOT NULL COLLATE NOCASE,
-        #         artist varchar NOT NULL COLLATE NOCASE,
-        #         rater_id NUMERIC NOT NULL,
-        #         suggester_id NUMERIC NOT NULL,
-        #         guild_id NUMERIC NOT NULL,
-        #         timestamp text NOT NULL,
-        #         rating NUMERIC DEFAULT -1,
-        #         is_closed NUMERIC DEFAULT 0,
-        #         FOREIGN KEY (song_name, artist) REFERENCES song (song_name, artist)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE,
-        #         FOREIGN KEY (rater_id) REFERENCES user (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE,
-        #         FOREIGN KEY (suggester_id) REFERENCES user (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE,
-        #         FOREIGN KEY (guild_id) REFERENCES guild (discord_id)
-        #             ON DELETE CASCADE
-        #             ON UPDATE CASCADE
-        #     );
-        # ''')
+        # Tables and indexes are created by the versioned steps in migrations.py
+        cls.writer.submit(migrate, cls.con).result()
+        cls.trigram_search = cls.writer.submit(lambda: bool(cls.con.execute(
+            '''SELECT 1 FROM sqlite_master WHERE name = 'song_search_vocab' '''
+        ).fetchone())).result()
+        RoleCache.load(cls.get_mod_roles())
+        ThreadCache.load(Thread.parse_tuples(
+            cls.readers.submit(cls._fetchall_sync, '''SELECT * FROM thread''').result()
+        ))
+        # Every in-memory view of the recommendations is filled from this one scan, in order:
+        #   OpenRecCache  - open recs, as models
+        #   Leaderboard   - closed ratings, tallied per (guild, rater, suggester)
+        #   Analytics     - closed ratings, as NumPy columns
+        #   Compatibility - closed ratings, plus shared sums for every pair of raters of a song
+        #   SongIndex     - song names and artists of every rec, sorted for prefix lookups
+        # The rows are held only until the last view is built, so startup peaks at roughly the
+        # table once over on top of the views; Compatibility and Analytics take most of the
+        # time, growing with the number of ratings (and, for Compatibility, raters per song).
+        recs = cls.readers.submit(cls._fetchall_sync, '''SELECT * FROM recommendation''').result()
+        closed = [row for row in recs if row[7]]
+        OpenRecCache.load(Recommendation.parse_tuples([row for row in recs if not row[7]]))
+        Leaderboard.load(closed)
+        Analytics.load(closed)
+        Compatibility.load(closed)
+        SongIndex.load(recs)
         # if truncate:
         #     cls.cur.execute('DELETE FROM user')
         #     cls.cur.execute('DELETE FROM role')
@@ -94,281 +114,670 @@ class DB():
         #     cls.cur.execute('DELETE FROM recommendation')
 
     @classmethod
-    async def _add_user(cls, user: User) -> None:
-        cls.cur.execute('''INSERT INTO user VALUES(?)''', (user.discord_id,))
+    def close(cls) -> None:
+        if cls.writer is None:
+            return
+        cls.readers.shutdown()
+        for con in cls._reader_cons + cls._idle_streams:
+            con.close()
+        cls._reader_cons = []
+        cls._idle_streams = []
+        # Anything still waiting on a group commit is made durable before closing, and whoever
+        # is awaiting that batch is released with its outcome instead of being left hanging
+        batch, cls._batch = cls._batch, None
+        if cls._batch_timer is not None:
+            cls._batch_timer.cancel()
+            cls._batch_timer = None
+        try:
+            cls.writer.submit(cls.con.commit).result()
+        except Exception as e:
+            cls.writer.submit(cls.con.rollback).result()
+            if batch is not None and not batch.get_loop().is_closed():
+                batch.set_exception(e)
+        else:
+            if batch is not None and not batch.get_loop().is_closed():
+                batch.set_result(None)
+        cls.writer.submit(cls.con.close).result()
+        cls.writer.shutdown()
+        cls.writer = cls.readers = None
 
+    ##############################################
+    #
+    # Worker thread plumbing
+    #
+    ##############################################
     @classmethod
-    async def _does_user_exist(cls, user: User) -> bool:
-        cls.cur.execute('''SELECT * FROM user WHERE discord_id = ?''', (user.discord_id,))
-        return bool(cls.cur.fetchone())
+    def _connect_reader(cls) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{cls.path}?mode=ro", uri=True, check_same_thread=False)
 
+    # Runs once in each reader thread to give it its own read-only connection
     @classmethod
-    async def _add_mod_role(cls, role: Role, guild: Guild) -> None:
-        cls.cur.execute('''INSERT INTO role (discord_id, guild_id) VALUES(?, ?)''', (role.discord_id, guild.discord_id))
-        cls.cur.execute('''SELECT * FROM role''')
-        print(cls.cur.fetchall())
+    def _open_reader(cls) -> None:
+        con = cls._connect_reader()
+        cls._local.con = con
+        cls._reader_cons.append(con)
 
     @classmethod
-    def _get_mod_roles(cls) -> List[Tuple]:
-        cls.cur.execute('''SELECT * FROM role''')
-        return cls.cur.fetchall()
-    
+    async def _run(cls, executor: Executor, func: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
     @classmethod
-    async def _delete_mod_role(cls, role: Role) -> None:
-        cls.cur.execute('''DELETE FROM role WHERE discord_id = ?''', (role.discord_id,))
+    def _fetchone_sync(cls, sql: str, params: Any = ()) -> Optional[Tuple]:
+        return cls._local.con.execute(sql, params).fetchone()
 
     @classmethod
-    async def _add_song(cls, song: Song) -> None:
-        cls.cur.execute('''INSERT INTO song VALUES(?, ?)''', (song.name, song.artist))
-    
+    def _fetchall_sync(cls, sql: str, params: Any = ()) -> List[Tuple]:
+        return cls._local.con.execute(sql, params).fetchall()
+
+    # Read-only queries are served by the reader pool
     @classmethod
-    async def _does_song_exist(cls, song: Song) -> bool:
-        cls.cur.execute('''SELECT * FROM song WHERE song_name = ? and artist = ?''', (song.name, song.artist))
-        return bool(cls.cur.fetchone())
+    async def _fetchone(cls, sql: str, params: Any = ()) -> Optional[Tuple]:
+        return await cls._run(cls.readers, cls._fetchone_sync, sql, params)
 
     @classmethod
-    async def _add_thread(cls, thread: Thread) -> None:
-        cls.cur.execute(
-            '''INSERT INTO thread VALUES(?, ?, ?, ?, ?)''',
-            (thread.thread_id, thread.guild.discord_id, thread.user1.discord_id, thread.user2.discord_id, thread.next_user.discord_id)
-        )
+    async def _fetchall(cls, sql: str, params: Any = ()) -> List[Tuple]:
+        return await cls._run(cls.readers, cls._fetchall_sync, sql, params)
 
+    # Streams a query's rows in chunks of `size`, so a large result set is never held in memory
+    # at once. The query keeps its cursor on a connection of its own (reused from one stream to
+    # the next), and each chunk is a separate call on the reader pool, so no reader thread is
+    # held while the consumer awaits other work (such as another read) between chunks.
+    # Until the stream ends, its connection pins a WAL read snapshot, which checkpoints cannot
+    # get past, so consumers should keep what they await between rows short (DB calls, not
+    # Discord round trips).
     @classmethod
-    async def _delink_thread(cls, thread: Thread) -> None:
-        cls.cur.execute(
-            '''DELETE FROM thread WHERE thread_id = ?''',
-            (thread.thread_id,)
-        )
+    async def _iterate(cls, sql: str, params: Any = (), size: int = 256) -> AsyncIterator[List[Tuple]]:
+        if cls._idle_streams:
+            con = cls._idle_streams.pop()
+        else:
+            con = await cls._run(cls.readers, cls._connect_reader)
+        cur = con.cursor()
+        try:
+            await cls._run(cls.readers, cur.execute, sql, params)
+            while True:
+                chunk = await cls._run(cls.readers, cur.fetchmany, size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            # Resets the statement, which releases its read snapshot
+            await cls._run(cls.readers, cur.close)
+            cls._idle_streams.append(con)
 
+    # Like _iterate, but yields one model per row, built only as it is reached
     @classmethod
-    async def _get_all_threads(cls, guild: Guild) -> List[Thread]:
-        cls.cur.execute('''SELECT * FROM thread WHERE guild_id = ?''', (guild.discord_id,))
-        return Thread.parse_tuples(cls.cur.fetchall())
+    async def _iterate_models(
+        cls,
+        parse: Callable[[Tuple], T],
+        sql: str,
+        params: Any = (),
+        size: int = 256,
+    ) -> AsyncIterator[T]:
+        async for chunk in cls._iterate(sql, params, size):
+            for row in chunk:
+                yield parse(row)
 
     @classmethod
-    # Can be used with either a thread object or a thread id int
-    async def _does_thread_exist(cls, *, thread_id: int = None, thread: Thread = None) -> bool:
-        cls.cur.execute('''SELECT * FROM thread WHERE thread_id = ?''', (thread_id or thread.thread_id,))
-        return bool(cls.cur.fetchone())
+    def _transact_sync(cls, work: Callable[[sqlite3.Cursor], T]) -> T:
+        cur = cls.con.cursor()
+        try:
+            result = work(cur)
+            cls.con.commit()
+            return result
+        except Exception:
+            cls.con.rollback()
+            raise
+        finally:
+            cur.close()
 
+    # Inside DB.transaction(), each unit of work gets a savepoint instead of its own commit,
+    # so one that raises is undone without discarding the rest of the transaction.
     @classmethod
-    async def _add_rec_manual(cls, rec:Recommendation) -> None:
-        cls.cur.execute(
-                '''INSERT INTO recommendation VALUES(?, ?, ?, ?, ?, ?, ?, ?)''',
-                (
-                    rec.song.name, 
-                    rec.song.artist, 
-                    rec.rater.discord_id, 
-                    rec.suggester.discord_id,
-                    rec.guild.discord_id,
-                    rec.timestamp, 
-                    rec.rating, 
-                    rec.is_closed
-                )
-            )
+    def _savepoint_sync(cls, work: Callable[[sqlite3.Cursor], T]) -> T:
+        cur = cls.con.cursor()
+        cur.execute('''SAVEPOINT unit_of_work''')
+        try:
+            return work(cur)
+        except Exception:
+            cur.execute('''ROLLBACK TO unit_of_work''')
+            raise
+        finally:
+            cur.execute('''RELEASE unit_of_work''')
+            cur.close()
+
+    # In group commit mode, the writer connection keeps one transaction open per batch
+    @classmethod
+    def _begin_sync(cls, savepoint: str = None) -> None:
+        if not cls.con.in_transaction:
+            cls.con.execute('''BEGIN''')
+        if savepoint is not None:
+            cls.con.execute(f'''SAVEPOINT {savepoint}''')
+
+    @classmethod
+    def _batched_sync(cls, work: Callable[[sqlite3.Cursor], T]) -> T:
+        cls._begin_sync()
+        return cls._savepoint_sync(work)
+
+    @classmethod
+    def _rollback_savepoint_sync(cls, savepoint: str) -> None:
+        cls.con.execute(f'''ROLLBACK TO {savepoint}''')
+        cls.con.execute(f'''RELEASE {savepoint}''')
+
+    # Adds the caller to the pending batch (must hold the write lock) and returns the future
+    # that resolves once that batch is committed.
+    @classmethod
+    def _join_batch(cls) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if cls._batch is None:
+            cls._batch = loop.create_future()
+            cls._batch_size = 0
+            cls._batch_timer = loop.call_later(cls.group_commit_window, cls._schedule_flush, cls._batch)
+        batch = cls._batch
+        cls._batch_size += 1
+        if cls._batch_size >= cls.group_commit_size:
+            cls._batch_timer.cancel()
+            cls._schedule_flush(batch)
+        return batch
+
+    @classmethod
+    def _schedule_flush(cls, batch: asyncio.Future) -> None:
+        task = asyncio.ensure_future(cls._flush(batch))
+        cls._flush_tasks.add(task)
+        task.add_done_callback(cls._flush_tasks.discard)
+
+    @classmethod
+    async def _flush(cls, batch: asyncio.Future) -> None:
+        async with cls._write_lock:
+            if cls._batch is not batch:
+                return
+            cls._batch = None
+            try:
+                await cls._run(cls.writer, cls.con.commit)
+            except Exception as e:
+                await cls._run(cls.writer, cls.con.rollback)
+                batch.set_exception(e)
+            else:
+                batch.set_result(None)
+
+    # A failed write that opened a batch by itself leaves an empty transaction behind
+    @classmethod
+    async def _discard_idle_batch(cls) -> None:
+        if cls._batch is None:
+            await cls._run(cls.writer, cls.con.rollback)
+
+    # Runs `work(cur)` on the writer thread and commits it, or rolls it back if it raises.
+    # Within DB.transaction() the commit is deferred to the end of the block, and in group
+    # commit mode it is shared with the other writes in the batch. Either way, this only
+    # returns once the write is durable.
+    @classmethod
+    async def _write(cls, work: Callable[[sqlite3.Cursor], T]) -> T:
+        if cls._transaction.get() is not None:
+            return await cls._run(cls.writer, cls._savepoint_sync, work)
+        if cls.group_commit_window is None:
+            async with cls._write_lock:
+                return await cls._run(cls.writer, cls._transact_sync, work)
+        async with cls._write_lock:
+            try:
+                result = await cls._run(cls.writer, cls._batched_sync, work)
+            except Exception:
+                await cls._discard_idle_batch()
+                raise
+            batch = cls._join_batch()
+        await asyncio.shield(batch)
+        return result
 
+    # Groups several DB calls into a single commit:
+    #
+    #   async with DB.transaction():
+    #       await DB.flip_thread(thread)
+    #       await DB.create_open_rec(rec)
+    #
+    # Everything is rolled back if the block raises. Nested blocks, and tasks started inside
+    # the block, join the outer transaction.
+    # Reads inside the block are served by the reader pool, so they do not see its writes yet.
     @classmethod
-    async def _create_open_rec(cls, rec: Recommendation) -> None:
-        cls.cur.execute(
+    @asynccontextmanager
+    async def transaction(cls) -> AsyncIterator[None]:
+        if cls._transaction.get() is not None:
+            yield
+            return
+        if cls.group_commit_window is not None:
+            async with cls._batched_transaction():
+                yield
+            return
+        pending: List[Callable[[], None]] = []
+        async with cls._write_lock:
+            token = cls._transaction.set(pending)
+            try:
+                await cls._run(cls.writer, cls.con.execute, '''BEGIN''')
+                try:
+                    yield
+                    await cls._run(cls.writer, cls.con.commit)
+                except BaseException:
+                    await cls._run(cls.writer, cls.con.rollback)
+                    raise
+            finally:
+                cls._transaction.reset(token)
+        for callback in pending:
+            callback()
+
+    # Group commit flavour of DB.transaction(): the block is a savepoint inside the open batch,
+    # so failing only undoes the block, and succeeding waits for the batch to commit.
+    @classmethod
+    @asynccontextmanager
+    async def _batched_transaction(cls) -> AsyncIterator[None]:
+        pending: List[Callable[[], None]] = []
+        async with cls._write_lock:
+            token = cls._transaction.set(pending)
+            try:
+                await cls._run(cls.writer, cls._begin_sync, '''txn''')
+                try:
+                    yield
+                    await cls._run(cls.writer, cls.con.execute, '''RELEASE txn''')
+                except BaseException:
+                    await cls._run(cls.writer, cls._rollback_savepoint_sync, '''txn''')
+                    await cls._discard_idle_batch()
+                    raise
+                batch = cls._join_batch()
+            finally:
+                cls._transaction.reset(token)
+        await asyncio.shield(batch)
+        for callback in pending:
+            callback()
+
+    @classmethod
+    def _bump_generation(cls) -> None:
+        cls.generation += 1
+
+    # Feed a committed closed rating (or its removal) to the in-memory views built on ratings
+    @classmethod
+    def _rating_added(cls, rec: Recommendation, rating: float) -> None:
+        Leaderboard.add(rec.guild, rec.rater, rec.suggester, rating)
+        Analytics.add(rec, rating)
+        Compatibility.add(rec, rating)
+        SongIndex.add_to_pair(rec)
+
+    @classmethod
+    def _rating_removed(cls, rec: Recommendation, rating: float) -> None:
+        Leaderboard.remove(rec.guild, rec.rater, rec.suggester, rating)
+        Analytics.remove(rec, rating)
+        Compatibility.remove(rec, rating)
+        SongIndex.remove_from_pair(rec)
+
+    # Keeps in-memory caches write-through: runs `callback` once the current write is durable,
+    # which inside DB.transaction() means when the block commits (and never, if it rolls back).
+    @classmethod
+    def _on_commit(cls, callback: Callable[[], None]) -> None:
+        pending = cls._transaction.get()
+        if pending is None:
+            callback()
+        else:
+            pending.append(callback)
+
+    ##############################################
+    #
+    # Statement helpers, called from inside a unit of work on the worker thread
+    #
+    ##############################################
+    # Adds any of the given users that are not already stored
+    @staticmethod
+    def _add_users(cur: sqlite3.Cursor, *users: User) -> None:
+        cur.executemany(
+            '''INSERT INTO user VALUES(?) ON CONFLICT DO NOTHING''',
+            [(user.discord_id,) for user in users]
+        )
+
+    @staticmethod
+    def _does_user_exist(cur: sqlite3.Cursor, user: User) -> bool:
+        cur.execute('''SELECT * FROM user WHERE discord_id = ?''', (user.discord_id,))
+        return bool(cur.fetchone())
+
+    @staticmethod
+    def _add_mod_role(cur: sqlite3.Cursor, role: Role, guild: Guild) -> None:
+        cur.execute('''INSERT INTO role (discord_id, guild_id) VALUES(?, ?)''', (role.discord_id, guild.discord_id))
+
+    @staticmethod
+    def _delete_mod_role(cur: sqlite3.Cursor, role: Role) -> None:
+        cur.execute('''DELETE FROM role WHERE discord_id = ?''', (role.discord_id,))
+
+    @staticmethod
+    def _add_song(cur: sqlite3.Cursor, song: Song) -> None:
+        cur.execute('''INSERT INTO song VALUES(?, ?) ON CONFLICT DO NOTHING''', (song.name, song.artist))
+    
+    @staticmethod
+    def _does_song_exist(cur: sqlite3.Cursor, song: Song) -> bool:
+        cur.execute('''SELECT * FROM song WHERE song_name = ? and artist = ?''', (song.name, song.artist))
+        return bool(cur.fetchone())
+
+    # Returns False if the thread was already linked
+    @staticmethod
+    def _add_thread(cur: sqlite3.Cursor, thread: Thread) -> bool:
+        cur.execute(
+            '''INSERT INTO thread VALUES(?, ?, ?, ?, ?) ON CONFLICT DO NOTHING''',
+            (thread.thread_id, thread.guild.discord_id, thread.user1.discord_id, thread.user2.discord_id, thread.next_user.discord_id)
+        )
+        return cur.rowcount == 1
+
+    @staticmethod
+    def _delink_thread(cur: sqlite3.Cursor, thread: Thread) -> None:
+        cur.execute(
+            '''DELETE FROM thread WHERE thread_id = ?''',
+            (thread.thread_id,)
+        )
+
+    # Inserts the rec unless the same closed rating is already stored; returns whether it did.
+    # recommendation has no unique key, so the existence check is folded into the INSERT itself.
+    @staticmethod
+    def _add_rec_manual(cur: sqlite3.Cursor, rec:Recommendation) -> bool:
+        cur.execute('''
+                INSERT INTO recommendation
+                SELECT :song_name, :artist, :rater_id, :suggester_id, :guild_id, :timestamp, :rating, :is_closed
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM recommendation
+                    WHERE song_name = :song_name AND artist = :artist AND rater_id = :rater_id
+                    AND suggester_id = :suggester_id AND guild_id = :guild_id AND is_closed = 1
+                )
+            ''',
+            {
+                "song_name": rec.song.name,
+                "artist": rec.song.artist,
+                "rater_id": rec.rater.discord_id,
+                "suggester_id": rec.suggester.discord_id,
+                "guild_id": rec.guild.discord_id,
+                "timestamp": rec.timestamp,
+                "rating": rec.rating,
+                "is_closed": rec.is_closed,
+            }
+        )
+        return cur.rowcount == 1
+
+    @staticmethod
+    def _create_open_rec(cur: sqlite3.Cursor, rec: Recommendation) -> None:
+        cur.execute(
             '''INSERT INTO recommendation VALUES(?, ?, ?, ?, ?, ?, -1, 0)''',
             (rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id, rec.timestamp)
         )
 
-    @classmethod
-    async def _close_rec(cls, rec: Recommendation) -> None:
-        cls.cur.execute('''
+    # Set only_open to close a rec, which fails (returning False) if it is not currently open
+    @staticmethod
+    def _set_rating(cur: sqlite3.Cursor, rec: Recommendation, only_open: bool = False) -> bool:
+        cur.execute('''
                 UPDATE recommendation SET rating = ?, is_closed = 1 
                 WHERE song_name = ? AND artist = ? AND rater_id = ? AND suggester_id = ? AND guild_id = ?
-            ''',
+            ''' + ('''AND is_closed = 0''' if only_open else ''''''),
             (rec.rating, rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id)
         )
-    @classmethod
-    async def _delete_rec(cls, rec: Recommendation) -> None:
-        cls.cur.execute('''
+        return cur.rowcount > 0
+
+    @staticmethod
+    def _remove_rec(cur: sqlite3.Cursor, rec: Recommendation) -> None:
+        cur.execute('''
                 DELETE FROM recommendation
                 WHERE song_name = ? AND artist = ? AND rater_id = ? AND suggester_id = ? AND guild_id = ?
             ''',
             (rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id)
         )
 
-    @classmethod
-    async def _does_rating_exist(cls, rec: Recommendation, is_closed: int = 1) -> bool:
-        cls.cur.execute('''
+    # The ratings currently stored for the closed rec(s) matching `rec`
+    @staticmethod
+    def _closed_ratings(cur: sqlite3.Cursor, rec: Recommendation) -> List[float]:
+        cur.execute('''
+                SELECT rating FROM recommendation
+                WHERE song_name = ? AND artist = ? AND rater_id = ? AND suggester_id = ? AND guild_id = ? AND is_closed
+            ''',
+            (rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id)
+        )
+        return [row[0] for row in cur.fetchall()]
+
+    # The timestamp of every row (open or closed) matching `rec`, i.e. of what _set_rating updates
+    @staticmethod
+    def _rec_timestamps(cur: sqlite3.Cursor, rec: Recommendation) -> List[str]:
+        cur.execute('''
+                SELECT timestamp FROM recommendation
+                WHERE song_name = ? AND artist = ? AND rater_id = ? AND suggester_id = ? AND guild_id = ?
+            ''',
+            (rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id)
+        )
+        return [row[0] for row in cur.fetchall()]
+
+    @staticmethod
+    def _does_rating_exist(cur: sqlite3.Cursor, rec: Recommendation, is_closed: int = 1) -> bool:
+        cur.execute('''
                 SELECT * FROM recommendation 
                 WHERE song_name = ? AND artist = ? AND rater_id = ? AND suggester_id = ? AND guild_id = ? AND is_closed = ?
             ''',
             (rec.song.name, rec.song.artist, rec.rater.discord_id, rec.suggester.discord_id, rec.guild.discord_id, is_closed)
         )
-        return bool(cls.cur.fetchone())
+        return bool(cur.fetchone())
+
+    ##############################################
+    #
+    # Public API
+    #
+    ##############################################
+    # Directly (re)writes the rating of a rec, e.g. for /rec rerate. Every matching row is
+    # rewritten, and each keeps its own timestamp.
+    @classmethod
+    async def _close_rec(cls, rec: Recommendation) -> None:
+        def work(cur: sqlite3.Cursor) -> Tuple[List[float], List[str]]:
+            old_ratings = cls._closed_ratings(cur, rec)
+            timestamps = cls._rec_timestamps(cur, rec)
+            cls._set_rating(cur, rec)
+            return old_ratings, timestamps
+        old_ratings, timestamps = await cls._write(work)
+        def on_commit() -> None:
+            OpenRecCache.discard(rec)
+            for rating in old_ratings:
+                cls._rating_removed(rec, rating)
+            for timestamp in timestamps:
+                cls._rating_added(replace(rec, timestamp=timestamp), rec.rating)
+            cls._bump_generation()
+        cls._on_commit(on_commit)
+
+    @classmethod
+    async def _delete_rec(cls, rec: Recommendation) -> None:
+        def work(cur: sqlite3.Cursor) -> Tuple[List[float], int]:
+            old_ratings = cls._closed_ratings(cur, rec)
+            cls._remove_rec(cur, rec)
+            return old_ratings, cur.rowcount
+        old_ratings, deleted = await cls._write(work)
+        def on_commit() -> None:
+            OpenRecCache.discard(rec)
+            for rating in old_ratings:
+                cls._rating_removed(rec, rating)
+            for _ in range(deleted):
+                SongIndex.remove_from_guild(rec)
+            cls._bump_generation()
+        cls._on_commit(on_commit)
 
     @classmethod
     async def create_mod_role(cls, role: Role, guild: Guild) -> None:
-        await cls._add_mod_role(role=role, guild=guild)
-        cls.con.commit()
+        await cls._write(lambda cur: cls._add_mod_role(cur, role=role, guild=guild))
+        cls._on_commit(lambda: RoleCache.add(role, guild))
 
+    # Synchronous, as this is only used to warm the role cache at startup
     @classmethod
-    def get_mod_roles(cls) -> List[Role]:
-        return cls._get_mod_roles()
+    def get_mod_roles(cls) -> List[Tuple]:
+        return cls.readers.submit(cls._fetchall_sync, '''SELECT * FROM role''').result()
     
     @classmethod 
     async def remove_mod_role(cls, role: Role) -> None:
-        await cls._delete_mod_role(role)
-        cls.con.commit()
+        await cls._write(lambda cur: cls._delete_mod_role(cur, role))
+        cls._on_commit(lambda: RoleCache.remove(role))
 
     @classmethod
     async def get_threads_by_guild(cls, guild: Guild) -> List[Thread]:
-        return await cls._get_all_threads(guild=guild)
+        return Thread.parse_tuples(
+            await cls._fetchall('''SELECT * FROM thread WHERE guild_id = ?''', (guild.discord_id,))
+        )
+
+    @classmethod
+    def iter_threads_by_guild(cls, guild: Guild) -> AsyncIterator[Thread]:
+        return cls._iterate_models(
+            Thread.parse_tuple, '''SELECT * FROM thread WHERE guild_id = ?''', (guild.discord_id,)
+        )
 
     @classmethod
     async def debug_fetch_db(cls, which_db: str):
         match which_db:
             case "user":
-                cls.cur.execute('''SELECT * FROM user''')
+                return await cls._fetchall('''SELECT * FROM user''')
             case "thread":
-                cls.cur.execute('''SELECT * FROM thread''')
+                return await cls._fetchall('''SELECT * FROM thread''')
             case "song":
-                cls.cur.execute('''SELECT * FROM song''')
+                return await cls._fetchall('''SELECT * FROM song''')
             case "recommendation":
-                cls.cur.execute('''SELECT * FROM recommendation''')
-        return cls.cur.fetchall()
+                return await cls._fetchall('''SELECT * FROM recommendation''')
 
     @classmethod
     async def does_thread_have_open_rec(cls, thread: Thread) -> bool:
-        cls.cur.execute('''
-                SELECT * FROM recommendation
-                WHERE rater_id = ? AND suggester_id = ? AND is_closed = 0
-            ''',
-            (thread.next_user.discord_id, thread.other_user.discord_id)
-        )
-        return bool(cls.cur.fetchone())
+        return OpenRecCache.fetch(thread.next_user, thread.other_user) is not None
 
     # Create an open recommendation, and add any users, artists, and songs that are not currently stored.
     @classmethod
     async def create_open_rec(cls, rec: Recommendation) -> None:
-        if not await cls._does_user_exist(rec.rater):
-            await cls._add_user(rec.rater)
-        if not await cls._does_user_exist(rec.suggester):
-            await cls._add_user(rec.suggester)
-        if not await cls._does_song_exist(rec.song):
-            await cls._add_song(rec.song)
-
-        await cls._create_open_rec(rec) 
-        cls.con.commit()
+        def work(cur: sqlite3.Cursor) -> None:
+            cls._add_users(cur, rec.rater, rec.suggester)
+            cls._add_song(cur, rec.song)
+            cls._create_open_rec(cur, rec)
+        await cls._write(work)
+        def on_commit() -> None:
+            OpenRecCache.put(rec)
+            SongIndex.add_to_guild(rec)
+        cls._on_commit(on_commit)
 
     # Close an open recommendation by providing a rating. 
     @classmethod
     async def close_rec(cls, rec: Recommendation) -> None:
-        if await cls._does_rating_exist(rec, is_closed = 0):
-            await cls._close_rec(rec)
-            cls.con.commit()
-        else:
-            raise ValueError("Attempted to close a non-existent rec.")
-        
+        def work(cur: sqlite3.Cursor) -> None:
+            if not cls._set_rating(cur, rec, only_open=True):
+                raise ValueError("Attempted to close a non-existent rec.")
+        await cls._write(work)
+        def on_commit() -> None:
+            OpenRecCache.discard(rec)
+            cls._rating_added(rec, rec.rating)
+            cls._bump_generation()
+        cls._on_commit(on_commit)
 
     # Manually add a (most likely closed) rating
     @classmethod
     async def add_rating_manual(cls, rec: Recommendation) -> None:
-        if not await cls._does_user_exist(rec.rater):
-            await cls._add_user(rec.rater)
-        if not await cls._does_user_exist(rec.suggester):
-            await cls._add_user(rec.suggester)
-        if not await cls._does_song_exist(rec.song):
-            await cls._add_song(rec.song)
-        if await cls._does_rating_exist(rec):
-            raise ValueError("Attempted to create a pre-existing rec.")
-        else:
-            await cls._add_rec_manual(rec)
-            cls.con.commit()
+        def work(cur: sqlite3.Cursor) -> None:
+            cls._add_users(cur, rec.rater, rec.suggester)
+            cls._add_song(cur, rec.song)
+            if not cls._add_rec_manual(cur, rec):
+                raise ValueError("Attempted to create a pre-existing rec.")
+        await cls._write(work)
+        def on_commit() -> None:
+            if rec.is_closed:
+                cls._rating_added(rec, rec.rating)
+            else:
+                OpenRecCache.put(rec)
+            SongIndex.add_to_guild(rec)
+            cls._bump_generation()
+        cls._on_commit(on_commit)
 
     @classmethod
     async def create_thread(cls, thread: Thread) -> None:
-        if not await cls._does_user_exist(thread.user1):
-            await cls._add_user(thread.user1)
-        if not await cls._does_user_exist(thread.user2):
-            await cls._add_user(thread.user2)
-        if await cls._does_thread_exist(thread=thread):
-            raise ValueError("Attempted to create a pre-existing thread")
-        else:
-            await cls._add_thread(thread)
-            cls.con.commit()
+        def work(cur: sqlite3.Cursor) -> None:
+            cls._add_users(cur, thread.user1, thread.user2)
+            if not cls._add_thread(cur, thread):
+                raise ValueError("Attempted to create a pre-existing thread")
+        await cls._write(work)
+        cls._on_commit(lambda: ThreadCache.put(thread))
 
     @classmethod
     async def delink_thread(cls, thread: Thread) -> None:
-        await cls._delink_thread(thread)
-        cls.con.commit()
+        await cls._write(lambda cur: cls._delink_thread(cur, thread))
+        cls._on_commit(lambda: ThreadCache.remove(thread.thread_id))
 
+    # Served from the in-memory registry, which is loaded at startup and kept in step with
+    # create_thread, flip_thread and delink_thread
     @classmethod
     async def get_thread_by_id(cls, thread_id: int) -> Thread:
-        if await cls._does_thread_exist(thread_id=thread_id):
-            cls.cur.execute(
-                '''SELECT * FROM thread where thread_id = ?''',
-                (thread_id,)
-            )
-            return Thread.parse_tuple(cls.cur.fetchone())
-        else:
+        thread = ThreadCache.fetch(thread_id)
+        if thread is None:
             raise ValueError("Command not used in an established thread.")
+        return thread
 
     @classmethod
     async def flip_thread(cls, thread: Thread, next_user: User = None) -> Thread:
         next_user = next_user or thread.other_user
-        if await cls._does_thread_exist(thread=thread):
-            cls.cur.execute(
-                '''UPDATE thread SET next_user = ? WHERE thread_id = ?''',
-                (next_user.discord_id, thread.thread_id)
-            )
-            cls.con.commit()
+        await cls._write(lambda cur: cur.execute(
+            '''UPDATE thread SET next_user = ? WHERE thread_id = ?''',
+            (next_user.discord_id, thread.thread_id)
+        ))
         thread.next_user = next_user
+        flipped = replace(thread)
+        cls._on_commit(lambda: ThreadCache.flip(flipped))
         return thread
 
     @classmethod
     async def get_waiting_threads_by_user(cls, user: User, guild: Guild = None) -> List[Thread]:
         if guild is not None:
-            cls.cur.execute('''
+            rows = await cls._fetchall('''
                     SELECT * FROM thread WHERE next_user = ? AND guild_id = ?
                 ''',
                 (user.discord_id, guild.discord_id)
             )
         else:
-            cls.cur.execute('''
+            rows = await cls._fetchall('''
                     SELECT * FROM thread WHERE next_user = ?
                 ''',
                 (user.discord_id,)    
             )
-        return Thread.parse_tuples(cls.cur.fetchall())
+        return Thread.parse_tuples(rows)
 
-    # Fetch the open rec (if any) in a thread
+    # Fetch the open rec (if any) in a thread, from the in-memory open rec cache
     @classmethod
     async def get_open_rating_by_thread(cls, thread: Thread) -> Optional[Recommendation]:
-        cls.cur.execute('''
-                SELECT * FROM recommendation
-                WHERE rater_id = ? AND suggester_id = ? AND is_closed = 0
-            ''',
-            (thread.next_user.discord_id, thread.other_user.discord_id)    
-        )
-        return Recommendation.parse_tuple(cls.cur.fetchone())
+        return OpenRecCache.fetch(thread.next_user, thread.other_user)
     
     @classmethod
     async def get_ratings_by_suggester(cls, suggester: User, is_closed = 1) -> List[Recommendation]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
                 WHERE suggester_id = ? AND is_closed = ?
             ''', 
             (suggester.discord_id, is_closed)
         )
         # Parse elements into dataclass in schema order 
-        return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
 
     # These two functions fetch all recommendations for a specific rater, either closed or open.
     @classmethod
     async def get_ratings_by_rater(cls, rater: User, is_closed = 1) -> List[Recommendation]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
                 WHERE rater_id = ? AND is_closed = ?
             ''', 
             (rater.discord_id, is_closed)
         )
         # Parse elements into dataclass in schema order 
-        return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
+
+    # Streaming versions of the two above, for result sets too large to hold at once
+    @classmethod
+    def iter_ratings_by_suggester(cls, suggester: User, is_closed = 1) -> AsyncIterator[Recommendation]:
+        return cls._iterate_models(
+            Recommendation.parse_tuple,
+            '''
+                SELECT * FROM recommendation 
+                WHERE suggester_id = ? AND is_closed = ?
+            ''',
+            (suggester.discord_id, is_closed)
+        )
+
+    @classmethod
+    def iter_ratings_by_rater(cls, rater: User, is_closed = 1) -> AsyncIterator[Recommendation]:
+        return cls._iterate_models(
+            Recommendation.parse_tuple,
+            '''
+                SELECT * FROM recommendation 
+                WHERE rater_id = ? AND is_closed = ?
+            ''',
+            (rater.discord_id, is_closed)
+        )
 
     @classmethod
     async def get_open_recs_by_rater(cls, rater: User) -> List[Recommendation]:
@@ -377,56 +786,261 @@ class DB():
     # Fetch all recommendations of a specific song
     @classmethod
     async def get_ratings_by_song(cls, song: Song) -> List[Recommendation]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
                 WHERE song_name = ? AND artist = ? AND is_closed = 1
             ''', 
             (song.name, song.artist)
         )
-        return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
 
     # Used for rerate() method
     @classmethod
     async def get_ratings_by_song_and_pair(cls, song: Song, rater: User, suggester:User) -> List[Recommendation]:
-        print(f'''
-                SELECT * FROM recommendation 
-                WHERE song_name = {song.name} AND artist = {song.artist} AND is_closed = 1 AND rater_id = {rater.discord_id} AND suggester_id = {suggester.discord_id}
-            ''')
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
                 WHERE song_name = ? AND artist = ? AND is_closed = 1 AND rater_id = ? AND suggester_id = ?
             ''', 
             (song.name, song.artist, rater.discord_id, suggester.discord_id)
         )
-        return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
     
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        text = text.casefold()
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    # FTS5 query matching any of `trigrams` in `column`
+    @staticmethod
+    def _trigram_query(column: str, trigrams: Set[str]) -> Optional[str]:
+        if not trigrams:
+            return None
+        return f"{column} : (" + " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in sorted(trigrams)) + ")"
+
+    # Candidate songs for a fuzzy search, from the song_search index: trigrams found in more
+    # than half the songs are left out (bm25 gives them no weight, but scoring every song they
+    # match is most of a search's cost). Only songs the pair has rated are ranked, so other
+    # users' songs cannot crowd theirs out of the `candidates` best, which are joined to the
+    # pair's ratings, at most `limit` of which are returned.
+    @classmethod
+    def _search_trigrams_sync(cls, song: Song, rater: User, suggester: User, limit: int, candidates: int) -> List[Tuple]:
+        con = cls._local.con
+        names, artists = cls._trigrams(song.name), cls._trigrams(song.artist)
+        if not names and not artists:
+            return []
+        songs = con.execute('''SELECT MAX(rowid) FROM song_search''').fetchone()[0] or 0
+        terms = sorted(names | artists)
+        docs = dict(con.execute(
+            f'''SELECT term, doc FROM song_search_vocab WHERE term IN ({", ".join("?" * len(terms))})''',
+            terms
+        ))
+        common = {term for term, count in docs.items() if count > songs / 2}
+        # In a small library every trigram any song has may be common, in which case all are kept
+        if common >= docs.keys():
+            common = set()
+        query = " OR ".join(filter(None, (
+            cls._trigram_query("song_name", names - common),
+            cls._trigram_query("artist", artists - common),
+        )))
+        return con.execute('''
+                SELECT recommendation.* FROM (
+                    SELECT song_name, artist, bm25(song_search, 2.0, 1.0) AS score FROM song_search
+                    WHERE song_search MATCH :query
+                    AND EXISTS (
+                        SELECT 1 FROM recommendation
+                        WHERE recommendation.song_name = song_search.song_name
+                        AND recommendation.artist = song_search.artist
+                        AND rater_id = :rater AND suggester_id = :suggester AND is_closed = 1
+                    )
+                    ORDER BY score
+                    LIMIT :candidates
+                ) AS candidate
+                    JOIN recommendation
+                        ON recommendation.song_name = candidate.song_name
+                        AND recommendation.artist = candidate.artist
+                WHERE is_closed = 1 AND rater_id = :rater AND suggester_id = :suggester
+                ORDER BY candidate.score
+                LIMIT :limit
+            ''',
+            {
+                "query": query,
+                "candidates": candidates,
+                "rater": rater.discord_id,
+                "suggester": suggester.discord_id,
+                "limit": limit,
+            }
+        ).fetchall()
+
+    # Without FTS5, or for a small pair, the pair's ratings are ranked by how many trigrams of
+    # the search each contains instead (names counting double, as in bm25 above)
+    @classmethod
+    def _search_like_sync(cls, song: Song, rater: User, suggester: User, limit: int) -> List[Tuple]:
+        columns = [("song_name", 2, trigram) for trigram in cls._trigrams(song.name)]
+        columns += [("artist", 1, trigram) for trigram in cls._trigrams(song.artist)]
+        if not columns:
+            return []
+        hits = " + ".join(f"{weight} * ({column} LIKE ? ESCAPE '\\')" for column, weight, _ in columns)
+        patterns = [
+            "%" + trigram.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            for _, _, trigram in columns
+        ]
+        return [row[:-1] for row in cls._local.con.execute(f'''
+                SELECT * FROM (
+                    SELECT *, {hits} AS hits FROM recommendation
+                    WHERE is_closed = 1 AND rater_id = ? AND suggester_id = ?
+                )
+                WHERE hits > 0
+                ORDER BY hits DESC
+                LIMIT ?
+            ''',
+            (*patterns, rater.discord_id, suggester.discord_id, limit)
+        )]
+
+    # Fuzzy version of get_ratings_by_song_and_pair, for typos in /rec rerate. Candidates are
+    # the songs sharing the most (and rarest) trigrams with the search; they are then scored by
+    # how closely they match, best first, as (score in 0-1, rec). The trigram index is only
+    # used for pairs with more than `fuzzy_scan_limit` ratings.
+    @classmethod
+    async def search_ratings_by_song_and_pair(
+        cls,
+        song: Song,
+        rater: User,
+        suggester: User,
+        limit: int = 5,
+    ) -> List[Tuple[float, Recommendation]]:
+        pair = await cls._fetchone(
+            '''SELECT count FROM pair_stats WHERE rater_id = ? AND suggester_id = ?''',
+            (rater.discord_id, suggester.discord_id)
+        )
+        if pair is None:
+            return []
+        if cls.trigram_search and pair[0] > cls.fuzzy_scan_limit:
+            rows = await cls._run(cls.readers, cls._search_trigrams_sync, song, rater, suggester, limit * 4, 500)
+        else:
+            rows = await cls._run(cls.readers, cls._search_like_sync, song, rater, suggester, limit * 4)
+        name, artist = song.name.casefold(), song.artist.casefold()
+        scored = [
+            (
+                (
+                    2 * SequenceMatcher(None, name, rec.song.name.casefold()).ratio()
+                    + SequenceMatcher(None, artist, rec.song.artist.casefold()).ratio()
+                ) / 3,
+                rec
+            )
+            for rec in Recommendation.parse_tuples(rows)
+        ]
+        scored.sort(key=lambda match: -match[0])
+        return scored[:limit]
+
     # Fetch all recommendations of a specific artist
     @classmethod
     async def get_ratings_by_artist(cls, artist) -> List[Recommendation]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
+                SELECT * FROM recommendation 
+                WHERE artist = ? AND is_closed = 1
+            ''', (artist,)
+        )
+        return Recommendation.parse_tuples(rows)
+
+    @classmethod
+    def iter_ratings_by_artist(cls, artist) -> AsyncIterator[Recommendation]:
+        return cls._iterate_models(
+            Recommendation.parse_tuple,
+            '''
                 SELECT * FROM recommendation 
                 WHERE artist = ? AND is_closed = 1
             ''', (artist,)
         )
-        return Recommendation.parse_tuples(cls.cur.fetchall())
 
     # Takes two user IDs and returns all ratings between the two
     @classmethod
     async def get_ratings_by_pair(cls, a: User, b: User) -> List[Recommendation]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
                 WHERE rater_id IN (:a, :b) and suggester_id in (:a, :b) AND is_closed = 1
                 ORDER BY timestamp desc
             ''', 
             {"a": a.discord_id, "b": b.discord_id}
         )
-        return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
+
+    # Streams the whole history between two users, newest first, e.g. for exporting it
+    @classmethod
+    def iter_ratings_by_pair(cls, a: User, b: User) -> AsyncIterator[Recommendation]:
+        return cls._iterate_models(
+            Recommendation.parse_tuple,
+            '''
+                SELECT * FROM recommendation 
+                WHERE rater_id IN (:a, :b) and suggester_id in (:a, :b) AND is_closed = 1
+                ORDER BY timestamp desc
+            ''', 
+            {"a": a.discord_id, "b": b.discord_id}
+        )
+
+    # One page of the ratings between two users, newest first. Pages are keyset-paginated on
+    # (timestamp, rowid), so every page costs the same however long the history is: pass a
+    # page's `last` cursor for the next (older) page, or its `first` with older=False for the
+    # previous (newer) one. No cursor gives the newest page.
+    # Each direction of the pair is its own ordered range of idx_rec_rater_suggester, read only
+    # as far as one page, and the two are merged.
+    @classmethod
+    async def get_ratings_page_by_pair(
+        cls,
+        a: User,
+        b: User,
+        limit: int = 8,
+        cursor: Optional[Cursor] = None,
+        older: bool = True,
+    ) -> Page:
+        if cursor is None:
+            older = True
+        if older:
+            bound, order = "(timestamp, rowid) < (:timestamp, :rowid)", "DESC"
+        else:
+            bound, order = "(timestamp, rowid) > (:timestamp, :rowid)", "ASC"
+        directions = dict.fromkeys(((a.discord_id, b.discord_id), (b.discord_id, a.discord_id)))
+        branches = " UNION ALL ".join(f'''
+                SELECT * FROM (
+                    SELECT *, rowid FROM recommendation
+                    WHERE rater_id = :rater{i} AND suggester_id = :suggester{i} AND is_closed = 1
+                    {f"AND {bound}" if cursor is not None else ""}
+                    ORDER BY timestamp {order}, rowid {order}
+                    LIMIT :limit
+                )'''
+            for i in range(len(directions))
+        )
+        rows = await cls._fetchall(f'''{branches}
+                ORDER BY timestamp {order}, rowid {order}
+                LIMIT :limit
+            ''',
+            {
+                **{f"rater{i}": rater for i, (rater, _) in enumerate(directions)},
+                **{f"suggester{i}": suggester for i, (_, suggester) in enumerate(directions)},
+                "timestamp": cursor[0] if cursor is not None else None,
+                "rowid": cursor[1] if cursor is not None else None,
+                # One extra row tells us whether there is another page beyond this one
+                "limit": limit + 1,
+            }
+        )
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if not older:
+            rows.reverse()
+        if not rows:
+            return Page(recs=[])
+        return Page(
+            recs=Recommendation.parse_tuples(rows),
+            first=(rows[0][5], rows[0][8]),
+            last=(rows[-1][5], rows[-1][8]),
+            has_newer=more if not older else cursor is not None,
+            has_older=more if older else True,
+        )
 
 
     #takes two user IDs as inputs and returns all songs they have both rated
     @classmethod
     async def get_overlap(cls, rater_a: User, rater_b: User) -> List[Tuple[Recommendation]]:
-        cls.cur.execute('''
+        rows = await cls._fetchall('''
                 SELECT 
                     a.song_name, a.artist, a.guild_id,
                     a.suggester_id, a.timestamp, a.rating_a, 
@@ -446,186 +1060,203 @@ class DB():
         return [
             (
                 Recommendation(
-                    song=Song(name=item[0], artist=item[1]),
+                    song=Song.of(item[0], item[1]),
                     rater=rater_a,
-                    suggester=User(discord_id=item[3]),
-                    guild=Guild(item[2]),
+                    suggester=User.of(item[3]),
+                    guild=Guild.of(item[2]),
                     timestamp=item[4],
                     rating=item[5],
                     is_closed=True
                 ),
                 Recommendation(
-                    song=Song(name=item[0], artist=item[1]),
+                    song=Song.of(item[0], item[1]),
                     rater=rater_b,
-                    suggester=User(discord_id=item[6]),
-                    guild=Guild(item[2]),
+                    suggester=User.of(item[6]),
+                    guild=Guild.of(item[2]),
                     timestamp=item[7],
                     rating=item[8],
                     is_closed=True
                 )
             )
-            for item in cls.cur.fetchall()
+            for item in rows
         ]
     
+    # The aggregate getters below read the pair_stats/suggester_stats tables (see migrations.py),
+    # which triggers keep up to date, so they cost O(result) however much history there is.
+
     #This returns a list, even though it is a superlative, because two recommendations may share a max rating   
     @classmethod
     async def get_max_rating(cls, suggester : User, rater : User = None) -> List[Recommendation]:
-        #print("suggester: {suggester}, rater: {rater}".format(suggester=suggester.discord_id, rater=rater.discord_id))        
         if rater == None:
-            print 
-            cls.cur.execute('''
+            rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
-                    WHERE suggester_id = :suggester
+                    WHERE suggester_id = :suggester AND is_closed = 1
                     AND rating = (
-                        SELECT MAX(rating) FROM recommendation WHERE suggester_id = :suggester
+                        SELECT max_rating FROM suggester_stats WHERE suggester_id = :suggester
                     )
                 ''',
                 {"suggester": suggester.discord_id}
-                
             )
-            return Recommendation.parse_tuples(cls.cur.fetchall())            
         else:
-            cls.cur.execute('''
+            rows = await cls._fetchall('''
                 SELECT * FROM recommendation 
-                    WHERE suggester_id = :suggester AND rater_id = :rater
+                    WHERE suggester_id = :suggester AND rater_id = :rater AND is_closed = 1
                     AND rating = (
-                        SELECT MAX(rating) FROM recommendation WHERE suggester_id = :suggester AND rater_id = :rater
+                        SELECT max_rating FROM pair_stats WHERE suggester_id = :suggester AND rater_id = :rater
                     )
                 ''',
                 {"suggester": suggester.discord_id, "rater": rater.discord_id}
             )
-            return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
 
     @classmethod
     async def get_average_rating(cls, suggester : User, rater : User = None) -> float:
         if rater == None:
-            cls.cur.execute('''
-                SELECT AVG(rating) FROM recommendation 
+            row = await cls._fetchone('''
+                SELECT total * 1.0 / count FROM suggester_stats 
                     WHERE suggester_id = :suggester
-                    AND is_closed 
                 ''',
                 {"suggester": suggester.discord_id}
             )
-            return cls.cur.fetchone()[0]
         else:
-            cls.cur.execute('''
-                SELECT AVG(rating) FROM recommendation 
+            row = await cls._fetchone('''
+                SELECT total * 1.0 / count FROM pair_stats 
                     WHERE suggester_id = :suggester
                     AND rater_id = :rater
-                    AND is_closed
                 ''',
                 {"suggester": suggester.discord_id, "rater": rater.discord_id}
             )
-            return cls.cur.fetchone()[0]
+        return row[0] if row else None
 
     @classmethod
     async def get_total_rating(cls, suggester : User, rater : User = None) -> float:
         if rater == None:
-            cls.cur.execute('''
-                SELECT SUM(rating) FROM recommendation 
+            row = await cls._fetchone('''
+                SELECT total FROM suggester_stats 
                     WHERE suggester_id = ? 
-                    AND is_closed
                 ''',(suggester.discord_id,)
             )
-            return cls.cur.fetchone()[0]
         else:
-            cls.cur.execute('''
-                SELECT SUM(rating) FROM recommendation 
+            row = await cls._fetchone('''
+                SELECT total FROM pair_stats 
                     WHERE suggester_id = ? 
                     AND rater_id = ?
-                    AND is_closed
                 ''',(suggester.discord_id, rater.discord_id)
             )
-            return cls.cur.fetchone()[0]
+        return row[0] if row else None
            
+    # One rec per suggester: (one of) their highest rated, best first
     @classmethod
     async def get_max_ratings(cls, rater : User = None) -> List[Recommendation]:
         if rater:
-            cls.cur.execute('''
-                SELECT song_name, artist, rater_id, suggester_id, guild_id, timestamp, MAX(rating) as rating, is_closed \
-                    FROM recommendation 
-                    WHERE is_closed
-                    AND rater_id = ?
-                    GROUP BY suggester_id 
-                    ORDER BY rating DESC
+            rows = await cls._fetchall('''
+                SELECT r.* FROM pair_stats s
+                    JOIN recommendation r ON r.rowid = (
+                        SELECT rowid FROM recommendation
+                        WHERE rater_id = s.rater_id AND suggester_id = s.suggester_id
+                        AND is_closed = 1 AND rating = s.max_rating
+                        LIMIT 1
+                    )
+                    WHERE s.rater_id = ?
+                    ORDER BY s.max_rating DESC
                 ''', (rater.discord_id,))
-            return Recommendation.parse_tuples(cls.cur.fetchall())
         else:
-            cls.cur.execute('''
-                SELECT song_name, artist, rater_id, suggester_id, guild_id, timestamp, MAX(rating) as rating, is_closed \
-                    FROM recommendation 
-                    WHERE is_closed
-                    GROUP BY suggester_id 
-                    ORDER BY rating DESC
+            rows = await cls._fetchall('''
+                SELECT r.* FROM suggester_stats s
+                    JOIN recommendation r ON r.rowid = (
+                        SELECT rowid FROM recommendation
+                        WHERE suggester_id = s.suggester_id AND is_closed = 1 AND rating = s.max_rating
+                        LIMIT 1
+                    )
+                    ORDER BY s.max_rating DESC
             ''')
-            return Recommendation.parse_tuples(cls.cur.fetchall())
+        return Recommendation.parse_tuples(rows)
+
+    # The song behind each entry of a Leaderboard "max" board: one closed rec per
+    # (rating, suggester), in the order given. The entries go in as a single JSON parameter,
+    # so a board of any size is one query, each entry a seek on idx_rec_suggester(_rating).
+    @classmethod
+    async def get_ratings_by_suggester_and_rating(
+        cls, entries: List[Tuple[float, User]], rater: User = None
+    ) -> List[Recommendation]:
+        rows = await cls._fetchall(f'''
+            SELECT r.* FROM json_each(:entries) e
+                JOIN recommendation r ON r.rowid = (
+                    SELECT rowid FROM recommendation
+                    WHERE suggester_id = json_extract(e.value, '$[1]')
+                    {"AND rater_id = :rater" if rater else ""}
+                    AND is_closed = 1 AND rating = json_extract(e.value, '$[0]')
+                    LIMIT 1
+                )
+                ORDER BY e.key
+            ''',
+            {
+                "entries": json.dumps([(rating, suggester.discord_id) for rating, suggester in entries]),
+                "rater": rater.discord_id if rater else None,
+            }
+        )
+        return Recommendation.parse_tuples(rows)
 
     @classmethod
-    async def get_average_ratings(cls, rater : User = None) -> Tuple[float, User]:
+    async def get_average_ratings(cls, rater : User = None) -> List[Tuple[float, User]]:
         if rater == None:
-            cls.cur.execute('''
-                SELECT AVG(rating) as avg_rating, suggester_id 
-                    FROM recommendation 
-                    WHERE is_closed
-                    GROUP BY suggester_id 
+            rows = await cls._fetchall('''
+                SELECT total * 1.0 / count as avg_rating, suggester_id 
+                    FROM suggester_stats 
                     ORDER BY avg_rating DESC
                 ''')
-            return [(rating, User(id)) for rating, id in cls.cur.fetchall()]
         else:
-            cls.cur.execute('''
-                SELECT AVG(rating) as avg_rating, suggester_id 
-                    FROM recommendation 
-                    WHERE is_closed
-                    AND rater_id = ?
-                    GROUP BY suggester_id 
+            rows = await cls._fetchall('''
+                SELECT total * 1.0 / count as avg_rating, suggester_id 
+                    FROM pair_stats 
+                    WHERE rater_id = ?
                     ORDER BY avg_rating DESC
                 ''', (rater.discord_id,))
-            return [(rating, User(id)) for rating, id in cls.cur.fetchall()]
+        return [(rating, User(id)) for rating, id in rows]
 
 
     @classmethod
-    async def get_total_ratings(cls, rater : User = None) -> Tuple[float, User]:
+    async def get_total_ratings(cls, rater : User = None) -> List[Tuple[float, User]]:
         if rater == None:
-            cls.cur.execute('''
-                SELECT SUM(rating) as total_rating, suggester_id 
-                    FROM recommendation 
-                    WHERE is_closed
-                    GROUP BY suggester_id 
+            rows = await cls._fetchall('''
+                SELECT total as total_rating, suggester_id 
+                    FROM suggester_stats 
                     ORDER BY total_rating DESC
                 ''')
         else:
-            cls.cur.execute('''
-                SELECT SUM(rating) as total_rating, suggester_id 
-                    FROM recommendation 
-                    WHERE is_closed
-                    AND rater_id = ?
-                    GROUP BY suggester_id 
+            rows = await cls._fetchall('''
+                SELECT total as total_rating, suggester_id 
+                    FROM pair_stats 
+                    WHERE rater_id = ?
                     ORDER BY total_rating DESC
                 ''', (rater.discord_id,))
-        return [(rating, User(id)) for rating, id in cls.cur.fetchall()]
+        return [(rating, User(id)) for rating, id in rows]
 
 
-    
 
 
 
 
 async def lame_ass_test_suite():
     backEnd = DB()
+    # The statement helpers run inside a unit of work on the DB worker thread
+    async def run(helper, *args):
+        return await backEnd._write(lambda cur: helper(cur, *args))
+
     print("Running initial tests:")
     user1 = User(12345)
-    await backEnd._add_user(user1)
-    print(await backEnd._does_user_exist(user1))
-    print(not await backEnd._does_user_exist(User(58613)))
+    await run(backEnd._add_users, user1)
+    print(await run(backEnd._does_user_exist, user1))
+    print(not await run(backEnd._does_user_exist, User(58613)))
     user2 = User(3)
-    await backEnd._add_user(user2)
-    print(await backEnd._does_user_exist(user2))
+    await run(backEnd._add_users, user2)
+    print(await run(backEnd._does_user_exist, user2))
 
     sandstorm = Song("Sandstorm", "Darude")
-    await backEnd._add_song(sandstorm)
-    print(await backEnd._does_song_exist(sandstorm))
-    print(not await backEnd._does_song_exist(Song("Sandstorm", "dadude")))
-    print(await backEnd._does_song_exist(sandstorm))
+    await run(backEnd._add_song, sandstorm)
+    print(await run(backEnd._does_song_exist, sandstorm))
+    print(not await run(backEnd._does_song_exist, Song("Sandstorm", "dadude")))
+    print(await run(backEnd._does_song_exist, sandstorm))
     rec1 = Recommendation(
         song=sandstorm, 
         rater=user1, 
@@ -636,9 +1267,10 @@ async def lame_ass_test_suite():
         is_closed=True
     )
     await backEnd.add_rating_manual(rec1)
-    print(await backEnd._does_rating_exist(rec1))
+    print(await run(backEnd._does_rating_exist, rec1))
     print(
-        not await backEnd._does_rating_exist(
+        not await run(
+            backEnd._does_rating_exist,
             Recommendation(
                 Song("Sandstorm", "DaDude"), 
                 User(12345), 
@@ -800,5 +1432,5 @@ async def lame_ass_test_suite():
     pprint(await backEnd.get_overlap(User(2),User(3)))
 
 if __name__ == "__main__":
-    import asyncio
+    DB.setup()
     asyncio.run(lame_ass_test_suite())
\ No newline at end of file
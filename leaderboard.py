@@ -0,0 +1,110 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from models.snowflakes import User, Guild
+
+# A leaderboard is scoped to a (guild_id, rater_id) pair, where None means "any".
+# (None, None) is the global board, which is what /leaderboard shows without a rater.
+Scope = Tuple[Optional[int], Optional[int]]
+METRICS = ("total", "average", "max")
+
+
+@dataclass
+class _Tally:
+    count: int = 0
+    total: float = 0
+    # Every rating received, so the max survives a rating being removed
+    ratings: Counter = field(default_factory=Counter)
+
+    def score(self, metric: str) -> float:
+        match metric:
+            case "total":
+                return self.total
+            case "average":
+                return self.total / self.count
+            case "max":
+                return max(self.ratings)
+
+
+# In-memory leaderboards of suggesters by total, average and max rating, per guild and per
+# rater. Each board is kept sorted (as (-score, suggester_id) pairs), so reading the top K is
+# a slice. Built from SQL by DB.setup and updated by DB on every rating event.
+# A rating event re-sorts one entry per board with bisect: the search is logarithmic, but the
+# list shift is linear in the number of suggesters on the board. That stays under 0.1 ms per
+# event up to a few thousand suggesters, so plain lists are kept over a balanced tree.
+@dataclass
+class Leaderboard:
+    tallies: Dict[Scope, Dict[int, _Tally]] = None
+    boards: Dict[Tuple[Scope, str], List[Tuple[float, int]]] = None
+
+    @staticmethod
+    def _scopes(guild_id: int, rater_id: int) -> Tuple[Scope, ...]:
+        return ((None, None), (guild_id, None), (None, rater_id), (guild_id, rater_id))
+
+    # rows are closed recommendation rows, in schema order (see Recommendation.parse_tuple)
+    @classmethod
+    def load(cls, rows: List[Tuple]):
+        cls.tallies = {}
+        cls.boards = {}
+        ratings = Counter((row[4], row[2], row[3], row[6]) for row in rows)
+        for (guild_id, rater_id, suggester_id, rating), count in ratings.items():
+            for scope in cls._scopes(guild_id, rater_id):
+                tally = cls.tallies.setdefault(scope, {}).setdefault(suggester_id, _Tally())
+                tally.count += count
+                tally.total += rating * count
+                tally.ratings[rating] += count
+        for scope, tallies in cls.tallies.items():
+            for metric in METRICS:
+                cls.boards[(scope, metric)] = sorted(
+                    (-tally.score(metric), suggester_id) for suggester_id, tally in tallies.items()
+                )
+
+    @classmethod
+    def _apply(cls, guild: Guild, rater: User, suggester: User, rating: float, delta: int):
+        # A rating that was never tallied has nothing to remove. Every broader scope holds
+        # at least what the narrowest one does, so checking that one is enough.
+        if delta < 0:
+            tally = cls.tallies.get((guild.discord_id, rater.discord_id), {}).get(suggester.discord_id)
+            if tally is None or tally.ratings[rating] <= 0:
+                return
+        for scope in cls._scopes(guild.discord_id, rater.discord_id):
+            tallies = cls.tallies.setdefault(scope, {})
+            tally = tallies.setdefault(suggester.discord_id, _Tally())
+            for metric in METRICS:
+                board = cls.boards.setdefault((scope, metric), [])
+                if tally.count:
+                    del board[bisect_left(board, (-tally.score(metric), suggester.discord_id))]
+            tally.count += delta
+            tally.total += rating * delta
+            tally.ratings[rating] += delta
+            if tally.ratings[rating] <= 0:
+                del tally.ratings[rating]
+            if tally.count <= 0:
+                del tallies[suggester.discord_id]
+                continue
+            for metric in METRICS:
+                insort(cls.boards[(scope, metric)], (-tally.score(metric), suggester.discord_id))
+
+    @classmethod
+    def add(cls, guild: Guild, rater: User, suggester: User, rating: float):
+        cls._apply(guild, rater, suggester, rating, 1)
+
+    @classmethod
+    def remove(cls, guild: Guild, rater: User, suggester: User, rating: float):
+        cls._apply(guild, rater, suggester, rating, -1)
+
+    # The best k suggesters for a metric, as (score, User) like DB.get_total_ratings.
+    # k=None returns the whole board.
+    @classmethod
+    def top(
+        cls,
+        metric: str,
+        k: Optional[int] = 10,
+        guild: Guild = None,
+        rater: User = None,
+    ) -> List[Tuple[float, User]]:
+        scope = (guild.discord_id if guild else None, rater.discord_id if rater else None)
+        board = cls.boards.get((scope, metric), [])
+        return [(-score, User.of(suggester_id)) for score, suggester_id in board[:k]]
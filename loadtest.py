@@ -0,0 +1,638 @@
+"""Load-tests the bot's commands offline, with stand-ins for Discord's interactions.
+
+    python loadtest.py --recs 10000 --rate 50 --duration 30
+    python loadtest.py --rate 200 --commands "rec rate" "stats max" --output load.json
+
+Each invocation builds a fake ApplicationCommandInteraction (or ModalInteraction, when a
+/rec new modal is submitted) and calls the real Recommend, Stats, Threads, Admin and Misc cog
+methods with it, against a database generated as in bench.py. Commands arrive at random (a
+Poisson process at --rate per second) regardless of how far behind the bot is, so a slow
+command shows up as queueing in the latencies of everything after it.
+
+Latency is the time until the interaction is first responded to, which Discord requires
+within 3 seconds. Event loop lag is how late a 10ms sleep wakes up, measured throughout.
+Slash command checks are run, but options are passed straight to the callbacks rather than
+through disnake's converters.
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from disnake import ChannelType
+from disnake.errors import InteractionResponded
+from disnake.ext import commands
+from disnake.utils import maybe_coroutine
+
+from bench import Dataset, generate
+from cache import ThreadCache
+from charts import Charts
+from cogs.admin import Admin
+from cogs.misc import Misc
+from cogs.recommend import Recommend
+from cogs.stats import Stats
+from cogs.threads import Threads
+from db import DB
+from suggest import Suggestions
+
+# Discord fails an interaction that is not responded to within this many seconds
+RESPONSE_DEADLINE = 3.0
+
+
+@dataclass
+class FakePermissions:
+    administrator: bool = True
+
+
+@dataclass
+class FakeUser:
+    id: int
+    roles: List[Any] = field(default_factory=list)
+    guild_permissions: FakePermissions = field(default_factory=FakePermissions)
+
+    @property
+    def name(self) -> str:
+        return f"user{self.id}"
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@dataclass
+class FakeRole:
+    id: int
+
+
+@dataclass
+class FakeThreadChannel:
+    id: int
+    type: ChannelType = ChannelType.public_thread
+    parent: Optional["FakeChannel"] = None
+
+    async def send(self, *args, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+
+@dataclass
+class FakeChannel:
+    id: int
+    type: ChannelType = ChannelType.text
+    parent: Optional["FakeChannel"] = None
+    # Where thread ids handed out by create_thread come from
+    thread_ids: Optional[Callable[[], int]] = None
+
+    async def create_thread(self, name: str, type: ChannelType) -> FakeThreadChannel:
+        return FakeThreadChannel(self.thread_ids(), parent=self)
+
+
+@dataclass
+class FakeGuild:
+    id: int
+
+    # Every thread PyRate knows of in the guild still exists, so /thread cleanup finds nothing
+    @property
+    def threads(self) -> List[FakeThreadChannel]:
+        return [FakeThreadChannel(thread_id) for thread_id, thread in ThreadCache.threads.items() if thread.guild.discord_id == self.id]
+
+
+# Records what a command sent, and when it first responded
+@dataclass
+class FakeResponse:
+    sent: List[Tuple[str, tuple, dict]] = field(default_factory=list)
+    responded_at: Optional[float] = None
+    interaction: Any = None
+
+    def is_done(self) -> bool:
+        return self.responded_at is not None
+
+    def _respond(self, kind: str, args: tuple, kwargs: dict):
+        if self.responded_at is not None:
+            raise InteractionResponded(self.interaction)
+        self.responded_at = time.perf_counter()
+        self.sent.append((kind, args, kwargs))
+
+    async def send_message(self, *args, **kwargs):
+        self._respond("send_message", args, kwargs)
+
+    async def send_modal(self, *args, **kwargs):
+        self._respond("send_modal", args, kwargs)
+
+    async def edit_message(self, *args, **kwargs):
+        self._respond("edit_message", args, kwargs)
+
+    async def defer(self, *args, **kwargs):
+        self._respond("defer", args, kwargs)
+
+
+@dataclass
+class FakeFollowup:
+    sent: List[Tuple[tuple, dict]] = field(default_factory=list)
+
+    async def send(self, *args, **kwargs):
+        self.sent.append((args, kwargs))
+
+
+# Stands in for ApplicationCommandInteraction, ModalInteraction and MessageInteraction: just
+# the attributes the cogs read, plus recorded responses
+@dataclass
+class FakeInteraction:
+    author: FakeUser
+    guild: FakeGuild
+    channel: Any
+    text_values: Dict[str, str] = field(default_factory=dict)
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    response: FakeResponse = field(default_factory=FakeResponse)
+    followup: FakeFollowup = field(default_factory=FakeFollowup)
+
+    def __post_init__(self):
+        self.response.interaction = self
+
+    @property
+    def guild_id(self) -> int:
+        return self.guild.id
+
+    @property
+    def channel_id(self) -> int:
+        return self.channel.id
+
+
+# Answers UserCache lookups as the Discord API would, after `api_latency` seconds
+class FakeBot:
+    def __init__(self, api_latency: float):
+        self.api_latency = api_latency
+
+    async def getch_user(self, user_id: int) -> FakeUser:
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        return FakeUser(user_id)
+
+
+@dataclass
+class Sample:
+    command: str
+    started: float
+    responded: Optional[float]
+    finished: float
+    # "ok", "error" (an "Error: ..." reply), "unanswered" or the exception's type
+    outcome: str
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class LoadTest:
+    def __init__(self, data: Dataset, bot: FakeBot, seed: int):
+        self.data = data
+        self.rng = random.Random(seed)
+        self.recommend = Recommend(bot)
+        self.stats = Stats(bot)
+        self.threads = Threads(bot)
+        self.admin = Admin(bot)
+        self.misc = Misc(bot)
+        self.samples: List[Sample] = []
+        self.exceptions: Dict[str, BaseException] = {}
+        self.parent = FakeChannel(1)
+        self.parent.thread_ids = self._new_id
+        # Threads linked during the run, which /thread delink may take away again
+        self.linked: List[int] = []
+        self._next_id = 2 * 10 ** 9
+        self.scenarios: List[Tuple[str, float, Callable[[], Awaitable[None]]]] = [
+            ("rec new", 6, self.rec_new),
+            ("rec rate", 6, self.rec_rate),
+            ("rec rerate", 2, self.rec_rerate),
+            ("rec rerate autocomplete", 6, self.rec_rerate_autocomplete),
+            ("rec clear", 1, self.rec_clear),
+            ("rec suggest", 2, self.rec_suggest),
+            ("stats max", 2, self.stats_max),
+            ("stats average", 2, self.stats_average),
+            ("stats total", 2, self.stats_total),
+            ("stats distribution", 1, self.stats_distribution),
+            ("stats compatibility", 1, self.stats_compatibility),
+            ("stats history", 2, self.stats_history),
+            ("leaderboard max", 1, self.leaderboard_max),
+            ("leaderboard average", 1, self.leaderboard_average),
+            ("leaderboard total", 1, self.leaderboard_total),
+            ("thread create", 0.5, self.thread_create),
+            ("thread link", 0.5, self.thread_link),
+            ("thread next", 2, self.thread_next),
+            ("thread waiting", 2, self.thread_waiting),
+            ("thread delink", 0.5, self.thread_delink),
+            ("thread cleanup", 0.1, self.thread_cleanup),
+            ("queue", 3, self.queue),
+            ("manual rating", 0.5, self.manual_rating),
+            ("role register", 0.2, self.role_register),
+            ("role remove", 0.2, self.role_remove),
+        ]
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _interaction(self, author_id: int, guild_id: int, channel_id: int = None) -> FakeInteraction:
+        channel = FakeThreadChannel(channel_id, parent=self.parent) if channel_id is not None else self.parent
+        return FakeInteraction(author=FakeUser(author_id), guild=FakeGuild(guild_id), channel=channel)
+
+    # A random linked thread, as it is now, and an interaction in it from `who`: the user
+    # at bat, the other user, or either
+    def _in_thread(self, who: str = "either") -> FakeInteraction:
+        thread_id = self.rng.choice(self.data.threads).thread_id
+        thread = ThreadCache.fetch(thread_id)
+        if thread is None:
+            thread = self.rng.choice(list(ThreadCache.threads.values()))
+        other = thread.user2 if thread.next_user == thread.user1 else thread.user1
+        author = {"next": thread.next_user, "other": other}.get(who) or self.rng.choice((thread.user1, thread.user2))
+        return self._interaction(author.discord_id, thread.guild.discord_id, thread.thread_id)
+
+    def _pair(self) -> Tuple[int, int]:
+        return self.rng.choice(self.data.pairs)
+
+    def _guild_member(self) -> FakeInteraction:
+        return self._interaction(self.rng.choice(self.data.users), self.rng.choice(self.data.guilds))
+
+    # Runs a cog command callback as disnake would after parsing its options: checks first
+    async def _call(self, cog: commands.Cog, command, inter: FakeInteraction, *args, **kwargs):
+        parent = getattr(command, "parent", None)
+        for check in [*(parent.checks if parent is not None else ()), *command.checks]:
+            if not await maybe_coroutine(check, inter):
+                raise commands.CheckFailure(f"check failed for {command.qualified_name}")
+        await command.callback(cog, inter, *args, **kwargs)
+
+    async def _timed(self, name: str, inter: FakeInteraction, work: Awaitable[Any]) -> Any:
+        started = time.perf_counter()
+        outcome = None
+        result = None
+        try:
+            result = await work
+        except Exception as e:
+            outcome = type(e).__name__
+            self.exceptions.setdefault(f"{name}: {outcome}", e)
+        finished = time.perf_counter()
+        if outcome is None:
+            if not inter.response.sent:
+                outcome = "unanswered"
+            else:
+                kind, args, kwargs = inter.response.sent[0]
+                content = args[0] if args else kwargs.get("content")
+                outcome = "error" if isinstance(content, str) and content.startswith("Error") else "ok"
+        self.samples.append(Sample(name, started, inter.response.responded_at, finished, outcome))
+        return result
+
+    ##############################################
+    #
+    # Scenarios
+    #
+    ##############################################
+    # The modal is submitted too, by the same user, as its own sample
+    async def rec_new(self):
+        inter = self._in_thread("next")
+        await self._timed("rec new", inter, self._call(self.recommend, self.recommend.new, inter))
+        if inter.response.sent and inter.response.sent[0][0] == "send_modal":
+            modal = inter.response.sent[0][1][0]
+            submit = self._interaction(inter.author.id, inter.guild_id, inter.channel_id)
+            song = self.rng.choice(self.data.songs)
+            submit.text_values = {"song_name": song.name, "artist": song.artist, "url": "https://example.com"}
+            await self._timed("rec new modal", submit, modal.callback(submit))
+
+    async def rec_rate(self):
+        inter = self._in_thread("next")
+        rating = self.rng.randint(2, 20) / 2
+        await self._timed("rec rate", inter, self._call(self.recommend, self.recommend.rate, inter, rating))
+
+    async def rec_rerate(self):
+        rater, suggester = self._pair()
+        song = self.rng.choice(self.data.rated_songs[(rater, suggester)])
+        thread = next(t for t in self.data.threads if {t.user1.discord_id, t.user2.discord_id} == {rater, suggester})
+        inter = self._interaction(rater, thread.guild.discord_id, thread.thread_id)
+        rating = self.rng.randint(2, 20) / 2
+        await self._timed(
+            "rec rerate", inter,
+            self._call(self.recommend, self.recommend.rerate, inter, song.name, song.artist, rating),
+        )
+
+    async def rec_rerate_autocomplete(self):
+        inter = self._in_thread()
+        prefix = self.rng.choice(self.data.songs).name[:self.rng.randint(1, 6)]
+        await self._timed("rec rerate autocomplete", inter, self.recommend.rerate_song(inter, prefix))
+        # Autocomplete answers by returning its choices, so count it as answered on return
+        if self.samples[-1].outcome == "unanswered":
+            self.samples[-1].responded, self.samples[-1].outcome = self.samples[-1].finished, "ok"
+
+    async def rec_clear(self):
+        inter = self._in_thread("other")
+        await self._timed("rec clear", inter, self._call(self.recommend, self.recommend.clear, inter))
+
+    async def rec_suggest(self):
+        inter = self._guild_member()
+        await self._timed("rec suggest", inter, self._call(self.recommend, self.recommend.suggest, inter))
+
+    async def stats_max(self):
+        suggester, rater = self.rng.choice(self.data.suggesters), self.rng.choice((None, self._pair()[0]))
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        await self._timed(
+            "stats max", inter,
+            self._call(self.stats, self.stats.stats_max, inter, FakeUser(rater) if rater else None),
+        )
+
+    async def stats_average(self):
+        rater, suggester = self._pair()
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        other = self.rng.choice((None, FakeUser(rater)))
+        await self._timed("stats average", inter, self._call(self.stats, self.stats.stats_average, inter, other))
+
+    async def stats_total(self):
+        rater, suggester = self._pair()
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        other = self.rng.choice((None, FakeUser(rater)))
+        await self._timed("stats total", inter, self._call(self.stats, self.stats.stats_total, inter, other))
+
+    async def stats_distribution(self):
+        rater, suggester = self._pair()
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        other = self.rng.choice((None, FakeUser(rater)))
+        await self._timed(
+            "stats distribution", inter, self._call(self.stats, self.stats.stats_distribution, inter, other)
+        )
+
+    async def stats_compatibility(self):
+        inter = self._guild_member()
+        other = self.rng.choice((None, FakeUser(self.rng.choice(self.data.users))))
+        await self._timed(
+            "stats compatibility", inter, self._call(self.stats, self.stats.stats_compatibility, inter, other)
+        )
+
+    # Pressing "Older" on the history is its own sample
+    async def stats_history(self):
+        rater, suggester = self._pair()
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        await self._timed(
+            "stats history", inter, self._call(self.stats, self.stats.stats_history, inter, FakeUser(rater))
+        )
+        view = inter.response.sent[0][2].get("view") if inter.response.sent else None
+        if view is not None and not view.older.disabled:
+            click = self._interaction(suggester, inter.guild_id)
+            await self._timed("stats history older", click, view.older.callback(click))
+            view.stop()
+
+    async def leaderboard_max(self):
+        inter = self._guild_member()
+        rater = self.rng.choice((None, FakeUser(self.rng.choice(self.data.raters))))
+        await self._timed("leaderboard max", inter, self._call(self.stats, self.stats.leaderboard_max, inter, rater))
+
+    async def leaderboard_average(self):
+        inter = self._guild_member()
+        rater = self.rng.choice((None, FakeUser(self.rng.choice(self.data.raters))))
+        await self._timed(
+            "leaderboard average", inter, self._call(self.stats, self.stats.leaderboard_average, inter, rater)
+        )
+
+    async def leaderboard_total(self):
+        inter = self._guild_member()
+        rater = self.rng.choice((None, FakeUser(self.rng.choice(self.data.raters))))
+        await self._timed(
+            "leaderboard total", inter, self._call(self.stats, self.stats.leaderboard_total, inter, rater)
+        )
+
+    async def thread_create(self):
+        inter = self._guild_member()
+        other = FakeUser(self.rng.choice(self.data.users))
+        await self._timed(
+            "thread create", inter, self._call(self.threads, self.threads.thread_create, inter, other)
+        )
+
+    async def thread_link(self):
+        thread_id = self._new_id()
+        inter = self._interaction(self.rng.choice(self.data.users), self.rng.choice(self.data.guilds), thread_id)
+        other = FakeUser(self.rng.choice(self.data.users))
+        await self._timed("thread link", inter, self._call(self.threads, self.threads.thread_link, inter, other))
+        if inter.response.sent and inter.response.sent[0][2].get("ephemeral") is None:
+            self.linked.append(thread_id)
+
+    async def thread_next(self):
+        inter = self._in_thread()
+        await self._timed("thread next", inter, self._call(self.threads, self.threads.thread_next, inter))
+
+    async def thread_waiting(self):
+        inter = self._guild_member()
+        await self._timed("thread waiting", inter, self._call(self.threads, self.threads.thread_waiting, inter))
+
+    # Only threads linked during the run are delinked, so the generated ones stay usable
+    async def thread_delink(self):
+        if not self.linked:
+            return
+        thread = ThreadCache.fetch(self.linked.pop(self.rng.randrange(len(self.linked))))
+        if thread is None:
+            return
+        inter = self._interaction(thread.user1.discord_id, thread.guild.discord_id, thread.thread_id)
+        await self._timed("thread delink", inter, self._call(self.threads, self.threads.thread_delink, inter))
+
+    async def thread_cleanup(self):
+        inter = self._guild_member()
+        await self._timed("thread cleanup", inter, self._call(self.threads, self.threads.thread_cleanup, inter))
+
+    async def queue(self):
+        inter = self._guild_member()
+        user = self.rng.choice((None, FakeUser(self.rng.choice(self.data.users))))
+        await self._timed("queue", inter, self._call(self.misc, self.misc.get_user_queue, inter, user))
+
+    async def manual_rating(self):
+        rater, suggester = self._pair()
+        inter = self._interaction(suggester, self.rng.choice(self.data.guilds))
+        song = self.rng.choice(self.data.songs)
+        rating = self.rng.randint(2, 20) / 2
+        await self._timed(
+            "manual rating", inter,
+            self._call(
+                self.admin, self.admin.add_rating, inter,
+                song.name, song.artist, FakeUser(suggester), FakeUser(rater), rating,
+            ),
+        )
+
+    # Role ids are unique across guilds, as on Discord
+    def _role(self, inter: FakeInteraction) -> FakeRole:
+        return FakeRole(3 * 10 ** 9 + 100 * self.data.guilds.index(inter.guild_id) + self.rng.randrange(20))
+
+    async def role_register(self):
+        inter = self._guild_member()
+        role = self._role(inter)
+        await self._timed("role register", inter, self._call(self.admin, self.admin.role_register, inter, role))
+
+    async def role_remove(self):
+        inter = self._guild_member()
+        role = self._role(inter)
+        await self._timed("role remove", inter, self._call(self.admin, self.admin.role_remove, inter, role))
+
+    ##############################################
+    #
+    # Driving the load
+    #
+    ##############################################
+    # Issues scenarios at random for `duration` seconds, `rate` per second on average, without
+    # waiting for earlier ones to finish. Returns how late each 10ms tick of the loop ran.
+    async def run(self, rate: float, duration: float, names: Optional[List[str]] = None) -> List[float]:
+        scenarios = [s for s in self.scenarios if not names or s[0] in names]
+        if not scenarios:
+            raise ValueError(f"No such commands: {', '.join(names)}")
+        weights = [weight for _, weight, _ in scenarios]
+        lag: List[float] = []
+        running = True
+
+        async def monitor(interval: float = 0.01):
+            while running:
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                lag.append(time.perf_counter() - started - interval)
+
+        monitor_task = asyncio.create_task(monitor())
+        tasks = set()
+        deadline = time.perf_counter() + duration
+        arrival = time.perf_counter()
+        while True:
+            arrival += self.rng.expovariate(rate)
+            if arrival >= deadline:
+                break
+            await asyncio.sleep(max(0, arrival - time.perf_counter()))
+            _, _, scenario = self.rng.choices(scenarios, weights)[0]
+            task = asyncio.create_task(scenario())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        running = False
+        await monitor_task
+        return lag
+
+
+def summarize(samples: List[Sample], lag: List[float], duration: float) -> Dict[str, Any]:
+    def latencies(group: List[Sample]) -> Dict[str, Any]:
+        answered = [(s.responded - s.started) * 1000 for s in group if s.responded is not None]
+        outcomes: Dict[str, int] = {}
+        for s in group:
+            outcomes[s.outcome] = outcomes.get(s.outcome, 0) + 1
+        return {
+            "count": len(group),
+            "outcomes": outcomes,
+            "late": sum(1 for ms in answered if ms > RESPONSE_DEADLINE * 1000),
+            "p50_ms": _percentile(answered, 50),
+            "p99_ms": _percentile(answered, 99),
+            "max_ms": max(answered, default=None),
+            "mean_ms": statistics.fmean(answered) if answered else None,
+        }
+
+    commands: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        commands.setdefault(sample.command, []).append(sample)
+    lag_ms = [seconds * 1000 for seconds in lag]
+    return {
+        "throughput": len(samples) / duration,
+        "overall": latencies(samples),
+        "commands": {name: latencies(group) for name, group in sorted(commands.items())},
+        "loop_lag": {
+            "ticks": len(lag_ms),
+            "p50_ms": _percentile(lag_ms, 50),
+            "p99_ms": _percentile(lag_ms, 99),
+            "max_ms": max(lag_ms, default=None),
+        },
+    }
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:9.2f}" if value is not None else " " * 9
+
+
+def print_summary(summary: Dict[str, Any]):
+    print(f"{'command':<26} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  outcomes", file=sys.stderr)
+    for name, stats in [*summary["commands"].items(), ("(all)", summary["overall"])]:
+        outcomes = ", ".join(f"{outcome} {count}" for outcome, count in sorted(stats["outcomes"].items()))
+        print(
+            f"{name:<26} {stats['count']:>6} {_ms(stats['p50_ms'])} {_ms(stats['p99_ms'])} {_ms(stats['max_ms'])}  {outcomes}",
+            file=sys.stderr,
+        )
+    lag = summary["loop_lag"]
+    print(
+        f"{summary['throughput']:.1f} commands/s, {summary['overall']['late']} answered after {RESPONSE_DEADLINE:.0f}s; "
+        f"event loop lag p50 {lag['p50_ms']:.2f}ms, p99 {lag['p99_ms']:.2f}ms, max {lag['max_ms']:.2f}ms",
+        file=sys.stderr,
+    )
+
+
+async def main(args: argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        DB.path = os.path.join(directory, "loadtest.db")
+        started = time.perf_counter()
+        data = generate(DB.path, args.recs, args.guilds, args.users, args.seed)
+        print(f"{args.recs} recs generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        DB.setup(readers=args.readers, group_commit_ms=args.group_commit_ms)
+        Charts.setup()
+        Suggestions.setup()
+        test = LoadTest(data, FakeBot(args.api_latency_ms / 1000), args.seed)
+        try:
+            # Trained up front, as the bot would have by the time anyone asks
+            await Suggestions.refresh()
+            await test.recommend.cog_load()
+            started = time.perf_counter()
+            lag = await test.run(args.rate, args.duration, args.commands)
+            elapsed = time.perf_counter() - started
+        finally:
+            test.recommend.cog_unload()
+            Suggestions.close()
+            Charts.close()
+            DB.close()
+    for name, e in test.exceptions.items():
+        print(f"EXCEPTION: {name}: {e}", file=sys.stderr)
+    summary = summarize(test.samples, lag, elapsed)
+    print_summary(summary)
+    if args.output:
+        report = {
+            "meta": {
+                "recs": args.recs,
+                "guilds": args.guilds,
+                "users": args.users,
+                "seed": args.seed,
+                "rate": args.rate,
+                "duration": args.duration,
+                "readers": args.readers,
+                "group_commit_ms": args.group_commit_ms,
+                "api_latency_ms": args.api_latency_ms,
+                "started": datetime.now().isoformat(timespec="seconds"),
+            },
+            **summary,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the bot's commands with fake interactions")
+    parser.add_argument("--recs", type=int, default=10_000, help="recommendations in the generated database")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=50, help="commands per second, on average")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to issue commands for")
+    parser.add_argument("--commands", nargs="+", help="only issue these commands, e.g. \"rec rate\" \"stats max\"")
+    parser.add_argument("--readers", type=int, help="DB reader threads (DB.setup's default if not given)")
+    parser.add_argument("--group-commit-ms", type=float, help="enable DB group commit with this window")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="simulated Discord API latency for user lookups")
+    parser.add_argument("--output", help="also write the report as JSON here")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -2,11 +2,13 @@ if __name__ == "__main__":
     from bot import PyRate
     from util import token
     from db import DB
-    from cache import RoleCache
+    from charts import Charts
+    from suggest import Suggestions
     import asyncio
 
     DB.setup()
-    RoleCache.refresh()
+    Charts.setup()
+    Suggestions.setup()
     bot = PyRate()
     bot.load_extension("cogs.misc")
     bot.load_extension("cogs.recommend")
@@ -0,0 +1,340 @@
+from dataclasses import dataclass
+from datetime import datetime
+import sqlite3
+from typing import Callable, List, Optional, Set
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    statements: List[str]
+    # For steps needing an optional SQLite feature: if this returns False the step is skipped,
+    # and tried again on a later start (e.g. once SQLite has been upgraded)
+    requires: Optional[Callable[[sqlite3.Connection], bool]] = None
+
+
+# FTS5 with the trigram tokenizer, which is SQLite 3.34+ built with ENABLE_FTS5
+def supports_trigram_search(con: sqlite3.Connection) -> bool:
+    if sqlite3.sqlite_version_info < (3, 34, 0):
+        return False
+    return bool(con.execute('''SELECT sqlite_compileoption_used('ENABLE_FTS5')''').fetchone()[0])
+
+
+# Ordered schema history. Each step runs once, inside its own transaction, and is recorded in
+# `schema_version`. Never edit a step that has shipped; append a new one instead.
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version=1,
+        description="Base tables",
+        # IF NOT EXISTS, as databases created before migrations existed already have these.
+        statements=[
+            '''
+            CREATE TABLE IF NOT EXISTS user(
+                discord_id NUMERIC PRIMARY KEY NOT NULL
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS guild(
+                discord_id NUMERIC PRIMARY KEY NOT NULL
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS role(
+                discord_id NUMERIC PRIMARY KEY NOT NULL,
+                guild_id NUMERIC NOT NULL,
+                FOREIGN KEY(guild_id) REFERENCES guild (guild_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS thread(
+                thread_id NUMERIC PRIMARY KEY NOT NULL,
+                guild_id NUMERIC NOT NULL,
+                user1_id NUMERIC NOT NULL,
+                user2_id NUMERIC NOT NULL,
+                next_user NUMERIC NOT NULL,
+                FOREIGN KEY(guild_id) REFERENCES guild (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY(user1_id) REFERENCES user (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY(user2_id) REFERENCES user (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE
+                FOREIGN KEY (next_user) REFERENCES user (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS song(
+                song_name varchar NOT NULL COLLATE NOCASE,
+                artist varchar NOT NULL COLLATE NOCASE,
+                PRIMARY KEY(song_name, artist)
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS recommendation(
+                song_name varchar NOT NULL COLLATE NOCASE,
+                artist varchar NOT NULL COLLATE NOCASE,
+                rater_id NUMERIC NOT NULL,
+                suggester_id NUMERIC NOT NULL,
+                guild_id NUMERIC NOT NULL,
+                timestamp text NOT NULL,
+                rating NUMERIC DEFAULT -1,
+                is_closed NUMERIC DEFAULT 0,
+                FOREIGN KEY (song_name, artist) REFERENCES song (song_name, artist)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY (rater_id) REFERENCES user (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY (suggester_id) REFERENCES user (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY (guild_id) REFERENCES guild (discord_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE
+            );
+            ''',
+        ]
+    ),
+    Migration(
+        version=2,
+        description="Covering indexes for the recommendation and thread lookups in db.py",
+        statements=[
+            # Open rec per thread (rater, suggester, is_closed = 0), pair history,
+            # get_ratings_by_rater and the rater-scoped leaderboards, which group by suggester
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_rater_suggester
+                ON recommendation(rater_id, suggester_id, is_closed, rating, timestamp);
+            ''',
+            # Per-suggester stats: get_max/average/total_rating(s) never touch the table
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_suggester
+                ON recommendation(suggester_id, rater_id, is_closed, rating);
+            ''',
+            # Closing, rerating and deleting a specific rec, plus song lookups and get_overlap
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_song
+                ON recommendation(song_name, artist, rater_id, suggester_id);
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_artist
+                ON recommendation(artist);
+            ''',
+            # get_waiting_threads_by_user
+            '''
+            CREATE INDEX IF NOT EXISTS idx_thread_next_user
+                ON thread(next_user, guild_id);
+            ''',
+            # get_threads_by_guild
+            '''
+            CREATE INDEX IF NOT EXISTS idx_thread_guild
+                ON thread(guild_id);
+            ''',
+            '''ANALYZE;''',
+        ]
+    ),
+    Migration(
+        version=3,
+        description="Materialized pair_stats/suggester_stats aggregates kept up to date by triggers",
+        # Triggers run inside the statement that changes a rating, so the aggregates commit (or
+        # roll back) together with close_rec, add_rating_manual, rerate and delete.
+        # Count and total are adjusted by deltas; the max is only recomputed, from the covering
+        # indexes, when a rating is removed or changed.
+        statements=[
+            '''
+            CREATE TABLE IF NOT EXISTS pair_stats(
+                rater_id NUMERIC NOT NULL,
+                suggester_id NUMERIC NOT NULL,
+                count INTEGER NOT NULL,
+                total NUMERIC NOT NULL,
+                max_rating NUMERIC,
+                updated_at text NOT NULL,
+                PRIMARY KEY(rater_id, suggester_id)
+            );
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_pair_stats_suggester
+                ON pair_stats(suggester_id);
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS suggester_stats(
+                suggester_id NUMERIC PRIMARY KEY NOT NULL,
+                count INTEGER NOT NULL,
+                total NUMERIC NOT NULL,
+                max_rating NUMERIC,
+                updated_at text NOT NULL
+            );
+            ''',
+            # Finding the rec(s) behind a suggester's max rating
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_suggester_rating
+                ON recommendation(suggester_id, is_closed, rating);
+            ''',
+            '''
+            INSERT INTO pair_stats
+                SELECT rater_id, suggester_id, COUNT(*), SUM(rating), MAX(rating), CURRENT_TIMESTAMP
+                FROM recommendation WHERE is_closed
+                GROUP BY rater_id, suggester_id;
+            ''',
+            '''
+            INSERT INTO suggester_stats
+                SELECT suggester_id, SUM(count), SUM(total), MAX(max_rating), CURRENT_TIMESTAMP
+                FROM pair_stats
+                GROUP BY suggester_id;
+            ''',
+            *[
+                f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON recommendation
+                WHEN NEW.is_closed
+                BEGIN
+                    INSERT INTO pair_stats VALUES(NEW.rater_id, NEW.suggester_id, 1, NEW.rating, NEW.rating, CURRENT_TIMESTAMP)
+                        ON CONFLICT DO UPDATE SET
+                            count = count + 1,
+                            total = total + excluded.total,
+                            max_rating = MAX(max_rating, excluded.max_rating),
+                            updated_at = excluded.updated_at;
+                    INSERT INTO suggester_stats VALUES(NEW.suggester_id, 1, NEW.rating, NEW.rating, CURRENT_TIMESTAMP)
+                        ON CONFLICT DO UPDATE SET
+                            count = count + 1,
+                            total = total + excluded.total,
+                            max_rating = MAX(max_rating, excluded.max_rating),
+                            updated_at = excluded.updated_at;
+                END;
+                '''
+                for name, event in (
+                    ("rec_stats_insert", "INSERT"),
+                    ("rec_stats_update_add", "UPDATE OF rating, is_closed"),
+                )
+            ],
+            *[
+                f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON recommendation
+                WHEN OLD.is_closed
+                BEGIN
+                    UPDATE pair_stats SET
+                        count = count - 1,
+                        total = total - OLD.rating,
+                        max_rating = (
+                            SELECT MAX(rating) FROM recommendation
+                            WHERE rater_id = OLD.rater_id AND suggester_id = OLD.suggester_id AND is_closed
+                        ),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE rater_id = OLD.rater_id AND suggester_id = OLD.suggester_id;
+                    DELETE FROM pair_stats
+                    WHERE rater_id = OLD.rater_id AND suggester_id = OLD.suggester_id AND count <= 0;
+                    UPDATE suggester_stats SET
+                        count = count - 1,
+                        total = total - OLD.rating,
+                        max_rating = (SELECT MAX(max_rating) FROM pair_stats WHERE suggester_id = OLD.suggester_id),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE suggester_id = OLD.suggester_id;
+                    DELETE FROM suggester_stats
+                    WHERE suggester_id = OLD.suggester_id AND count <= 0;
+                END;
+                '''
+                for name, event in (
+                    ("rec_stats_delete", "DELETE"),
+                    ("rec_stats_update_remove", "UPDATE OF rating, is_closed"),
+                )
+            ],
+        ]
+    ),
+    Migration(
+        version=4,
+        description="Keyset order in the rater/suggester index for paging through a pair's history",
+        statements=[
+            # get_ratings_page_by_pair seeks to (timestamp, rowid) within each rater/suggester
+            # pair. The rating column is dropped to make room: the per-pair rating aggregates
+            # it covered now come from pair_stats, and the max from idx_rec_suggester.
+            '''
+            DROP INDEX IF EXISTS idx_rec_rater_suggester;
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_rec_rater_suggester
+                ON recommendation(rater_id, suggester_id, is_closed, timestamp);
+            ''',
+        ]
+    ),
+    Migration(
+        version=5,
+        description="Trigram full-text index over songs for fuzzy search",
+        requires=supports_trigram_search,
+        # Kept in sync with `song` by triggers, so _add_song (whose ON CONFLICT DO NOTHING skips
+        # the insert trigger for songs already stored) needs no extra statement
+        statements=[
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS song_search
+                USING fts5(song_name, artist, tokenize = 'trigram');
+            ''',
+            '''
+            INSERT INTO song_search(song_name, artist) SELECT song_name, artist FROM song;
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS song_search_insert AFTER INSERT ON song
+            BEGIN
+                INSERT INTO song_search(song_name, artist) VALUES(NEW.song_name, NEW.artist);
+            END;
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS song_search_delete AFTER DELETE ON song
+            BEGIN
+                DELETE FROM song_search WHERE song_name = OLD.song_name AND artist = OLD.artist;
+            END;
+            ''',
+        ]
+    ),
+    Migration(
+        version=6,
+        description="Document counts of the song_search trigrams",
+        requires=supports_trigram_search,
+        # Lets a fuzzy search leave out trigrams found in most songs, which bm25 gives no weight
+        statements=[
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS song_search_vocab
+                USING fts5vocab(song_search, 'row');
+            ''',
+        ]
+    ),
+]
+
+
+def applied_versions(con: sqlite3.Connection) -> Set[int]:
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY NOT NULL,
+            description text NOT NULL,
+            applied_at text NOT NULL
+        );
+    ''')
+    return {row[0] for row in con.execute('''SELECT version FROM schema_version''')}
+
+
+# Brings the database up to the latest schema, returning the migrations that were applied.
+def migrate(con: sqlite3.Connection) -> List[Migration]:
+    applied = []
+    versions = applied_versions(con)
+    for migration in MIGRATIONS:
+        if migration.version in versions:
+            continue
+        if migration.requires is not None and not migration.requires(con):
+            continue
+        try:
+            con.execute('BEGIN')
+            for statement in migration.statements:
+                con.execute(statement)
+            con.execute(
+                '''INSERT INTO schema_version VALUES(?, ?, ?)''',
+                (migration.version, migration.description, datetime.utcnow().isoformat())
+            )
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        applied.append(migration)
+    return applied
@@ -0,0 +1,30 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+# Hands out one shared instance per key, so parsing many rows that mention the same few users,
+# guilds or songs reuses the same immutable objects instead of allocating new ones.
+# Bounded by `max_size`: past that the oldest entries are dropped (first in, first out, which
+# keeps a hit to a single dict lookup). A dropped key just gets a fresh instance next time.
+# An OrderedDict, since popping the front of a plain dict leaves holes that every later
+# `next(iter(...))` has to walk past, making eviction slower the longer the map stays full.
+class IdentityMap(Generic[K, V]):
+    def __init__(self, factory: Callable[..., V], max_size: int = 16384):
+        self.factory = factory
+        self.max_size = max_size
+        self.instances: "OrderedDict[K, V]" = OrderedDict()
+
+    def get(self, key: K, *args) -> V:
+        instance = self.instances.get(key)
+        if instance is None:
+            instance = self.factory(*args) if args else self.factory(key)
+            if len(self.instances) >= self.max_size:
+                self.instances.popitem(last=False)
+            self.instances[key] = instance
+        return instance
+
+    def clear(self):
+        self.instances.clear()
@@ -44,16 +44,18 @@ class RecommendModal(Modal):
             return
 
         song = Song(name=song_name.casefold(), artist=artist.casefold())
-        thread = await DB.flip_thread(thread=self.thread)
+        # Flipping the thread and opening the rec commit together, or not at all
+        async with DB.transaction():
+            thread = await DB.flip_thread(thread=self.thread)
 
-        rec = Recommendation(
-            song=song,
-            rater=self.thread.next_user,
-            suggester=self.thread.other_user,
-            guild=Guild(inter.guild_id),
-            timestamp=inter.created_at,
-        )
-        await DB.create_open_rec(rec)
+            rec = Recommendation(
+                song=song,
+                rater=self.thread.next_user,
+                suggester=self.thread.other_user,
+                guild=Guild(inter.guild_id),
+                timestamp=inter.created_at,
+            )
+            await DB.create_open_rec(rec)
         
         await inter.response.send_message(
             rec.rater.mention,
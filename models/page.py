@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from models.recommendation import Recommendation
+
+# Keyset position of a recommendation: its (timestamp, rowid)
+Cursor = Tuple[str, int]
+
+# One page of recommendations, newest first, with the cursors needed to fetch the pages
+# either side of it
+@dataclass
+class Page:
+    recs: List[Recommendation]
+    first: Optional[Cursor] = None
+    last: Optional[Cursor] = None
+    has_newer: bool = False
+    has_older: bool = False
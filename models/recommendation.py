@@ -6,7 +6,7 @@ from models.embed import EmbedBuilder, Field
 from models.snowflakes import User, Guild
 from models.song import Song
 
-@dataclass
+@dataclass(slots=True)
 class Recommendation:
     song: Song
     rater: User 
@@ -19,10 +19,10 @@ class Recommendation:
     @classmethod
     def parse_tuple(cls, row: Tuple) -> List["Recommendation"]:
         return cls(
-            song=Song(name=row[0], artist=row[1]),
-            rater=User(discord_id=row[2]),
-            suggester=User(discord_id=row[3]),
-            guild=Guild(discord_id=row[4]),
+            song=Song.of(row[0], row[1]),
+            rater=User.of(row[2]),
+            suggester=User.of(row[3]),
+            guild=Guild.of(row[4]),
             timestamp=row[5],
             rating = row[6],
             is_closed = row[7]
@@ -32,10 +32,10 @@ class Recommendation:
     def parse_tuples(cls, tuples: List[Tuple]) -> List["Recommendation"]:
         return [
             cls(
-                song=Song(name=row[0], artist=row[1]),
-                rater=User(discord_id=row[2]),
-                suggester=User(discord_id=row[3]),
-                guild=Guild(discord_id=row[4]),
+                song=Song.of(row[0], row[1]),
+                rater=User.of(row[2]),
+                suggester=User.of(row[3]),
+                guild=Guild.of(row[4]),
                 timestamp=row[5],
                 rating = row[6],
                 is_closed = row[7]
@@ -1,8 +1,12 @@
 from dataclasses import dataclass
 from typing import List, Tuple
 
+from models.identity import IdentityMap
 
-@dataclass
+
+# Snowflakes are immutable and slotted: they are created for every row the DB returns, and the
+# common ones are shared through the identity maps below (see User.of and Guild.of).
+@dataclass(frozen=True, slots=True)
 class Mentionable:
     discord_id: int
 
@@ -17,16 +21,19 @@ class Mentionable:
             return False
         return self.discord_id == other.discord_id
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class User(Mentionable):
     # Implicitly print a User instance as their ID
     def __repr__(self) -> str:
         return str(self.discord_id)
 
-@dataclass
+    # The shared User for an id
+    @classmethod
+    def of(cls, discord_id: int) -> "User":
+        return _users.get(discord_id)
+
+@dataclass(frozen=True, slots=True)
 class Role(Mentionable):
-    discord_id: int
-    
     @property
     def mention(self) -> str:
         return f"<@&{self.discord_id}>"
@@ -38,14 +45,19 @@ class Role(Mentionable):
             for row in rows
         ]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Guild:
     discord_id: int
 
     def __hash__(self):
         return hash(self.discord_id)
 
-@dataclass
+    # The shared Guild for an id
+    @classmethod
+    def of(cls, discord_id: int) -> "Guild":
+        return _guilds.get(discord_id)
+
+@dataclass(slots=True)
 class Thread:
     thread_id: int
     guild: Guild
@@ -75,10 +87,10 @@ class Thread:
     def parse_tuple(cls, row: Tuple) -> "Thread":
         return cls(
             thread_id=row[0],
-            guild=Guild(row[1]),
-            user1=User(discord_id=row[2]),
-            user2=User(discord_id=row[3]),
-            next_user=User(discord_id=row[4])
+            guild=Guild.of(row[1]),
+            user1=User.of(row[2]),
+            user2=User.of(row[3]),
+            next_user=User.of(row[4])
         )
 
     @classmethod
@@ -86,10 +98,14 @@ class Thread:
         return [
             cls(
                 thread_id=row[0],
-                guild=Guild(row[1]),
-                user1=User(discord_id=row[2]),
-                user2=User(discord_id=row[3]),
-                next_user=User(discord_id=row[4])
+                guild=Guild.of(row[1]),
+                user1=User.of(row[2]),
+                user2=User.of(row[3]),
+                next_user=User.of(row[4])
             )
             for row in tuples
         ]    
+
+
+_users: IdentityMap[int, User] = IdentityMap(User)
+_guilds: IdentityMap[int, Guild] = IdentityMap(Guild, max_size=1024)
@@ -1,7 +1,17 @@
 from dataclasses import dataclass
 
+from models.identity import IdentityMap
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Song:
     name: str
-    artist: str
\ No newline at end of file
+    artist: str
+
+    # The shared Song for a name and artist, as stored
+    @classmethod
+    def of(cls, name: str, artist: str) -> "Song":
+        return _songs.get((name, artist), name, artist)
+
+
+_songs: IdentityMap[tuple, Song] = IdentityMap(Song)
@@ -0,0 +1,74 @@
+from disnake.ui import View, Button, button
+from disnake import ButtonStyle, MessageInteraction, User as disnakeUser
+
+from models.page import Page
+from models.snowflakes import User
+from util import build_table
+from db import DB
+
+# Pages through the history between two users, one page per click. Only the current page is
+# held; each click fetches the next one by its cursor (see DB.get_ratings_page_by_pair).
+class HistoryView(View):
+    headers = "Song", "Artist", "Suggester", "Rater", "Rating"
+    # Keeps a full page within Discord's 2000 character message limit
+    page_size = 8
+    max_column_size = 30
+
+    def __init__(self, author: disnakeUser, other: disnakeUser, page: Page):
+        super().__init__(timeout=300)
+        self.author = author
+        self.other = other
+        self.page = page
+        self.number = 1
+        self._update_buttons()
+
+    @classmethod
+    async def fetch_first(cls, author: disnakeUser, other: disnakeUser) -> "HistoryView":
+        page = await DB.get_ratings_page_by_pair(User(author.id), User(other.id), limit=cls.page_size)
+        if not page.recs:
+            raise ValueError(f"No history found between {author.name} and {other.name}")
+        return cls(author, other, page)
+
+    def render(self) -> str:
+        title = f"History Between {self.author.name} and {self.other.name}"
+        if self.number > 1 or self.page.has_older:
+            title += f" (page {self.number})"
+        names = {self.author.id: self.author.name, self.other.id: self.other.name}
+        data = [
+            (rec.song.name, rec.song.artist, names[rec.suggester.discord_id], names[rec.rater.discord_id], rec.rating)
+            for rec in self.page.recs
+        ]
+        return build_table(title, self.headers, data, max_column_size=self.max_column_size)
+
+    def _update_buttons(self):
+        self.newer.disabled = not self.page.has_newer
+        self.older.disabled = not self.page.has_older
+
+    async def interaction_check(self, inter: MessageInteraction) -> bool:
+        return inter.author.id in (self.author.id, self.other.id)
+
+    async def _turn(self, inter: MessageInteraction, older: bool):
+        page = await DB.get_ratings_page_by_pair(
+            User(self.author.id),
+            User(self.other.id),
+            limit=self.page_size,
+            cursor=self.page.last if older else self.page.first,
+            older=older,
+        )
+        # The history changed under us (e.g. a rec was deleted), so start over from the newest
+        if not page.recs:
+            page = await DB.get_ratings_page_by_pair(User(self.author.id), User(self.other.id), limit=self.page_size)
+            self.number = 1
+        else:
+            self.number += 1 if older else -1
+        self.page = page
+        self._update_buttons()
+        await inter.response.edit_message(content=self.render(), view=self)
+
+    @button(label="Newer", style=ButtonStyle.secondary)
+    async def newer(self, _: Button, inter: MessageInteraction):
+        await self._turn(inter, older=False)
+
+    @button(label="Older", style=ButtonStyle.secondary)
+    async def older(self, _: Button, inter: MessageInteraction):
+        await self._turn(inter, older=True)
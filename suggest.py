@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import time
+from typing import Dict, List, Tuple
+
+import als
+from analytics import Analytics
+from db import DB
+from models.snowflakes import Guild, User
+from models.song import Song
+
+
+# Song suggestions for each rater, from a matrix factorization of everyone's ratings in the
+# guild (see als.py). Training runs in a worker process on a snapshot of the Analytics columns;
+# commands are answered from the last trained model, so they never wait on it. A rater's
+# suggestions are only worked out from the model the first time they are asked for.
+class Suggestions():
+    executor: ProcessPoolExecutor = None
+    # guild_id -> its last trained model, and the Analytics songs its song ids refer to
+    models: Dict[int, als.Model] = {}
+    songs: List[Song] = []
+    # (guild_id, rater_id) -> best suggestions first, as (predicted rating, Song)
+    suggestions: Dict[Tuple[int, int], List[Tuple[float, Song]]] = {}
+    # How many suggestions are worked out per rater
+    top_n: int = 20
+    # Retrain once this many ratings have changed, or after `retrain_every` seconds with any change
+    retrain_after: int = 25
+    retrain_every: float = 6 * 60 * 60
+    trained_generation: int = None
+    trained_at: float = None
+
+    @classmethod
+    def setup(cls) -> None:
+        cls.executor = ProcessPoolExecutor(
+            max_workers=1,
+            # The bot process runs threads (see DB), which do not mix well with fork()
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    @classmethod
+    def close(cls) -> None:
+        if cls.executor is not None:
+            cls.executor.shutdown()
+            cls.executor = None
+
+    @classmethod
+    def is_due(cls) -> bool:
+        if cls.trained_generation is None:
+            return True
+        changed = DB.generation - cls.trained_generation
+        if not changed:
+            return False
+        return changed >= cls.retrain_after or time.monotonic() - cls.trained_at >= cls.retrain_every
+
+    @classmethod
+    async def train(cls) -> None:
+        generation = DB.generation
+        columns = Analytics.select()
+        songs = list(Analytics.songs)
+        if len(columns["rating"]):
+            models = await asyncio.get_running_loop().run_in_executor(cls.executor, als.train, columns)
+        else:
+            models = {}
+        cls.models = models
+        cls.songs = songs
+        cls.suggestions = {}
+        cls.trained_generation = generation
+        cls.trained_at = time.monotonic()
+
+    # Called on a schedule by the Recommend cog
+    @classmethod
+    async def refresh(cls) -> None:
+        if cls.executor is not None and cls.is_due():
+            await cls.train()
+
+    @classmethod
+    def suggest(cls, guild: Guild, rater: User, k: int = 10) -> List[Tuple[float, Song]]:
+        key = (guild.discord_id, rater.discord_id)
+        suggestions = cls.suggestions.get(key)
+        if suggestions is None:
+            suggestions = cls.suggestions[key] = cls._predict(guild.discord_id, rater.discord_id)
+        return suggestions[:k]
+
+    @classmethod
+    def _predict(cls, guild_id: int, rater_id: int) -> List[Tuple[float, Song]]:
+        model = cls.models.get(guild_id)
+        top = model.top(rater_id, cls.top_n) if model is not None else None
+        if top is None:
+            return []
+        song_ids, scores = top
+        return [
+            (min(max(score, 1), 10), cls.songs[song_id])
+            for song_id, score in zip(song_ids.tolist(), scores.tolist())
+            if score != float("-inf")
+        ]
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DB
+
+
+# Points DB at a fresh database file for the test; the test calls DB.setup itself, so it can
+# pick the reader count and group commit window
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(DB, "path", str(tmp_path / "pyrate.db"))
+    yield DB.path
+    DB.close()
@@ -0,0 +1,41 @@
+import asyncio
+import gc
+
+from cache import MissingUser, UserCache
+from loadtest import FakeBot, FakeUser
+
+
+# getch_user fails for deleted accounts, like disnake raising NotFound
+class _Bot(FakeBot):
+    def __init__(self, deleted: set, api_latency: float = 0):
+        super().__init__(api_latency)
+        self.deleted = deleted
+
+    async def getch_user(self, user_id: int) -> FakeUser:
+        user = await super().getch_user(user_id)
+        if user_id in self.deleted:
+            raise LookupError(f"Unknown user {user_id}")
+        return user
+
+
+# Collects what the event loop would log, e.g. "Task exception was never retrieved"
+def _logged(loop: asyncio.AbstractEventLoop) -> list:
+    logged = []
+    loop.set_exception_handler(lambda _, context: logged.append(context["message"]))
+    return logged
+
+
+def test_resolve_with_a_deleted_user():
+    async def main():
+        UserCache.users = None
+        logged = _logged(asyncio.get_running_loop())
+        users = await UserCache.resolve(_Bot(deleted={2}), [1, 2, 3])
+        assert [users[i].name for i in (1, 2, 3)] == ["user1", "Unknown user", "user3"]
+        assert isinstance(users[2], MissingUser)
+        # The placeholder is not cached, so the next lookup fetches again
+        assert 2 not in UserCache.users and 1 in UserCache.users
+        gc.collect()
+        assert logged == []
+
+    asyncio.run(main())
+
@@ -0,0 +1,155 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from db import DB
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, User
+from models.song import Song
+
+
+# A read awaited while iterating must not wait on the iterator: with a single reader thread,
+# holding it between chunks deadlocked as soon as the rows ran past the first chunk
+def test_nested_read_while_iterating(db_path):
+    async def main():
+        DB.setup(readers=1)
+        await DB._write(lambda cur: cur.executemany(
+            '''INSERT INTO recommendation VALUES(?, 'Artist', 10, 11, 1, '2024-01-01 00:00:00', 5, 1)''',
+            [(f"Song {i}",) for i in range(600)],
+        ))
+        seen = 0
+        async for rec in DB.iter_ratings_by_rater(User(10)):
+            seen += 1
+            if seen % 100 == 0:
+                assert len(await DB.get_ratings_by_song(rec.song)) == 1
+        return seen
+
+    assert asyncio.run(asyncio.wait_for(main(), 30)) == 600
+
+
+# Streams reuse their connection once done with it, including one left after a single chunk
+def test_iterate_reuses_its_connection(db_path):
+    async def main():
+        DB.setup()
+        await DB._write(lambda cur: cur.executemany(
+            '''INSERT INTO user VALUES(?)''', [(i,) for i in range(10)]
+        ))
+        stream = DB._iterate('''SELECT * FROM user''', size=4)
+        assert len(await stream.__anext__()) == 4
+        await stream.aclose()
+        assert len(DB._idle_streams) == 1
+        con = DB._idle_streams[0]
+        rows = [row async for chunk in DB._iterate('''SELECT * FROM user''', size=4) for row in chunk]
+        assert len(rows) == 10
+        assert DB._idle_streams == [con]
+
+    asyncio.run(main())
+
+
+# Closing with a group commit still pending commits it and releases whoever is waiting on it
+def test_close_flushes_group_commit(db_path):
+    async def main():
+        DB.setup(group_commit_ms=60_000)
+        rec = Recommendation(
+            Song("Song", "Artist"), rater=User(10), suggester=User(11), guild=Guild(1),
+            timestamp=datetime(2024, 1, 1), rating=5, is_closed=True,
+        )
+        write = asyncio.ensure_future(DB.add_rating_manual(rec))
+        await asyncio.sleep(0.1)
+        assert not write.done()
+        DB.close()
+        await asyncio.wait_for(write, 5)
+
+    asyncio.run(main())
+    con = sqlite3.connect(db_path)
+    try:
+        assert con.execute('''SELECT COUNT(*) FROM recommendation''').fetchone() == (1,)
+    finally:
+        con.close()
+
+
+# Songs other users rated that fit the search better must not crowd out the pair's own song
+def test_fuzzy_search_ranks_only_the_pairs_songs(db_path, monkeypatch):
+    # Small as the pair is, search it through the trigram index
+    monkeypatch.setattr(DB, "fuzzy_scan_limit", 0)
+
+    async def main():
+        DB.setup()
+        if not DB.trigram_search:
+            pytest.skip("SQLite lacks FTS5 trigram support")
+        songs = [("Hello World Remastered Edition", "Band", 10)]
+        songs += [(f"Hello Wrld {i}", "Band", 12) for i in range(550)]
+        songs += [(f"Filler {i}", f"Other {i}", 12) for i in range(700)]
+        def work(cur):
+            cur.executemany('''INSERT INTO song VALUES(?, ?)''', [song[:2] for song in songs])
+            cur.executemany(
+                '''INSERT INTO recommendation VALUES(?, ?, ?, 11, 1, '2024-01-01 00:00:00', 5, 1)''', songs
+            )
+        await DB._write(work)
+        matches = await DB.search_ratings_by_song_and_pair(Song("Hello Wrld", "Band"), User(10), User(11))
+        assert [rec.song.name for _, rec in matches] == ["Hello World Remastered Edition"]
+
+    asyncio.run(main())
+
+
+# Paging back and forth through a pair's history, both directions of it, with tied timestamps
+def test_ratings_pages_by_pair(db_path):
+    a, b = User(10), User(11)
+
+    async def main():
+        DB.setup()
+        rows = [
+            (f"Song {i}", 10 + i % 2, 11 - i % 2, f"2024-01-{1 + i // 3:02} 00:00:00")
+            for i in range(40)
+        ]
+        rows.append(("Elsewhere", 10, 12, "2024-01-05 00:00:00"))
+        await DB._write(lambda cur: cur.executemany(
+            '''INSERT INTO recommendation VALUES(?, 'Artist', ?, ?, 1, ?, 5, 1)''', rows
+        ))
+        expected = [row[0] for row in await DB._fetchall('''
+            SELECT song_name FROM recommendation WHERE suggester_id IN (10, 11)
+            ORDER BY timestamp DESC, rowid DESC
+        ''')]
+        pages = [await DB.get_ratings_page_by_pair(a, b)]
+        while pages[-1].has_older:
+            pages.append(await DB.get_ratings_page_by_pair(a, b, cursor=pages[-1].last))
+        assert [rec.song.name for page in pages for rec in page.recs] == expected
+        assert [len(page.recs) for page in pages] == [8] * 5
+        assert not pages[0].has_newer
+        for newer, page in zip(pages, pages[1:]):
+            back = await DB.get_ratings_page_by_pair(a, b, cursor=page.first, older=False)
+            assert back.recs == newer.recs
+            assert back.has_newer == (newer is not pages[0])
+
+    asyncio.run(main())
+    con = sqlite3.connect(db_path)
+    try:
+        assert [row[2] for row in con.execute('''PRAGMA index_info(idx_rec_rater_suggester)''')] == [
+            "rater_id", "suggester_id", "is_closed", "timestamp"
+        ]
+        assert "idx_rec_pair_timestamp" not in {row[1] for row in con.execute('''PRAGMA index_list(recommendation)''')}
+    finally:
+        con.close()
+
+
+# Only closed recs count: an open rec (rating -1) is never anyone's best
+def test_max_rating_ignores_open_recs(db_path):
+    async def main():
+        DB.setup()
+        guild, rater, suggester = Guild(1), User(10), User(11)
+        await DB.create_open_rec(Recommendation(
+            Song("Song A", "Artist"), rater=rater, suggester=suggester, guild=guild, timestamp=datetime(2024, 1, 1),
+        ))
+        assert await DB.get_max_rating(suggester) == []
+        assert await DB.get_max_rating(suggester, rater) == []
+        await DB.add_rating_manual(Recommendation(
+            Song("Song B", "Artist"), rater=rater, suggester=suggester, guild=guild,
+            timestamp=datetime(2024, 1, 2), rating=6, is_closed=True,
+        ))
+        assert [rec.song.name for rec in await DB.get_max_rating(suggester)] == ["Song B"]
+        assert [rec.song.name for rec in await DB.get_max_rating(suggester, rater)] == ["Song B"]
+        assert [rec.song.name for rec in await DB.get_max_ratings()] == ["Song B"]
+
+    asyncio.run(main())
@@ -0,0 +1,19 @@
+from leaderboard import Leaderboard
+from models.snowflakes import Guild, User
+
+GUILD = Guild(1)
+RATER, SUGGESTER = User(10), User(11)
+
+
+# Removing a rating that was never added must not leave a negative tally behind
+def test_removing_an_untallied_rating_is_ignored():
+    Leaderboard.load([])
+    Leaderboard.remove(GUILD, RATER, SUGGESTER, 5)
+    assert not any(Leaderboard.tallies.values())
+    assert not any(Leaderboard.boards.values())
+
+    Leaderboard.add(GUILD, RATER, SUGGESTER, 7)
+    Leaderboard.remove(GUILD, RATER, SUGGESTER, 5)
+    for metric in ("total", "average", "max"):
+        assert Leaderboard.top(metric) == [(7, SUGGESTER)]
+        assert Leaderboard.top(metric, guild=GUILD, rater=RATER) == [(7, SUGGESTER)]
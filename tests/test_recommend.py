@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+from cogs.recommend import rec_rerate
+from db import DB
+from loadtest import FakeGuild, FakeInteraction, FakeThreadChannel, FakeUser
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, Thread, User
+from models.song import Song
+
+GUILD = Guild(1)
+RATER, SUGGESTER = User(10), User(11)
+
+
+async def _rated_thread() -> FakeThreadChannel:
+    await DB.create_thread(Thread(thread_id=100, guild=GUILD, user1=RATER, user2=SUGGESTER, next_user=RATER))
+    await DB.add_rating_manual(Recommendation(
+        Song("Song A", "Artist"), rater=RATER, suggester=SUGGESTER, guild=GUILD,
+        timestamp=datetime(2024, 1, 1), rating=5, is_closed=True,
+    ))
+    return FakeThreadChannel(100)
+
+
+def _inter(channel: FakeThreadChannel) -> FakeInteraction:
+    return FakeInteraction(author=FakeUser(RATER.discord_id), guild=FakeGuild(GUILD.discord_id), channel=channel)
+
+
+async def _ratings(song: Song):
+    return [rec.rating for rec in await DB.get_ratings_by_song_and_pair(song, RATER, SUGGESTER)]
+
+
+# A near miss is only ever offered back: "Song B" must not rerate "Song A" by the same artist
+def test_rerate_suggests_instead_of_writing_a_fuzzy_match(db_path):
+    async def main():
+        DB.setup()
+        inter = _inter(await _rated_thread())
+        await rec_rerate(inter, "Song B", "Artist", 9)
+        (_, args, kwargs), = inter.response.sent
+        assert "Did you mean: Song A by Artist?" in args[0]
+        assert kwargs["ephemeral"]
+        assert await _ratings(Song("Song A", "Artist")) == [5]
+
+    asyncio.run(main())
+
+
+def test_rerate_exact_match(db_path):
+    async def main():
+        DB.setup()
+        inter = _inter(await _rated_thread())
+        await rec_rerate(inter, "Song A", "Artist", 9)
+        assert "re-rated **9/10**" in inter.response.sent[0][1][0]
+        assert await _ratings(Song("Song A", "Artist")) == [9]
+
+    asyncio.run(main())
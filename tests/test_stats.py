@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime
+
+from cogs.stats import Stats
+from db import DB
+from loadtest import FakeBot, FakeGuild, FakeInteraction, FakeThreadChannel, FakeUser
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, User
+from models.song import Song
+
+GUILD = Guild(1)
+
+
+async def _compatibility(other: int):
+    inter = FakeInteraction(author=FakeUser(10), guild=FakeGuild(GUILD.discord_id), channel=FakeThreadChannel(100))
+    stats = Stats(FakeBot(api_latency=0))
+    await stats.stats_compatibility.callback(stats, inter, FakeUser(other))
+    (_, args, kwargs), = inter.response.sent
+    return args[0], kwargs
+
+
+async def _rate(rater: int, song: str, rating: float):
+    await DB.add_rating_manual(Recommendation(
+        Song(song, "Artist"), rater=User(rater), suggester=User(99), guild=GUILD,
+        timestamp=datetime(2024, 1, 1), rating=rating, is_closed=True,
+    ))
+
+
+def test_compatibility_with_no_songs_in_common(db_path):
+    async def main():
+        DB.setup()
+        await _rate(10, "Song A", 5)
+        await _rate(11, "Song B", 5)
+        message, kwargs = await _compatibility(11)
+        assert message == "You and user11 have no songs in common yet."
+        assert kwargs["ephemeral"]
+
+    asyncio.run(main())
+
+
+# Cosine has no value when one side's shared ratings are all zero
+def test_compatibility_without_a_cosine(db_path):
+    async def main():
+        DB.setup()
+        for song in ("Song A", "Song B"):
+            await _rate(10, song, 0)
+            await _rate(11, song, 7)
+        message, _ = await _compatibility(11)
+        assert message == "You and user11 have rated 2 of the same songs, which is not enough to compare tastes"
+
+    asyncio.run(main())
+
+
+# The max board comes from the Leaderboard, with the song behind each suggester's best rating
+def test_leaderboard_max(db_path):
+    async def main():
+        DB.setup()
+        for rater, suggester, song, rating in (
+            (10, 98, "Song A", 4), (10, 98, "Song B", 8), (11, 99, "Song C", 9), (10, 99, "Song D", 6),
+        ):
+            await DB.add_rating_manual(Recommendation(
+                Song(song, "Artist"), rater=User(rater), suggester=User(suggester), guild=GUILD,
+                timestamp=datetime(2024, 1, 1), rating=rating, is_closed=True,
+            ))
+        stats = Stats(FakeBot(api_latency=0))
+        for rater, songs in ((None, ["Song C", "Song B"]), (FakeUser(10), ["Song B", "Song D"])):
+            inter = FakeInteraction(author=FakeUser(10), guild=FakeGuild(GUILD.discord_id), channel=FakeThreadChannel(100))
+            await stats.leaderboard_max.callback(stats, inter, rater)
+            (_, (table,), _), = inter.response.sent
+            cells = [line.split("|")[1].strip() for line in table.splitlines() if "|" in line]
+            assert [cell for cell in cells if cell.startswith("Song ")] == songs
+
+    asyncio.run(main())
+
+
+# /stats max, average and total read the same Analytics rows, narrowed to a rater if given
+def test_stats_from_analytics(db_path):
+    async def main():
+        DB.setup()
+        await _rate(10, "Song A", 6)
+        await _rate(10, "Song B", 8)
+        await _rate(11, "Song C", 8)
+        stats = Stats(FakeBot(api_latency=0))
+
+        async def run(command, rater=None):
+            inter = FakeInteraction(author=FakeUser(99), guild=FakeGuild(GUILD.discord_id), channel=FakeThreadChannel(100))
+            await command.callback(stats, inter, rater)
+            (_, (message,), _), = inter.response.sent
+            return message
+
+        def rows(table):
+            cells = [[cell.strip() for cell in line.split("|")[1:-1]] for line in table.splitlines()]
+            return [row for row in cells if len(row) == 4 and row[0] != "Song"]
+
+        assert rows(await run(stats.stats_max)) == [["Song B", "Artist", "user10", "8"], ["Song C", "Artist", "user11", "8"]]
+        assert rows(await run(stats.stats_max, FakeUser(10))) == [["Song B", "Artist", "user10", "8"]]
+        assert "**7.3**" in await run(stats.stats_average)
+        assert "**7.0**" in await run(stats.stats_average, FakeUser(10))
+        assert "**22.0**" in await run(stats.stats_total)
+        assert "**8.0**" in await run(stats.stats_total, FakeUser(11))
+        assert await run(stats.stats_total, FakeUser(12)) == "Error: No data found for given query"
+
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+import asyncio
+import random
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import Analytics
+from cache import OpenRecCache, SongIndex
+from compatibility import Compatibility
+from db import DB
+from leaderboard import Leaderboard
+from models.recommendation import Recommendation
+from models.snowflakes import Guild, User
+from models.song import Song
+
+# Few enough users and songs that random operations keep colliding: the same song rated by
+# several raters, the same pair rating several songs, and names differing only in case
+GUILDS = [Guild(1), Guild(2)]
+USERS = [User(10), User(11), User(12), User(13)]
+SONGS = [Song("Song A", "Artist"), Song("song a", "artist"), Song("Song B", "Artist"), Song("Other", "Band")]
+
+
+# Each in-memory view, reduced to what a fresh load and a stream of updates must agree on:
+# empty leftovers (boards, counters, pairs with no songs in common) are dropped, and songs
+# are compared by their case-folded key, since a view keeps whichever spelling it saw first
+def _song_index():
+    views = {}
+    for name, index in (("guild", SongIndex.guilds), ("pair", SongIndex.pairs)):
+        for key, prefixes in index.items():
+            assert prefixes.keys == sorted(prefixes.counts) == sorted(prefixes.display)
+            if prefixes.counts:
+                views[(name, *key)] = dict(prefixes.counts)
+    return views
+
+
+def _compatibility():
+    ratings = {
+        (guild_id, rater_id, song): +counts
+        for guild_id, raters in Compatibility.ratings.items()
+        for rater_id, rated in raters.items()
+        for song, counts in rated.items()
+        if +counts
+    }
+    songs = {
+        (guild_id, song, rater_id): best
+        for guild_id, by_song in Compatibility.songs.items()
+        for song, raters in by_song.items()
+        for rater_id, best in raters.items()
+    }
+    pairs = {}
+    for guild_id, by_rater in Compatibility.pairs.items():
+        for a, others in by_rater.items():
+            for b, sums in others.items():
+                assert Compatibility.pairs[guild_id][b][a] is sums
+                if a < b and sums.n:
+                    pairs[(guild_id, a, b)] = (sums.n, sums.a, sums.b, sums.aa, sums.bb, sums.ab)
+    return ratings, songs, pairs
+
+
+def _analytics():
+    live = Analytics.select()
+    rows = Counter(
+        (guild, rater, suggester, Analytics.songs[song].name.casefold(), Analytics.songs[song].artist.casefold(), rating, epoch)
+        for guild, rater, suggester, song, rating, epoch in zip(
+            *(live[name].tolist() for name in ("guild", "rater", "suggester", "song", "rating", "epoch"))
+        )
+    )
+    indexed = [i for indexes in Analytics.rows.values() for i in indexes]
+    assert len(indexed) == len(set(indexed)) == sum(rows.values())
+    assert all(Analytics.live[i] for i in indexed)
+    return rows
+
+
+def _leaderboard():
+    return {key: board for key, board in Leaderboard.boards.items() if board}
+
+
+def _open_recs():
+    return {key: (rec.song, rec.guild) for key, rec in OpenRecCache.recs.items()}
+
+
+def _views():
+    return {
+        "song index": _song_index(),
+        "compatibility": _compatibility(),
+        "analytics": _analytics(),
+        "leaderboard": _leaderboard(),
+        "open recs": _open_recs(),
+    }
+
+
+# pair_stats and suggester_stats against the same aggregates computed from recommendation
+def _check_stats(path: str):
+    con = sqlite3.connect(path)
+    try:
+        assert sorted(con.execute('''
+            SELECT rater_id, suggester_id, count, total, max_rating FROM pair_stats
+        ''')) == sorted(con.execute('''
+            SELECT rater_id, suggester_id, COUNT(*), SUM(rating), MAX(rating) FROM recommendation
+                WHERE is_closed
+                GROUP BY rater_id, suggester_id
+        '''))
+        assert sorted(con.execute('''
+            SELECT suggester_id, count, total, max_rating FROM suggester_stats
+        ''')) == sorted(con.execute('''
+            SELECT suggester_id, COUNT(*), SUM(rating), MAX(rating) FROM recommendation
+                WHERE is_closed
+                GROUP BY suggester_id
+        '''))
+    finally:
+        con.close()
+
+
+class _Rollback(Exception):
+    pass
+
+
+# One random add, close, rerate, delete or rolled back write, going through DB the way the cogs do
+async def _step(rng: random.Random, now: datetime):
+    recs = Recommendation.parse_tuples(await DB.debug_fetch_db("recommendation"))
+    closed = [rec for rec in recs if rec.is_closed]
+    rater, suggester = rng.sample(USERS, 2)
+    rec = Recommendation(
+        rng.choice(SONGS), rater=rater, suggester=suggester, guild=rng.choice(GUILDS),
+        timestamp=now + timedelta(minutes=rng.randrange(10_000)),
+    )
+    match rng.choice(("add", "open", "close", "rerate", "delete", "rollback")):
+        case "add":
+            rec.rating, rec.is_closed = rng.randint(1, 10), True
+            try:
+                await DB.add_rating_manual(rec)
+            except ValueError:
+                pass
+        case "open":
+            if OpenRecCache.fetch(rater, suggester) is None:
+                await DB.create_open_rec(rec)
+        case "close":
+            if OpenRecCache.recs:
+                rec = rng.choice(list(OpenRecCache.recs.values()))
+                rec.rating = rng.randint(1, 10)
+                await DB.close_rec(rec)
+        case "rerate":
+            if closed:
+                rec = rng.choice(closed)
+                rec.rating = rng.randint(1, 10)
+                await DB._close_rec(rec)
+        case "delete":
+            if recs:
+                await DB._delete_rec(rng.choice(recs))
+        case "rollback":
+            rec.rating, rec.is_closed = rng.randint(1, 10), True
+            try:
+                async with DB.transaction():
+                    await DB.add_rating_manual(rec)
+                    if closed:
+                        await DB._delete_rec(rng.choice(closed))
+                    raise _Rollback()
+            except (_Rollback, ValueError):
+                pass
+
+
+@pytest.mark.parametrize("group_commit_ms", [None, 2])
+@pytest.mark.parametrize("seed", range(3))
+def test_views_match_a_fresh_load(db_path, seed, group_commit_ms):
+    async def main():
+        DB.setup(group_commit_ms=group_commit_ms)
+        rng = random.Random(seed)
+        now = datetime(2024, 1, 1)
+        for step in range(300):
+            await _step(rng, now)
+            if step % 50 == 49:
+                live = _views()
+                DB.close()
+                DB.setup(group_commit_ms=group_commit_ms)
+                assert live == _views()
+                _check_stats(db_path)
+        assert Analytics.select()["rating"].size
+
+    asyncio.run(main())
@@ -2,7 +2,7 @@ from __future__ import annotations
 import os
 
 from dotenv import dotenv_values
-from typing import Union
+from typing import Iterable, Iterator, Union
 
 from disnake import ApplicationCommandInteraction, ModalInteraction
 from db import DB
@@ -38,65 +38,99 @@ async def validate_request_recommender(inter: Interaction, thread: Thread):
     if author == thread.next_user:
         raise ValueError("You're not the active recommender")
 
-def build_table(title, headers : list[str], data : list[list], min_total_size = 30, max_column_size = 50):
-    if len(headers) != len(data[0]):
-        raise ValueError("Headers and data do not match")
+def _widen(column_sizes: list[int], row):
+    for i in range(len(row)):
+        if len(str(row[i])) > column_sizes[i]:
+            column_sizes[i] = len(str(row[i]))
+
+def _fit_columns(title, widths: list[int], min_total_size, max_column_size) -> list[int]:
     if min_total_size < len(title):
         min_total_size = len(title) + 2
-    #calculate column sizes
-    column_sizes = []
-    for header in headers:
-        column_sizes.append(len(header))
-    for row in data:
-        #print("row: %s" % row)
-        for i in range(len(row)):
-            if len( str(row[i])) > column_sizes[i]:
-                column_sizes[i] = len(str(row[i]))
-    for i in range(len(column_sizes)):
-        if column_sizes[i] > max_column_size:
-            column_sizes[i] = max_column_size
-    #print(column_sizes)
-
+    column_sizes = [min(width, max_column_size) for width in widths]
     total_size = int(sum(column_sizes) + len(column_sizes) - 1)
     while total_size < min_total_size:
         for i in range(len(column_sizes)):
             column_sizes[i]+=1
         total_size = int(sum(column_sizes) + len(column_sizes) - 1)
-
-    ret = "```\n"
-    ret += '-'* (total_size+2) + '\n'
+    return column_sizes
+
+# Length of a rendered table: the fences, rules, title and header take 4 lines' worth of
+# `total_size`, and every row is one more line of `total_size + 4` characters
+def _table_length(column_sizes: list[int], row_count: int) -> int:
+    total_size = sum(column_sizes) + len(column_sizes) - 1
+    return 4 * total_size + 21 + row_count * (total_size + 4)
+
+def _render_line(cells, column_sizes: list[int], parts: list[str]):
+    for datum, column_size in zip(cells, column_sizes):
+        datum = str(datum)
+        if len(datum) > column_size:
+            datum = datum[:column_size - 3] + "..."
+        right_pad = int(column_size - len(datum))//2
+        left_pad = int(column_size - len(datum) - right_pad)
+        parts.append('|' + ' '*left_pad + datum + ' '*right_pad)
+    parts.append("|\n\n")
+
+# Builds the table as a list of parts joined once, so rendering is linear in the output size
+def _render_table(title, headers, rows, column_sizes: list[int]) -> str:
+    total_size = int(sum(column_sizes) + len(column_sizes) - 1)
+    parts = ["```\n", '-'* (total_size+2) + '\n']
     right_pad = int(total_size - len(title))//2
     left_pad = int(total_size - len(title) - right_pad)
-    #print("Total size: %d Right pad: %d Left pad: %d" % (total_size, right_pad, left_pad))
-    ret += '|'+' '*left_pad + title + ' '*right_pad + '|\n\n'
-    #ret += '|'+' '*total_size+"|\n"
-    for i in range(len(headers)):
-        header = headers[i]
-        column_size = column_sizes[i]
-
-        if len(header) > column_size:
-            header = header[:column_size - 3] + "..."
-
-        right_pad = int(column_size - len(header))//2
-        left_pad = int(column_size - len(header) - right_pad)
-        ret += '|' + ' '*left_pad + header + ' '*right_pad
-    ret += "|\n\n"
-    for row in data:
-        for i in range(len(row)):
-            datum = str(row[i])
-            column_size = column_sizes[i]
-
-            if len(datum) > column_size:
-                datum = datum[:column_size - 3] + "..."
+    parts.append('|'+' '*left_pad + title + ' '*right_pad + '|\n\n')
+    _render_line(headers, column_sizes, parts)
+    for row in rows:
+        _render_line(row, column_sizes, parts)
+    parts.append('-'* (total_size+2) + '\n')
+    parts.append("```")
+    return "".join(parts)
 
-            right_pad = int(column_size - len(datum))//2
-            left_pad = int(column_size - len(datum) - right_pad)
-            ret += '|' + ' '*left_pad + datum + ' '*right_pad
-        ret += "|\n\n"
-    ret += '-'* (total_size+2) + '\n'
-    ret += "```"
-
-    return(ret)
+def build_table(title, headers : list[str], data : list[list], min_total_size = 30, max_column_size = 50):
+    if len(headers) != len(data[0]):
+        raise ValueError("Headers and data do not match")
+    widths = [len(header) for header in headers]
+    for row in data:
+        _widen(widths, row)
+    column_sizes = _fit_columns(title, widths, min_total_size, max_column_size)
+    return _render_table(title, headers, data, column_sizes)
+
+# Lazily splits a table into pages of at most `max_length` characters (Discord's message
+# limit), pulling rows from `rows` as it goes. Each page is sized to its own rows, and pages
+# after the first are titled "(cont.)".
+def build_table_pages(
+    title,
+    headers : list[str],
+    rows : Iterable,
+    min_total_size = 30,
+    max_column_size = 50,
+    max_length = 2000,
+) -> Iterator[str]:
+    page_title = title
+    page: list = []
+    widths = [len(header) for header in headers]
+    for row in rows:
+        if len(headers) != len(row):
+            raise ValueError("Headers and data do not match")
+        new_widths = list(widths)
+        _widen(new_widths, row)
+        sizes = _fit_columns(page_title, new_widths, min_total_size, max_column_size)
+        if page and _table_length(sizes, len(page) + 1) > max_length:
+            yield _render_table(page_title, headers, page, _fit_columns(page_title, widths, min_total_size, max_column_size))
+            page_title = f"{title} (cont.)"
+            page = []
+            new_widths = [len(header) for header in headers]
+            _widen(new_widths, row)
+        page.append(row)
+        widths = new_widths
+    if not page:
+        raise ValueError("No data to display")
+    yield _render_table(page_title, headers, page, _fit_columns(page_title, widths, min_total_size, max_column_size))
+
+# Sends the first page as the interaction response and the rest as follow-ups
+async def send_pages(inter: Interaction, pages: Iterable[str]):
+    pages = iter(pages)
+    await inter.response.send_message(next(pages))
+    for page in pages:
+        await inter.followup.send(page)
     
 if __name__ == "__main__":
     head = "col1", "test col2", "Column with length!"